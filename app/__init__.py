@@ -0,0 +1,4 @@
+import time
+
+# First import of the package, where app/warmup.py starts a worker's startup clock.
+IMPORTED_AT = time.monotonic()
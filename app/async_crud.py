@@ -0,0 +1,313 @@
+# Async mirror of app/crud.py on top of aiomysql, selected with DB_DRIVER=async.
+# Functions keep the same names, arguments and return values as their sync
+# counterparts so app/dal.py can dispatch to either.
+import json
+
+from aiomysql import Connection, DictCursor
+from pymysql.err import IntegrityError
+
+from app.consts import Status
+from app import schemas
+from app.crud import (
+    build_debit, build_idempotent_response, build_records_query, build_records_insert, build_usage_upsert,
+    check_request_hash, debited_balance, plan_charged_records
+)
+from app.metrics import run_in_threadpool, timed_query
+from app.replicas import reads, reads_primary, writes
+
+
+@reads_primary
+@timed_query
+async def get_user_by_username(connection: Connection, username: str) -> dict:
+    async with connection.cursor(DictCursor) as cursor:
+        await cursor.execute("SELECT * FROM users WHERE username = %s", (username,))
+        return await cursor.fetchone()
+
+
+@reads
+@timed_query
+async def get_user_by_id(connection: Connection, user_id: int) -> dict:
+    async with connection.cursor(DictCursor) as cursor:
+        await cursor.execute("SELECT id, username, balance, status FROM users WHERE id = %s", (user_id,))
+        return await cursor.fetchone()
+
+
+@writes
+@timed_query
+async def create_user(connection: Connection, user: schemas.UserCreate, hashed_password: str, status: Status) -> dict:
+    async with connection.cursor() as cursor:
+        await cursor.execute(
+            "INSERT INTO users (username, hashed_password, status) VALUES (%s, %s, %s)",
+            (user.username, hashed_password, status.value)
+        )
+    await connection.commit()
+    return await get_user_by_username(connection, user.username)
+
+
+@writes
+@timed_query
+async def update_user_password_hash(connection: Connection, user_id: int, hashed_password: str) -> None:
+    async with connection.cursor() as cursor:
+        await cursor.execute("UPDATE users SET hashed_password = %s WHERE id = %s", (hashed_password, user_id))
+    await connection.commit()
+
+
+@reads
+@timed_query
+async def get_operations(connection: Connection, skip: int = 0, limit: int = 10) -> list:
+    async with connection.cursor(DictCursor) as cursor:
+        await cursor.execute("SELECT * FROM operations LIMIT %s OFFSET %s", (limit, skip))
+        return await cursor.fetchall()
+
+
+@reads
+@timed_query
+async def get_all_operations(connection: Connection) -> list:
+    async with connection.cursor(DictCursor) as cursor:
+        await cursor.execute("SELECT id, type, cost FROM operations ORDER BY id")
+        return await cursor.fetchall()
+
+
+@writes
+@timed_query
+async def create_operation(connection: Connection, operation: schemas.OperationCreate) -> int:
+    async with connection.cursor() as cursor:
+        await cursor.execute("INSERT INTO operations (type, cost) VALUES (%s, %s)", (operation.type, operation.cost))
+        await connection.commit()
+        return cursor.lastrowid
+
+
+@writes
+@timed_query
+async def create_record(connection: Connection, record: schemas.RecordCreate) -> int:
+    async with connection.cursor() as cursor:
+        await cursor.execute(
+            "INSERT INTO records (operation_id, user_id, amount,"
+            " user_balance, operation_response) VALUES (%s, %s, %s, %s, %s)",
+            (record.operation_id, record.user_id, record.amount, record.user_balance, record.operation_response)
+        )
+        record_id = cursor.lastrowid
+        await cursor.execute(*build_usage_upsert(record.user_id, [record.dict()]))
+        await connection.commit()
+        return record_id
+
+
+@writes
+@timed_query
+async def create_charged_record(
+    connection: Connection, user_id: int, operation_id: int, amount: float, operation_response: str,
+    idempotency_key: str = None
+) -> dict:
+    async with connection.cursor() as cursor:
+        try:
+            await cursor.execute(*build_debit(user_id, amount))
+            user_balance = debited_balance(cursor.lastrowid)
+            if user_balance is None:
+                await connection.rollback()
+                return None
+            await cursor.execute(
+                "INSERT INTO records (operation_id, user_id, amount,"
+                " user_balance, operation_response) VALUES (%s, %s, %s, %s, %s)",
+                (operation_id, user_id, amount, user_balance, operation_response)
+            )
+            record = {
+                "id": cursor.lastrowid,
+                "operation_id": operation_id,
+                "user_id": user_id,
+                "amount": amount,
+                "user_balance": user_balance,
+                "operation_response": operation_response,
+                "deleted": False,
+            }
+            await cursor.execute(*build_usage_upsert(user_id, [record]))
+            if idempotency_key is not None:
+                await cursor.execute(*build_idempotent_response(user_id, idempotency_key, record))
+            await connection.commit()
+        except Exception:
+            await connection.rollback()
+            raise
+    return record
+
+
+@writes
+@timed_query
+async def create_charged_records(connection: Connection, user_id: int, items: list) -> list:
+    total = sum(amount for _, amount, _ in items)
+    async with connection.cursor() as cursor:
+        try:
+            await cursor.execute(*build_debit(user_id, total))
+            balance = debited_balance(cursor.lastrowid)
+            if balance is None:
+                await connection.rollback()
+                return None
+            records = plan_charged_records(user_id, items, balance)
+            await cursor.execute(*build_records_insert(records))
+            await cursor.execute(
+                "SELECT id FROM records WHERE user_id = %s AND id >= %s ORDER BY id LIMIT %s",
+                (user_id, cursor.lastrowid, len(records))
+            )
+            for record, (record_id,) in zip(records, await cursor.fetchall()):
+                record["id"] = record_id
+            await cursor.execute(*build_usage_upsert(user_id, records))
+            await connection.commit()
+        except Exception:
+            await connection.rollback()
+            raise
+    return records
+
+
+@writes
+@timed_query
+async def charge_records(
+    connection: Connection, user_id: int, items: list, ids: list = None, idempotency_key: str = None,
+    journal=None
+) -> list:
+    total = sum(amount for _, amount, _ in items)
+    logged = False
+    async with connection.cursor() as cursor:
+        try:
+            await cursor.execute(*build_debit(user_id, total))
+            balance = debited_balance(cursor.lastrowid)
+            if balance is None:
+                await connection.rollback()
+                return None
+            records = plan_charged_records(user_id, items, balance)
+            for record, record_id in zip(records, ids or ()):
+                record["id"] = record_id
+            await cursor.execute(*build_usage_upsert(user_id, records))
+            if idempotency_key is not None:
+                await cursor.execute(*build_idempotent_response(user_id, idempotency_key, records[0]))
+            if journal is not None:
+                # The log append (and fsync) stays off the event loop.
+                records = await run_in_threadpool(journal.prepare, records)
+                logged = True
+            await connection.commit()
+        except Exception:
+            await connection.rollback()
+            if logged:
+                await run_in_threadpool(journal.abort, records)
+            raise
+    if journal is not None:
+        journal.confirm(records)
+    return records
+
+
+@writes
+@timed_query
+async def claim_idempotency_key(
+    connection: Connection, user_id: int, key: str, ttl: int, request_hash: str = None
+) -> dict:
+    async with connection.cursor() as cursor:
+        while True:
+            try:
+                await cursor.execute(
+                    "INSERT INTO idempotency_keys (user_id, idempotency_key, request_hash) VALUES (%s, %s, %s)",
+                    (user_id, key, request_hash)
+                )
+                return None
+            except IntegrityError:
+                pass
+            await cursor.execute(
+                "SELECT response, created_at >= NOW() - INTERVAL %s SECOND, request_hash FROM idempotency_keys"
+                " WHERE user_id = %s AND idempotency_key = %s LOCK IN SHARE MODE",
+                (ttl, user_id, key)
+            )
+            row = await cursor.fetchone()
+            if row is None:
+                continue
+            response, live, stored_hash = row
+            if live and response is not None:
+                await connection.rollback()
+                check_request_hash(stored_hash, request_hash)
+                return json.loads(response)
+            await cursor.execute(
+                "UPDATE idempotency_keys SET record_id = NULL, response = NULL, request_hash = %s, created_at = NOW()"
+                " WHERE user_id = %s AND idempotency_key = %s",
+                (request_hash, user_id, key)
+            )
+            return None
+
+
+@writes
+@timed_query
+async def release_idempotency_key(connection: Connection) -> None:
+    await connection.rollback()
+
+
+@writes
+@timed_query
+async def purge_idempotency_keys(connection: Connection, ttl: int, batch_size: int = 1000) -> int:
+    purged = 0
+    async with connection.cursor() as cursor:
+        while True:
+            await cursor.execute(
+                "DELETE FROM idempotency_keys WHERE created_at < NOW() - INTERVAL %s SECOND LIMIT %s",
+                (ttl, batch_size)
+            )
+            await connection.commit()
+            purged += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                return purged
+
+
+@reads_primary
+@timed_query
+async def get_record(connection: Connection, record_id: int) -> dict:
+    async with connection.cursor(DictCursor) as cursor:
+        await cursor.execute("SELECT * FROM records WHERE id = %s", (record_id,))
+        return await cursor.fetchone()
+
+
+@reads
+@timed_query
+async def get_records(connection: Connection, **filters) -> list:
+    async with connection.cursor(DictCursor) as cursor:
+        await cursor.execute(*build_records_query(**filters))
+        return await cursor.fetchall()
+
+
+@writes
+@timed_query
+async def soft_delete_record(connection: Connection, record_id: int) -> dict:
+    async with connection.cursor(DictCursor) as cursor:
+        await cursor.execute("SELECT user_id, operation_id, amount, deleted FROM records WHERE id = %s", (record_id,))
+        record = await cursor.fetchone()
+        if record and not record["deleted"]:
+            try:
+                await cursor.execute("SELECT id FROM users WHERE id = %s FOR UPDATE", (record["user_id"],))
+                await cursor.fetchall()
+                await cursor.execute(
+                    "UPDATE records SET deleted = TRUE WHERE id = %s AND deleted = FALSE", (record_id,)
+                )
+                if cursor.rowcount:
+                    await cursor.execute(
+                        "UPDATE user_usage SET calls = calls - 1, total_amount = total_amount - %s"
+                        " WHERE user_id = %s AND operation_id = %s",
+                        (record["amount"], record["user_id"], record["operation_id"])
+                    )
+                await connection.commit()
+            except Exception:
+                await connection.rollback()
+                raise
+        await cursor.execute("SELECT * FROM records WHERE id = %s", (record_id,))
+        return await cursor.fetchone()
+
+
+@reads
+@timed_query
+async def get_user_usage(connection: Connection, user_id: int) -> list:
+    async with connection.cursor(DictCursor) as cursor:
+        await cursor.execute(
+            "SELECT operation_id, calls, total_amount, last_created_at FROM user_usage"
+            " WHERE user_id = %s AND calls > 0 ORDER BY operation_id",
+            (user_id,)
+        )
+        return await cursor.fetchall()
+
+
+@writes
+@timed_query
+async def update_user_balance(connection: Connection, user_id: int, new_balance: float) -> None:
+    async with connection.cursor() as cursor:
+        await cursor.execute("UPDATE users SET balance = %s WHERE id = %s", (new_balance, user_id))
+    await connection.commit()
@@ -0,0 +1,120 @@
+import asyncio
+import os
+
+import aiomysql
+from pymysql import MySQLError
+
+from app.database import PoolTimeout, get_db_config, worker_pool_size
+
+
+class AsyncConnectionPool:
+    """aiomysql counterpart of ``database.ConnectionPool``.
+
+    Same contract: bounded wait for a free connection (``PoolTimeout``),
+    optional ping on checkout, recycling of old connections and counters.
+    """
+
+    def __init__(self, pool, timeout: float = 2.0, pre_ping: bool = True):
+        self._pool = pool
+        self.timeout = timeout
+        self.pre_ping = pre_ping
+        self.waits = 0
+        self.timeouts = 0
+        self.failed_pings = 0
+
+    @classmethod
+    async def create(
+        cls, dbconfig: dict, size: int = 5, timeout: float = 2.0, recycle: float = 3600, pre_ping: bool = True
+    ) -> "AsyncConnectionPool":
+        pool = await aiomysql.create_pool(
+            host=dbconfig['host'], port=dbconfig.get('port', 3306), user=dbconfig['user'],
+            password=dbconfig['password'] or '', db=dbconfig['database'], minsize=0, maxsize=size, pool_recycle=int(recycle), autocommit=False
+        )
+        return cls(pool, timeout=timeout, pre_ping=pre_ping)
+
+    @property
+    def size(self) -> int:
+        return self._pool.maxsize
+
+    async def acquire(self, timeout: float = None):
+        timeout = self.timeout if timeout is None else timeout
+        if self._pool.freesize == 0 and self._pool.size >= self._pool.maxsize:
+            self.waits += 1
+        try:
+            connection = await asyncio.wait_for(self._pool.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise PoolTimeout(f"No database connection available within {timeout}s")
+        if self.pre_ping:
+            try:
+                await connection.ping(reconnect=True)
+            except MySQLError:
+                self.failed_pings += 1
+                self._pool.release(connection)
+                raise
+        return connection
+
+    async def prefill(self, count: int = None) -> int:
+        # Opens connections until ``count`` (default ``size``) are open and
+        # leaves them idle, so the first requests skip the connect.
+        count = self.size if count is None else min(count, self.size)
+        connections = [await self._pool.acquire() for _ in range(max(count - self._pool.size, 0))]
+        for connection in connections:
+            self._pool.release(connection)
+        return len(connections)
+
+    async def release(self, connection) -> None:
+        # aiomysql closes connections released inside a transaction, which
+        # every non-autocommit SELECT opens; roll back to keep them pooled.
+        if not connection.closed and connection.get_transaction_status():
+            try:
+                await connection.rollback()
+            except MySQLError:
+                connection.close()
+        self._pool.release(connection)
+
+    async def close(self) -> None:
+        self._pool.close()
+        await self._pool.wait_closed()
+
+    def stats(self) -> dict:
+        return {
+            "size": self._pool.maxsize,
+            "in_use": self._pool.size - self._pool.freesize,
+            "idle": self._pool.freesize,
+            "waits": self.waits,
+            "timeouts": self.timeouts,
+            "failed_pings": self.failed_pings,
+        }
+
+
+_async_pool = None
+_async_pool_lock = None
+
+
+async def init_async_pool() -> AsyncConnectionPool:
+    global _async_pool, _async_pool_lock
+    if _async_pool_lock is None:
+        _async_pool_lock = asyncio.Lock()
+    async with _async_pool_lock:
+        if _async_pool is None:
+            _async_pool = await AsyncConnectionPool.create(
+                get_db_config(),
+                size=worker_pool_size(),
+                timeout=float(os.getenv('DB_POOL_TIMEOUT', 2)),
+                recycle=float(os.getenv('DB_POOL_RECYCLE', 3600)),
+                pre_ping=os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true',
+            )
+            print("Async connection pool created successfully")
+        return _async_pool
+
+
+async def get_async_pool() -> AsyncConnectionPool:
+    return _async_pool if _async_pool is not None else await init_async_pool()
+
+
+async def close_async_pool() -> None:
+    global _async_pool
+    if _async_pool is not None:
+        await _async_pool.close()
+        _async_pool = None
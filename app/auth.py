@@ -1,37 +1,104 @@
+import os
 from typing import Any
 
 from fastapi.security import OAuth2PasswordBearer
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status, Request
-from app import crud
+from app import dal
+from app.hashing import get_password_hasher
+from app.cache import LRUCache
+from app.consts import Status
+from app.replicas import set_request_user
+from app.tokens import (
+    ACCESS, REFRESH, InvalidToken, create_token, decode_token, access_token_ttl, refresh_token_ttl,
+    legacy_tokens_allowed
+)
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Per-worker copy of the mutable user fields (balance, status), so signed
+# tokens can be checked without a query. Entries expire after a short TTL so
+# changes made by other workers are picked up.
+user_cache = LRUCache(
+    maxsize=int(os.getenv('USER_CACHE_SIZE', 10000)), ttl=float(os.getenv('USER_CACHE_TTL', 60))
+)
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
 
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
-
-
-def authenticate_user(connection, username: str, password: str) -> Any:
-    user = crud.get_user_by_username(connection, username)
+async def authenticate_user(connection, username: str, password: str) -> Any:
+    # bcrypt runs on the password hasher's executor, so no request thread is
+    # held while it works.
+    user = await dal.run("get_user_by_username", connection, username)
     if not user:
         return False
-    if not verify_password(password, user['hashed_password']):
+    valid, new_hash = await get_password_hasher().verify(password, user['hashed_password'])
+    if not valid:
         return False
+    if new_hash:
+        # BCRYPT_ROUNDS changed since this hash was made.
+        await dal.run("update_user_password_hash", connection, user['id'], new_hash)
+    cache_user(user)
     return user
 
 
-def get_current_user(request: Request, token: str = Depends(oauth2_scheme)) -> dict:
-    connection = request.state.db
-    user = crud.get_user_by_username(connection, token)
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid credentials"
-        )
+def create_tokens(user: dict) -> dict:
+    return {
+        "access_token": create_token(user, ACCESS, access_token_ttl()),
+        "refresh_token": create_token(user, REFRESH, refresh_token_ttl()),
+        "token_type": "bearer",
+        "expires_in": access_token_ttl(),
+    }
+
+
+def cache_user(user: dict) -> dict:
+    cached = {key: user[key] for key in ("id", "username", "balance", "status")}
+    user_cache.set(user['id'], cached)
+    return cached
+
+
+def update_cached_balance(user_id: int, balance: float) -> None:
+    user = user_cache.get(user_id)
+    if user is not None:
+        user_cache.set(user_id, dict(user, balance=balance))
+
+
+def invalidate_user(user_id: int) -> None:
+    user_cache.pop(user_id)
+
+
+async def get_user_state(connection, user_id: int) -> dict:
+    user = user_cache.get(user_id)
+    if user is None:
+        user = await dal.run("get_user_by_id", connection, user_id)
+        if user:
+            user = cache_user(user)
     return user
+
+
+async def get_user_from_token(connection, token: str, token_type: str = ACCESS) -> dict:
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid credentials"
+    )
+    try:
+        claims = decode_token(token, token_type)
+    except InvalidToken:
+        if token_type != ACCESS or not legacy_tokens_allowed():
+            raise credentials_exception
+        # Older clients send the username as the bearer token.
+        user = await dal.run("get_user_by_username", connection, token)
+        if not user:
+            raise credentials_exception
+        set_request_user(user['id'])
+        return cache_user(user)
+
+    if claims["st"] != Status.ACTIVE.value:
+        raise credentials_exception
+    # Before the lookup: a user who just wrote reads from the primary.
+    set_request_user(claims["sub"])
+    user = await get_user_state(connection, claims["sub"])
+    if not user or user['status'] != Status.ACTIVE.value:
+        raise credentials_exception
+    return user
+
+
+async def get_current_user(request: Request, token: str = Depends(oauth2_scheme)) -> dict:
+    return await get_user_from_token(request.state.db, token)
@@ -0,0 +1,171 @@
+import decimal
+import os
+from decimal import Decimal
+
+from app.cache import LRUCache
+
+# Operands used when a request sends none, which keeps the original
+# constant-operand behaviour ("addition" -> "2").
+DEFAULT_OPERANDS = (1, 1)
+
+
+class Operation:
+    def __init__(self, name: str, func, arity: int, deterministic: bool = True, check=None):
+        self.name = name
+        self.func = func
+        self.arity = arity
+        self.deterministic = deterministic
+        self.check = check
+
+
+class CalculatorConfig:
+    def __init__(self, mode: str = None, precision: int = None, max_precision: int = None,
+                 max_operand_digits: int = None, max_operand_exponent: int = None, max_exponent: int = None,
+                 max_result_digits: int = None):
+        self.mode = (mode or os.getenv('CALCULATION_MODE', 'float')).lower()
+        if self.mode not in ("float", "decimal"):
+            raise ValueError(f"Unknown calculation mode {self.mode!r}")
+        self.max_precision = max_precision or int(os.getenv('CALCULATION_MAX_PRECISION', 1000))
+        self.precision = min(precision or int(os.getenv('CALCULATION_PRECISION', 28)), self.max_precision)
+        self.max_operand_digits = max_operand_digits or int(os.getenv('CALCULATION_MAX_OPERAND_DIGITS', 100))
+        self.max_operand_exponent = max_operand_exponent or int(os.getenv('CALCULATION_MAX_OPERAND_EXPONENT', 1000))
+        self.max_exponent = max_exponent or int(os.getenv('CALCULATION_MAX_EXPONENT', 1000))
+        self.max_result_digits = max_result_digits or int(os.getenv('CALCULATION_MAX_RESULT_DIGITS', 10000))
+
+
+class Calculator:
+    """Registry of operation types and their evaluation.
+
+    Operands arrive as ``Decimal`` (or ints) and are checked against the size
+    guards before anything is computed. In ``float`` mode they are evaluated
+    as Python numbers, in ``decimal`` mode under a context with the configured
+    precision. Results of deterministic operations are memoized in a bounded
+    LRU keyed by type, mode and operands.
+    """
+
+    def __init__(self, config: CalculatorConfig = None, memo_size: int = None):
+        self.config = config or CalculatorConfig()
+        memo_size = int(os.getenv('CALCULATION_MEMO_SIZE', 4096)) if memo_size is None else memo_size
+        self.memo = LRUCache(maxsize=memo_size) if memo_size else None
+        self.operations = {}
+
+    def register(self, name: str, arity: int = 2, deterministic: bool = True, check=None):
+        def decorator(func):
+            self.operations[name] = Operation(name, func, arity, deterministic, check)
+            return func
+        return decorator
+
+    def _check_operand(self, value) -> None:
+        value = Decimal(value)
+        if not value.is_finite():
+            raise ValueError("Operands must be finite numbers")
+        if len(value.as_tuple().digits) > self.config.max_operand_digits:
+            raise ValueError(f"Operands are limited to {self.config.max_operand_digits} digits")
+        if value and abs(value.adjusted()) > self.config.max_operand_exponent:
+            raise ValueError(f"Operand exponents are limited to {self.config.max_operand_exponent}")
+
+    def _convert(self, value):
+        if self.config.mode == "decimal":
+            return Decimal(value)
+        if isinstance(value, Decimal):
+            return int(value) if value == value.to_integral_value() else float(value)
+        return value
+
+    def evaluate(self, operation_type: str, operands=None) -> str:
+        operation = self.operations.get(operation_type)
+        if operation is None:
+            raise ValueError("Invalid operation type")
+        if operation.arity == 0:
+            if operands:
+                raise ValueError(f"{operation_type} takes no operands")
+            return operation.func()
+        operands = tuple(DEFAULT_OPERANDS[:operation.arity] if operands is None else operands)
+        if len(operands) != operation.arity:
+            raise ValueError(f"{operation_type} takes {operation.arity} operand(s)")
+
+        key = None
+        if operation.deterministic and self.memo is not None:
+            # str() keeps 1 and 1.0 apart: their decimal results print differently.
+            key = (operation_type, self.config.mode, self.config.precision, tuple(map(str, operands)))
+            result = self.memo.get(key)
+            if result is not None:
+                # Only results that passed the guards are ever memoized.
+                return result
+        for operand in operands:
+            self._check_operand(operand)
+        if operation.check:
+            operation.check(self.config, *operands)
+        values = [self._convert(operand) for operand in operands]
+        try:
+            if self.config.mode == "decimal":
+                with decimal.localcontext() as context:
+                    context.prec = self.config.precision
+                    result = str(operation.func(*values))
+            else:
+                result = str(operation.func(*values))
+        except (ZeroDivisionError, decimal.DivisionByZero, decimal.DivisionUndefined):
+            raise ValueError("Division by zero")
+        except (OverflowError, decimal.Overflow):
+            raise ValueError("Result is too large")
+        except decimal.InvalidOperation:
+            raise ValueError("Invalid operands")
+        if key is not None:
+            self.memo.set(key, result)
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.config.mode,
+            "precision": self.config.precision,
+            "operations": sorted(self.operations),
+            "memo": self.memo.stats() if self.memo is not None else None,
+        }
+
+
+def _check_square_root(config: CalculatorConfig, value) -> None:
+    if Decimal(value) < 0:
+        raise ValueError("Square root of a negative number")
+
+
+def _check_power(config: CalculatorConfig, base, exponent) -> None:
+    exponent = Decimal(exponent)
+    if exponent != exponent.to_integral_value():
+        raise ValueError("Exponent must be an integer")
+    if abs(exponent) > config.max_exponent:
+        raise ValueError(f"Exponents are limited to {config.max_exponent}")
+    base = Decimal(base)
+    if base and (abs(base.adjusted()) + 1) * abs(exponent) > config.max_result_digits:
+        raise ValueError(f"Results are limited to {config.max_result_digits} digits")
+
+
+def _square_root(value):
+    return value.sqrt() if isinstance(value, Decimal) else value ** 0.5
+
+
+def _power(base, exponent):
+    if isinstance(exponent, Decimal):
+        return base ** int(exponent)
+    return base ** exponent
+
+
+def register_builtin_operations(calculator: Calculator) -> Calculator:
+    from app.random_strings import get_random_strings
+
+    calculator.register("addition")(lambda a, b: a + b)
+    calculator.register("subtraction")(lambda a, b: a - b)
+    calculator.register("multiplication")(lambda a, b: a * b)
+    calculator.register("division")(lambda a, b: a / b)
+    calculator.register("square_root", arity=1, check=_check_square_root)(_square_root)
+    calculator.register("power", check=_check_power)(_power)
+    calculator.register("random_string", arity=0, deterministic=False)(lambda: get_random_strings().get())
+    return calculator
+
+
+_calculator = None
+
+
+def get_calculator() -> Calculator:
+    global _calculator
+    if _calculator is None:
+        _calculator = register_builtin_operations(Calculator())
+    return _calculator
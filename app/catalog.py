@@ -0,0 +1,87 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from functools import partial
+
+from app import dal
+
+
+class CatalogSnapshot:
+    def __init__(self, operations: list):
+        self.operations = sorted(operations, key=lambda op: op['id'])
+        self.by_id = {op['id']: op for op in self.operations}
+        digest = hashlib.sha1(json.dumps(self.operations, sort_keys=True, default=str).encode()).hexdigest()
+        self.etag = f'"{digest[:20]}"'
+
+    def get(self, operation_id: int) -> dict:
+        return self.by_id.get(operation_id)
+
+    def list(self, skip: int = 0, limit: int = 10) -> list:
+        return self.operations[skip:skip + limit]
+
+
+class OperationCatalog:
+    """In-memory, id-indexed copy of the operations table.
+
+    The snapshot is reloaded once it is older than ``ttl`` seconds so that
+    every worker converges on writes made by the others; writes made by this
+    worker are applied immediately.
+    """
+
+    def __init__(self, loader=partial(dal.run, "get_all_operations"), ttl: float = None,
+                 miss_reload_interval: float = 1.0):
+        self._loader = loader
+        self.ttl = ttl
+        self.miss_reload_interval = miss_reload_interval
+        self._snapshot = None
+        self._loaded_at = 0.0
+        self._lock = None
+
+    def _get_ttl(self) -> float:
+        if self.ttl is None:
+            self.ttl = float(os.getenv('OPERATIONS_CACHE_TTL', 30))
+        return self.ttl
+
+    def _get_lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def _reload(self, connection) -> CatalogSnapshot:
+        self._snapshot = CatalogSnapshot(await self._loader(connection))
+        self._loaded_at = time.monotonic()
+        return self._snapshot
+
+    async def refresh(self, connection) -> CatalogSnapshot:
+        async with self._get_lock():
+            return await self._reload(connection)
+
+    async def snapshot(self, connection) -> CatalogSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._loaded_at <= self._get_ttl():
+            return snapshot
+        async with self._get_lock():
+            # Another request may have reloaded while we waited for the lock.
+            if self._snapshot is not None and self._snapshot is not snapshot:
+                return self._snapshot
+            return await self._reload(connection)
+
+    async def get(self, connection, operation_id: int) -> dict:
+        operation = (await self.snapshot(connection)).get(operation_id)
+        if operation is None and time.monotonic() - self._loaded_at > self.miss_reload_interval:
+            # The operation may have been created by another worker.
+            operation = (await self.refresh(connection)).get(operation_id)
+        return operation
+
+    def add(self, operation: dict) -> None:
+        if self._snapshot is not None:
+            operations = [op for op in self._snapshot.operations if op['id'] != operation['id']]
+            self._snapshot = CatalogSnapshot(operations + [operation])
+
+    def invalidate(self) -> None:
+        self._snapshot = None
+
+
+operation_catalog = OperationCatalog()
@@ -1,16 +1,47 @@
+import json
+import re
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
 from app.consts import Status
 from app import schemas
+from app.idempotency import IdempotencyKeyReused
+from app.metrics import timed_query
+from app.replicas import reads, reads_primary, writes
+from app.pagination import RECORD_SORTS
+from app.slow_queries import get_slow_query_log
 from mysql.connector import MySQLConnection
+from mysql.connector.errors import IntegrityError
+
+# innodb_ft_min_token_size: shorter words are not in the FULLTEXT index.
+FULLTEXT_MIN_TOKEN_SIZE = 3
+
 
+def _cursor(connection: MySQLConnection, **kwargs):
+    # Plain cursor, or one timed by the slow-query log when that is enabled.
+    return get_slow_query_log().cursor(connection, **kwargs)
 
+
+@reads_primary
+@timed_query
 def get_user_by_username(connection: MySQLConnection, username: str) -> dict:
-    cursor = connection.cursor(dictionary=True)
+    cursor = _cursor(connection, dictionary=True)
     cursor.execute("SELECT * FROM users WHERE username = %s", (username,))
     return cursor.fetchone()
 
 
+@reads
+@timed_query
+def get_user_by_id(connection: MySQLConnection, user_id: int) -> dict:
+    cursor = _cursor(connection, dictionary=True)
+    cursor.execute("SELECT id, username, balance, status FROM users WHERE id = %s", (user_id,))
+    return cursor.fetchone()
+
+
+@writes
+@timed_query
 def create_user(connection: MySQLConnection, user: schemas.UserCreate, hashed_password: str, status: Status) -> dict:
-    cursor = connection.cursor()
+    cursor = _cursor(connection)
     cursor.execute(
         "INSERT INTO users (username, hashed_password, status) VALUES (%s, %s, %s)",
         (user.username, hashed_password, status.value)
@@ -19,77 +50,553 @@ def create_user(connection: MySQLConnection, user: schemas.UserCreate, hashed_pa
     return get_user_by_username(connection, user.username)
 
 
+@writes
+@timed_query
+def update_user_password_hash(connection: MySQLConnection, user_id: int, hashed_password: str) -> None:
+    cursor = _cursor(connection)
+    cursor.execute("UPDATE users SET hashed_password = %s WHERE id = %s", (hashed_password, user_id))
+    connection.commit()
+
+
+@reads
+@timed_query
 def get_operations(connection: MySQLConnection, skip: int = 0, limit: int = 10) -> list:
-    cursor = connection.cursor(dictionary=True)
+    cursor = _cursor(connection, dictionary=True)
     cursor.execute("SELECT * FROM operations LIMIT %s OFFSET %s", (limit, skip))
     return cursor.fetchall()
 
 
+@reads
+@timed_query
+def get_all_operations(connection: MySQLConnection) -> list:
+    cursor = _cursor(connection, dictionary=True)
+    cursor.execute("SELECT id, type, cost FROM operations ORDER BY id")
+    return cursor.fetchall()
+
+
+@writes
+@timed_query
 def create_operation(connection: MySQLConnection, operation: schemas.OperationCreate) -> int:
-    cursor = connection.cursor()
+    cursor = _cursor(connection)
     cursor.execute("INSERT INTO operations (type, cost) VALUES (%s, %s)", (operation.type, operation.cost))
     connection.commit()
     return cursor.lastrowid
 
 
+@writes
+@timed_query
 def create_record(connection: MySQLConnection, record: schemas.RecordCreate) -> int:
-    cursor = connection.cursor()
+    cursor = _cursor(connection)
     cursor.execute(
         "INSERT INTO records (operation_id, user_id, amount,"
         " user_balance, operation_response) VALUES (%s, %s, %s, %s, %s)",
         (record.operation_id, record.user_id, record.amount, record.user_balance, record.operation_response)
     )
+    record_id = cursor.lastrowid
+    cursor.execute(*build_usage_upsert(record.user_id, [record.dict()]))
     connection.commit()
-    return cursor.lastrowid
+    return record_id
+
+
+def build_debit(user_id: int, total: float) -> tuple:
+    # Debits ``total`` only if the balance covers it, rounding the balance to
+    # cents, and hands the new balance back through LAST_INSERT_ID (in cents,
+    # plus one) so no SELECT has to follow. See debited_balance.
+    return (
+        "UPDATE users SET balance = (LAST_INSERT_ID(ROUND((balance - %s) * 100) + 1) - 1) / 100"
+        " WHERE id = %s AND balance >= %s",
+        (total, user_id, total)
+    )
+
+
+def debited_balance(insert_id: int):
+    # The balance left by build_debit's UPDATE, from the cursor's lastrowid;
+    # None when no row matched, because the user does not exist or cannot
+    # afford it. Matched rows are told apart from rows left unchanged (a
+    # zero-cost charge), which the affected row count cannot do.
+    if not insert_id:
+        return None
+    return (insert_id - 1) / 100
+
+
+@writes
+@timed_query
+def create_charged_record(
+    connection: MySQLConnection, user_id: int, operation_id: int, amount: float, operation_response: str,
+    idempotency_key: str = None
+) -> dict:
+    # Debit the balance, insert the record and bump the user_usage summary in
+    # a single transaction. The conditional UPDATE makes the balance check
+    # atomic, so concurrent requests from the same user can never overspend.
+    # With an idempotency key (claimed by claim_idempotency_key) the record is
+    # stored under it in the same transaction. Returns None when the balance
+    # does not cover the amount.
+    cursor = _cursor(connection)
+    try:
+        cursor.execute(*build_debit(user_id, amount))
+        user_balance = debited_balance(cursor.lastrowid)
+        if user_balance is None:
+            connection.rollback()
+            return None
+        cursor.execute(
+            "INSERT INTO records (operation_id, user_id, amount,"
+            " user_balance, operation_response) VALUES (%s, %s, %s, %s, %s)",
+            (operation_id, user_id, amount, user_balance, operation_response)
+        )
+        record = {
+            "id": cursor.lastrowid,
+            "operation_id": operation_id,
+            "user_id": user_id,
+            "amount": amount,
+            "user_balance": user_balance,
+            "operation_response": operation_response,
+            "deleted": False,
+        }
+        cursor.execute(*build_usage_upsert(user_id, [record]))
+        if idempotency_key is not None:
+            cursor.execute(*build_idempotent_response(user_id, idempotency_key, record))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return record
+
+
+def plan_charged_records(user_id: int, items: list, final_balance: float) -> list:
+    # Records for (operation_id, amount, operation_response) items charged in
+    # order, each carrying the balance left after it.
+    records = []
+    remaining = sum(amount for _, amount, _ in items)
+    for operation_id, amount, operation_response in items:
+        remaining -= amount
+        records.append({
+            "operation_id": operation_id,
+            "user_id": user_id,
+            "amount": amount,
+            "user_balance": final_balance + remaining,
+            "operation_response": operation_response,
+            "deleted": False,
+        })
+    return records
+
+
+def build_records_insert(records: list, with_ids: bool = False) -> tuple:
+    # With ids (reserved by reserve_record_ids) rows that already exist are
+    # left alone, so the same records can be written twice.
+    columns = ("id",) if with_ids else ()
+    columns += ("operation_id", "user_id", "amount", "user_balance", "operation_response")
+    query = (
+        f"INSERT INTO records ({', '.join(columns)}) VALUES "
+        + ", ".join(["(" + ", ".join(["%s"] * len(columns)) + ")"] * len(records))
+    )
+    if with_ids:
+        query += " ON DUPLICATE KEY UPDATE id = id"
+    params = tuple(record[column] for record in records for column in columns)
+    return query, params
+
+
+def build_usage_upsert(user_id: int, records: list) -> tuple:
+    # Adds records (dicts with operation_id and amount) to the user's
+    # user_usage rows, in operation_id order so concurrent writers lock them
+    # in the same order.
+    usage = {}
+    for record in records:
+        calls, amount = usage.get(record["operation_id"], (0, 0))
+        usage[record["operation_id"]] = (calls + 1, amount + record["amount"])
+    query = (
+        "INSERT INTO user_usage (user_id, operation_id, calls, total_amount, last_created_at) VALUES "
+        + ", ".join(["(%s, %s, %s, %s, NOW())"] * len(usage))
+        + " AS new ON DUPLICATE KEY UPDATE calls = user_usage.calls + new.calls,"
+        " total_amount = user_usage.total_amount + new.total_amount, last_created_at = new.last_created_at"
+    )
+    params = tuple(
+        value for operation_id in sorted(usage) for value in (user_id, operation_id, *usage[operation_id])
+    )
+    return query, params
+
+
+@writes
+@timed_query
+def create_charged_records(connection: MySQLConnection, user_id: int, items: list) -> list:
+    # Batch form of create_charged_record for (operation_id, amount,
+    # operation_response) items: the balance is debited once for the total and
+    # all records go in with one multi-row INSERT. Returns None when the
+    # balance does not cover the total.
+    total = sum(amount for _, amount, _ in items)
+    cursor = _cursor(connection)
+    try:
+        cursor.execute(*build_debit(user_id, total))
+        balance = debited_balance(cursor.lastrowid)
+        if balance is None:
+            connection.rollback()
+            return None
+        records = plan_charged_records(user_id, items, balance)
+        cursor.execute(*build_records_insert(records))
+        # The users row lock taken by the UPDATE keeps other inserts for this
+        # user out, so the rows from the first inserted id on are ours.
+        cursor.execute(
+            "SELECT id FROM records WHERE user_id = %s AND id >= %s ORDER BY id LIMIT %s",
+            (user_id, cursor.lastrowid, len(records))
+        )
+        for record, (record_id,) in zip(records, cursor.fetchall()):
+            record["id"] = record_id
+        cursor.execute(*build_usage_upsert(user_id, records))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return records
+
+
+@writes
+@timed_query
+def charge_records(
+    connection: MySQLConnection, user_id: int, items: list, ids: list = None, idempotency_key: str = None,
+    journal=None
+) -> list:
+    # The balance half of create_charged_records, for write-behind: debits the
+    # total and bumps user_usage in one transaction, and returns the records
+    # for app/write_behind.py to insert. Records get the given ``ids``, which
+    # a single item needs to be stored under an idempotency key. Returns None
+    # when the balance does not cover the total. A ``journal`` (the
+    # WriteBehindQueue) logs the records before the commit and queues them
+    # after it, or strikes them from its log if the commit fails, so a debit
+    # never commits without its records on disk.
+    total = sum(amount for _, amount, _ in items)
+    cursor = _cursor(connection)
+    logged = False
+    try:
+        cursor.execute(*build_debit(user_id, total))
+        balance = debited_balance(cursor.lastrowid)
+        if balance is None:
+            connection.rollback()
+            return None
+        records = plan_charged_records(user_id, items, balance)
+        for record, record_id in zip(records, ids or ()):
+            record["id"] = record_id
+        cursor.execute(*build_usage_upsert(user_id, records))
+        if idempotency_key is not None:
+            cursor.execute(*build_idempotent_response(user_id, idempotency_key, records[0]))
+        if journal is not None:
+            records = journal.prepare(records)
+            logged = True
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        if logged:
+            journal.abort(records)
+        raise
+    if journal is not None:
+        journal.confirm(records)
+    return records
+
+
+class RecordIdConflict(Exception):
+    """A record written behind found its id taken by a different record."""
+
 
+def check_record_ids(existing: list, records: list) -> None:
+    # ``existing`` holds the (id, user_id, operation_id, operation_response)
+    # rows stored under the records' ids after an insert that skips
+    # duplicates. A replay finds its own records there; anything else means
+    # another insert took the id and this record was dropped.
+    stored = {row[0]: tuple(row[1:]) for row in existing}
+    conflicts = [
+        record["id"] for record in records
+        if stored.get(record["id"]) != (record["user_id"], record["operation_id"], record["operation_response"])
+    ]
+    if conflicts:
+        raise RecordIdConflict(f"Record ids {conflicts} already hold other records")
 
+
+def build_record_ids_lookup(records: list, placeholder: str = "%s") -> tuple:
+    return (
+        "SELECT id, user_id, operation_id, operation_response FROM records"
+        f" WHERE id IN ({', '.join([placeholder] * len(records))})",
+        tuple(record["id"] for record in records)
+    )
+
+
+@writes
+@timed_query
+def insert_records(connection: MySQLConnection, records: list) -> None:
+    # Raises RecordIdConflict, rolling the whole batch back, when an id is
+    # taken by a different record.
+    cursor = _cursor(connection)
+    try:
+        cursor.execute(*build_records_insert(records, with_ids=True))
+        cursor.execute(*build_record_ids_lookup(records))
+        check_record_ids(cursor.fetchall(), records)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+
+@writes
+@timed_query
+def reserve_record_ids(connection: MySQLConnection, count: int) -> int:
+    # Claims ``count`` consecutive record ids and returns the first, in a
+    # transaction of its own so the sequence row is locked only briefly.
+    # Records inserted without an id (by a worker without write-behind, or
+    # while it was off) take theirs from AUTO_INCREMENT, so a block never
+    # starts below the highest id and AUTO_INCREMENT is moved past its end.
+    cursor = _cursor(connection)
+    try:
+        cursor.execute("SELECT next_id FROM id_sequences WHERE name = 'records'")
+        if cursor.fetchone() is None:
+            cursor.execute("INSERT IGNORE INTO id_sequences (name, next_id) VALUES ('records', 1)")
+        cursor.execute(
+            "UPDATE id_sequences SET next_id = LAST_INSERT_ID("
+            "GREATEST(next_id, (SELECT COALESCE(MAX(id), 0) + 1 FROM records)) + %s) WHERE name = 'records'",
+            (count,)
+        )
+        cursor.execute("SELECT LAST_INSERT_ID()")
+        end = cursor.fetchone()[0]
+        # An explicit id raises AUTO_INCREMENT past it even when the insert is
+        # rolled back, without the metadata lock ALTER TABLE would take, and
+        # the counter never goes down, so concurrent reservations are safe.
+        cursor.execute("SAVEPOINT reserve_record_ids")
+        cursor.execute("INSERT INTO records (id) VALUES (%s)", (end - 1,))
+        cursor.execute("ROLLBACK TO SAVEPOINT reserve_record_ids")
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return end - count
+
+
+def build_idempotent_response(user_id: int, idempotency_key: str, record: dict) -> tuple:
+    return (
+        "UPDATE idempotency_keys SET record_id = %s, response = %s WHERE user_id = %s AND idempotency_key = %s",
+        (record["id"], json.dumps(record, default=str), user_id, idempotency_key)
+    )
+
+
+@writes
+@timed_query
+def claim_idempotency_key(
+    connection: MySQLConnection, user_id: int, key: str, ttl: int, request_hash: str = None
+) -> dict:
+    # Inserts the key's row and leaves the transaction open for the charge
+    # that stores the response in it. A second claim of the same key blocks on
+    # that row until the first transaction ends, then sees its outcome.
+    # Returns the stored record when the key was used in the last ``ttl``
+    # seconds, otherwise None with the key claimed. Raises
+    # IdempotencyKeyReused when the stored request_hash (app/idempotency.py)
+    # is not this request's.
+    cursor = _cursor(connection)
+    while True:
+        try:
+            cursor.execute(
+                "INSERT INTO idempotency_keys (user_id, idempotency_key, request_hash) VALUES (%s, %s, %s)",
+                (user_id, key, request_hash)
+            )
+            return None
+        except IntegrityError:
+            pass
+        cursor.execute(
+            "SELECT response, created_at >= NOW() - INTERVAL %s SECOND, request_hash FROM idempotency_keys"
+            " WHERE user_id = %s AND idempotency_key = %s LOCK IN SHARE MODE",
+            (ttl, user_id, key)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            # Purged in between; claim it again.
+            continue
+        response, live, stored_hash = row
+        if live and response is not None:
+            connection.rollback()
+            check_request_hash(stored_hash, request_hash)
+            return json.loads(response)
+        cursor.execute(
+            "UPDATE idempotency_keys SET record_id = NULL, response = NULL, request_hash = %s, created_at = NOW()"
+            " WHERE user_id = %s AND idempotency_key = %s",
+            (request_hash, user_id, key)
+        )
+        return None
+
+
+def check_request_hash(stored_hash: str, request_hash: str) -> None:
+    # Keys stored before request hashes were kept have none to compare.
+    if stored_hash is not None and request_hash is not None and stored_hash != request_hash:
+        raise IdempotencyKeyReused("Idempotency-Key was already used with a different request")
+
+
+@writes
+@timed_query
+def release_idempotency_key(connection: MySQLConnection) -> None:
+    # Gives up a claim whose request failed, so a retry runs it again.
+    connection.rollback()
+
+
+@writes
+@timed_query
+def purge_idempotency_keys(connection: MySQLConnection, ttl: int, batch_size: int = 1000) -> int:
+    cursor = _cursor(connection)
+    purged = 0
+    while True:
+        cursor.execute(
+            "DELETE FROM idempotency_keys WHERE created_at < NOW() - INTERVAL %s SECOND LIMIT %s", (ttl, batch_size)
+        )
+        connection.commit()
+        purged += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            return purged
+
+
+@reads_primary
+@timed_query
 def get_record(connection: MySQLConnection, record_id: int) -> dict:
-    cursor = connection.cursor(dictionary=True)
+    cursor = _cursor(connection, dictionary=True)
     cursor.execute("SELECT * FROM records WHERE id = %s", (record_id,))
     return cursor.fetchone()
 
 
-def get_records(
-    connection: MySQLConnection, skip: int = 0, limit: int = 10, search: str = None, user_id: int = None
-) -> list:
-    cursor = connection.cursor(dictionary=True)
+def _search_condition(search: str, fulltext: bool = True) -> tuple:
+    # Pick an index-friendly predicate for the free-text search term: exact
+    # matches for numbers, a day range for dates and the FULLTEXT index for
+    # words. Terms shorter than the FULLTEXT minimum token size, and all words
+    # when ``fulltext`` is off (SQLite), fall back to LIKE.
+    term = search.strip()
+    try:
+        number = Decimal(term)
+    except InvalidOperation:
+        number = None
+    if number is not None and number.is_finite() and number.adjusted() < 12:
+        condition = "operation_response = %s OR amount = %s OR user_balance = %s"
+        params = [term, number, number]
+        if number == number.to_integral_value():
+            condition += " OR operation_id = %s"
+            params.append(int(number))
+        return f"({condition})", params
+
+    try:
+        day = date.fromisoformat(term)
+    except ValueError:
+        day = None
+    if day is not None:
+        return "created_at >= %s AND created_at < %s", [day, day + timedelta(days=1)]
+
+    words = [re.sub(r"[^\w]", "", word) for word in term.split()]
+    words = [word for word in words if word]
+    if fulltext and words and all(len(word) >= FULLTEXT_MIN_TOKEN_SIZE for word in words):
+        return "MATCH(operation_response) AGAINST (%s IN BOOLEAN MODE)", [" ".join(f"+{word}*" for word in words)]
+    return "operation_response LIKE %s", [f"%{term}%"]
+
+
+def build_records_query(
+    skip: int = 0, limit: int = 10, search: str = None, user_id: int = None, sort: str = "created_at",
+    after: tuple = None, operation_id: int = None, min_amount: float = None, max_amount: float = None,
+    from_date: datetime = None, to_date: datetime = None, fulltext: bool = True, include_archived: bool = False
+) -> tuple:
+    # Served by the (user_id, deleted, <column>, id) indexes. ``after`` is the
+    # (sort value, id) of the last row of the previous page for keyset
+    # pagination, which stays flat no matter how deep the page is. With
+    # ``include_archived`` the page is merged from the first skip + limit
+    # matches of records and of records_archive (see archive_records.py).
+    column, descending = RECORD_SORTS[sort]
+    direction, comparison = ("DESC", "<") if descending else ("ASC", ">")
     query = """
     SELECT id, operation_id, user_id, amount, user_balance, operation_response, created_at, deleted 
-    FROM records 
+    FROM {table} 
     WHERE user_id = %s AND deleted = FALSE
     """
     params = [user_id]
 
-    if search:
-        search_query = """
-        AND (
-            operation_response LIKE %s OR
-            CAST(operation_id AS CHAR) LIKE %s OR
-            CAST(user_id AS CHAR) LIKE %s OR
-            CAST(amount AS CHAR) LIKE %s OR
-            CAST(user_balance AS CHAR) LIKE %s OR
-            created_at LIKE %s
-        )
-        """
-        search_param = f"%{search}%"
-        params.extend([search_param] * 6)
-        query += search_query
+    if operation_id is not None:
+        query += " AND operation_id = %s"
+        params.append(operation_id)
+    if min_amount is not None:
+        query += " AND amount >= %s"
+        params.append(min_amount)
+    if max_amount is not None:
+        query += " AND amount <= %s"
+        params.append(max_amount)
+    if from_date is not None:
+        query += " AND created_at >= %s"
+        params.append(from_date)
+    if to_date is not None:
+        query += " AND created_at < %s"
+        params.append(to_date)
+    if search and search.strip():
+        condition, search_params = _search_condition(search, fulltext)
+        query += f" AND {condition}"
+        params.extend(search_params)
+
+    if after:
+        query += f" AND ({column} {comparison} %s OR ({column} = %s AND id {comparison} %s))"
+        params.extend([after[0], after[0], after[1]])
 
-    query += " LIMIT %s OFFSET %s"
+    order = f" ORDER BY {column} {direction}, id {direction}"
+    if include_archived:
+        query += order + " LIMIT %s"
+        params.append(skip + limit)
+        query = (
+            f"SELECT * FROM (SELECT * FROM ({query.format(table='records')}) AS hot"
+            f" UNION ALL SELECT * FROM ({query.format(table='records_archive')}) AS cold) AS merged"
+        )
+        params += params
+    else:
+        query = query.format(table="records")
+    query += order + " LIMIT %s OFFSET %s"
     params.extend([limit, skip])
-    cursor.execute(query, tuple(params))
+    return query, tuple(params)
+
+
+@reads
+@timed_query
+def get_records(connection: MySQLConnection, **filters) -> list:
+    # See build_records_query for the accepted filters.
+    cursor = _cursor(connection, dictionary=True)
+    cursor.execute(*build_records_query(**filters))
     return cursor.fetchall()
 
 
+@writes
+@timed_query
 def soft_delete_record(connection: MySQLConnection, record_id: int) -> dict:
-    cursor = connection.cursor(dictionary=True)
-    cursor.execute("UPDATE records SET deleted = TRUE WHERE id = %s", (record_id,))
-    connection.commit()
+    # The record leaves the user's user_usage summary in the same transaction.
+    # Locking the users row first orders this after in-flight charges for the
+    # same user and against backfill_usage.py.
+    cursor = _cursor(connection, dictionary=True)
+    cursor.execute("SELECT user_id, operation_id, amount, deleted FROM records WHERE id = %s", (record_id,))
+    record = cursor.fetchone()
+    if record and not record["deleted"]:
+        try:
+            cursor.execute("SELECT id FROM users WHERE id = %s FOR UPDATE", (record["user_id"],))
+            cursor.fetchall()
+            cursor.execute("UPDATE records SET deleted = TRUE WHERE id = %s AND deleted = FALSE", (record_id,))
+            if cursor.rowcount:
+                cursor.execute(
+                    "UPDATE user_usage SET calls = calls - 1, total_amount = total_amount - %s"
+                    " WHERE user_id = %s AND operation_id = %s",
+                    (record["amount"], record["user_id"], record["operation_id"])
+                )
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
     cursor.execute("SELECT * FROM records WHERE id = %s", (record_id,))
     return cursor.fetchone()
 
 
+@reads
+@timed_query
+def get_user_usage(connection: MySQLConnection, user_id: int) -> list:
+    # One primary-key range read, however many records the user has.
+    cursor = _cursor(connection, dictionary=True)
+    cursor.execute(
+        "SELECT operation_id, calls, total_amount, last_created_at FROM user_usage"
+        " WHERE user_id = %s AND calls > 0 ORDER BY operation_id",
+        (user_id,)
+    )
+    return cursor.fetchall()
+
+
+@writes
+@timed_query
 def update_user_balance(connection: MySQLConnection, user_id: int, new_balance: float) -> None:
-    cursor = connection.cursor()
+    cursor = _cursor(connection)
     cursor.execute("UPDATE users SET balance = %s WHERE id = %s", (new_balance, user_id))
     connection.commit()
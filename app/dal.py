@@ -0,0 +1,112 @@
+import os
+
+import mysql.connector
+import pymysql
+
+from app.metrics import run_in_threadpool
+from app.replicas import READ, READ_PRIMARY, WRITE, current_request, get_replica_set
+
+from app import crud, async_crud, sqlite_crud
+
+# DB_DRIVER=sync (default) runs app/crud.py on mysql-connector in the
+# threadpool; DB_DRIVER=async runs app/async_crud.py on aiomysql;
+# DB_DRIVER=sqlite runs app/sqlite_crud.py on the stdlib sqlite3 module in the
+# threadpool, for tests and benchmarks without a MySQL server.
+BACKENDS = {"sync": crud, "async": async_crud, "sqlite": sqlite_crud}
+
+_backend = None
+_async_driver = None
+
+DATABASE_ERRORS = (mysql.connector.Error, pymysql.MySQLError)
+
+
+def storage_backend() -> str:
+    global _backend
+    if _backend is None:
+        backend = os.getenv('DB_DRIVER', 'sync').lower()
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown DB_DRIVER {backend!r}, expected one of {', '.join(BACKENDS)}")
+        _backend = backend
+    return _backend
+
+
+def use_async_driver() -> bool:
+    global _async_driver
+    if _async_driver is None:
+        _async_driver = storage_backend() == 'async'
+    return _async_driver
+
+
+async def _call(func, connection, *args, **kwargs):
+    if use_async_driver():
+        return await func(connection, *args, **kwargs)
+    return await run_in_threadpool(func, connection, *args, **kwargs)
+
+
+async def _replica_connection(routing):
+    # The replica connection lent to this request, checked out on its first
+    # read. None keeps the read on the primary: no healthy replica, the
+    # request already wrote, or its user wrote within the sticky window.
+    if routing.wrote:
+        return None
+    if routing.replica_connection is not None:
+        return routing.replica_connection
+    replica_set = await get_replica_set()
+    if replica_set is None:
+        return None
+    if routing.user_id is not None and await replica_set.is_sticky(routing.user_id):
+        return None
+    replica = replica_set.choose()
+    if replica is None:
+        replica_set.fallbacks += 1
+        return None
+    try:
+        if use_async_driver():
+            connection = await replica.pool.acquire()
+        else:
+            connection = await run_in_threadpool(replica.pool.acquire)
+    except Exception as e:
+        print(f"Replica {replica.name} unavailable, reading from the primary: {e}")
+        replica_set.fallbacks += 1
+        return None
+    routing.replica, routing.replica_connection = replica, connection
+    return connection
+
+
+async def release_replica(routing) -> None:
+    if routing.replica_connection is None:
+        return
+    connection, routing.replica_connection = routing.replica_connection, None
+    if use_async_driver():
+        await routing.replica.pool.release(connection)
+    else:
+        await run_in_threadpool(routing.replica.pool.release, connection)
+
+
+async def run(name: str, connection, *args, **kwargs):
+    func = getattr(BACKENDS[storage_backend()], name)
+    routing = current_request()
+    if routing is None or routing.primary is not connection:
+        # Outside a request, or on a connection the caller checked out itself.
+        return await _call(func, connection, *args, **kwargs)
+    intent = getattr(func, "intent", WRITE)
+    if intent == READ_PRIMARY:
+        return await _call(func, connection, *args, **kwargs)
+    if intent != READ:
+        routing.wrote = True
+        result = await _call(func, connection, *args, **kwargs)
+        replica_set = await get_replica_set()
+        if replica_set is not None and routing.user_id is not None:
+            await replica_set.stick(routing.user_id)
+        return result
+    replica_connection = await _replica_connection(routing)
+    if replica_connection is not None:
+        try:
+            result = await _call(func, replica_connection, *args, **kwargs)
+            (await get_replica_set()).routed += 1
+            return result
+        except DATABASE_ERRORS as e:
+            print(f"Read on replica {routing.replica.name} failed, retrying on the primary: {e}")
+            routing.replica.mark_down(str(e))
+            await release_replica(routing)
+    return await _call(func, connection, *args, **kwargs)
@@ -1,6 +1,14 @@
+import threading
+import time
+from collections import deque
+
 import mysql.connector
 from mysql.connector import Error
 from fastapi import Request, Response
+from app.metrics import run_in_threadpool
+from app.dal import release_replica, storage_backend, use_async_driver
+from app.replicas import begin_request
+from app.write_behind import write_behind_enabled
 import os
 from dotenv import load_dotenv
 
@@ -8,16 +16,19 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+def get_db_config() -> dict:
+    return dict(
+        host=os.getenv('DB_HOST'),
+        database=os.getenv('DB_NAME'),
+        user=os.getenv('DB_USER'),
+        password=os.getenv('DB_PASSWORD')
+    )
+
+
 # Function to create a database connection
 def create_connection():
     try:
-        dbconfig = dict(
-            host=os.getenv('DB_HOST'),
-            database=os.getenv('DB_NAME'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD')
-        )
-        connection = mysql.connector.connect(**dbconfig)
+        connection = mysql.connector.connect(**get_db_config())
         if connection.is_connected():
             print("Connected to MySQL database")
             return connection
@@ -26,39 +37,254 @@ def create_connection():
     return None
 
 
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Process-wide pool handing out MySQL connections to the request middleware.
+
+    Connections are opened lazily up to ``size``. Checkout validates idle
+    connections (``pre_ping``) and replaces those older than ``recycle``
+    seconds; when every slot is busy the caller waits at most ``timeout``
+    seconds before getting a ``PoolTimeout``.
+    """
+
+    def __init__(
+        self, dbconfig: dict, size: int = 5, timeout: float = 2.0, recycle: float = 3600,
+        pre_ping: bool = True, connect=mysql.connector.connect
+    ):
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self._dbconfig = dbconfig
+        self._connect = connect
+        self._idle = deque()
+        self._created_at = {}
+        self._in_use = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self.waits = 0
+        self.timeouts = 0
+        self.created = 0
+        self.recycled = 0
+        self.failed_pings = 0
+
+    def acquire(self, timeout: float = None):
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if self._closed:
+                raise Error("Connection pool is closed")
+            waited = False
+            while not self._idle and self._in_use >= self.size:
+                if not waited:
+                    self.waits += 1
+                    waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(f"No database connection available within {timeout}s")
+                self._cond.wait(remaining)
+            self._in_use += 1
+            connection = self._idle.pop() if self._idle else None
+        try:
+            return self._checkout(connection)
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def _checkout(self, connection):
+        if connection is not None:
+            age = time.monotonic() - self._created_at.get(id(connection), 0)
+            if self.recycle and age > self.recycle:
+                self.recycled += 1
+                self._discard(connection)
+                connection = None
+            elif self.pre_ping and not self._is_alive(connection):
+                self.failed_pings += 1
+                self._discard(connection)
+                connection = None
+        if connection is None:
+            connection = self._connect(**self._dbconfig)
+            self._created_at[id(connection)] = time.monotonic()
+            self.created += 1
+        return connection
+
+    @staticmethod
+    def _is_alive(connection) -> bool:
+        try:
+            return connection.is_connected()
+        except Error:
+            return False
+
+    def _discard(self, connection) -> None:
+        self._created_at.pop(id(connection), None)
+        try:
+            connection.close()
+        except Error:
+            pass
+
+    def prefill(self, count: int = None) -> int:
+        # Opens connections until ``count`` (default ``size``) are open and
+        # leaves them idle, so the first requests skip the connect.
+        count = self.size if count is None else min(count, self.size)
+        opened = 0
+        while True:
+            with self._cond:
+                if self._closed or len(self._idle) + self._in_use >= count:
+                    return opened
+                self._in_use += 1
+            try:
+                connection = self._checkout(None)
+            except Exception:
+                with self._cond:
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+            self.release(connection)
+            opened += 1
+
+    def release(self, connection) -> None:
+        discard = False
+        try:
+            # Never hand a connection with an open transaction (and its
+            # snapshot) to the next request.
+            if connection.in_transaction:
+                connection.rollback()
+        except Error:
+            discard = True
+        with self._cond:
+            self._in_use -= 1
+            if discard or self._closed:
+                self._discard(connection)
+            else:
+                self._idle.append(connection)
+            self._cond.notify()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._discard(self._idle.pop())
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self.size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+                "created": self.created,
+                "recycled": self.recycled,
+                "failed_pings": self.failed_pings,
+            }
+
+
+def worker_pool_size() -> int:
+    # DB_POOL_SIZE when set. Otherwise this worker's share of
+    # DB_CONNECTION_BUDGET, the connections all web workers together may
+    # hold: WEB_DYNOS dynos of WEB_CONCURRENCY workers each, less the two
+    # every worker's write-behind queue keeps.
+    if os.getenv('DB_POOL_SIZE'):
+        return int(os.getenv('DB_POOL_SIZE'))
+    budget = os.getenv('DB_CONNECTION_BUDGET')
+    if not budget:
+        return 5
+    workers = int(os.getenv('WEB_DYNOS', 1)) * int(os.getenv('WEB_CONCURRENCY', 1))
+    size = int(budget) // workers - (2 if write_behind_enabled() else 0)
+    if size < 1:
+        print(f"DB_CONNECTION_BUDGET={budget} is too small for {workers} workers; using 1 connection per worker")
+        return 1
+    return size
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def init_pool() -> ConnectionPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None and storage_backend() == "sqlite":
+            from app.sqlite_database import create_sqlite_pool
+            _pool = create_sqlite_pool()
+            print("SQLite connection pool created successfully")
+        elif _pool is None:
+            _pool = ConnectionPool(
+                get_db_config(),
+                size=worker_pool_size(),
+                timeout=float(os.getenv('DB_POOL_TIMEOUT', 2)),
+                recycle=float(os.getenv('DB_POOL_RECYCLE', 3600)),
+                pre_ping=os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true',
+            )
+            print("Connection pool created successfully")
+        return _pool
+
+
+def get_pool() -> ConnectionPool:
+    # The startup hook normally creates the pool; fall back to lazy creation
+    # for clients (like TestClient without a context manager) that skip it.
+    return _pool if _pool is not None else init_pool()
+
+
+def close_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+async def acquire_connection():
+    if use_async_driver():
+        from app.async_database import get_async_pool
+        pool = await get_async_pool()
+        return await pool.acquire()
+    return await run_in_threadpool(get_pool().acquire)
+
+
+async def release_connection(connection) -> None:
+    if use_async_driver():
+        from app.async_database import get_async_pool
+        pool = await get_async_pool()
+        await pool.release(connection)
+    else:
+        await run_in_threadpool(get_pool().release, connection)
+
+
+# Paths served without a connection, so they keep working when the pool is exhausted.
+DB_FREE_PATHS = {"/metrics", "/ready", "/admin/slow-queries"}
+
+
 # Middleware to handle database connections
 async def db_session_middleware(request: Request, call_next):
-    # Database configuration
-    dbconfig = dict(
-        host=os.getenv('DB_HOST'),
-        database=os.getenv('DB_NAME'),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD')
-    )
-
-    # Create a connection pool
+    if request.url.path in DB_FREE_PATHS:
+        return await call_next(request)
     try:
-        connection_pool = mysql.connector.pooling.MySQLConnectionPool(
-            pool_name="mypool",
-            pool_size=int(os.getenv('DB_POOL_SIZE', 5)),
-            **dbconfig
-        )
-        print("Connection pool created successfully")
-    except Error as e:
-        print(f"Error creating connection pool: {e}")
-        raise
+        request.state.db = await acquire_connection()
+    except PoolTimeout as e:
+        print(f"Database pool exhausted: {e}")
+        return Response("Database busy, try again later", status_code=503, headers={"Retry-After": "1"})
+    except Exception as e:
+        print(f"Error acquiring database connection: {e}")
+        return Response("Database connection failed", status_code=500)
+
+    # Lets app/dal.py send this request's reads to a replica.
+    routing = begin_request(request.state.db)
     response = Response("Internal server error", status_code=500)
     try:
-        request.state.db = connection_pool.get_connection()
-        if request.state.db and request.state.db.is_connected():
-            response = await call_next(request)
-        else:
-            response = Response("Database connection failed", status_code=500)
+        response = await call_next(request)
     except Exception as e:
         print(f"Error during request processing: {e}")
     finally:
-        if request.state.db and request.state.db.is_connected():
-            request.state.db.close()
+        await release_replica(routing)
+        await release_connection(request.state.db)
     return response
 
 
@@ -0,0 +1,129 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+
+from passlib.context import CryptContext
+
+
+class HasherBusy(Exception):
+    pass
+
+
+@lru_cache(maxsize=None)
+def get_crypt_context(rounds: int) -> CryptContext:
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+
+
+# Module-level so they can run in worker processes.
+def _hash(password: str, rounds: int) -> str:
+    return get_crypt_context(rounds).hash(password)
+
+
+def _verify_and_update(password: str, hashed_password: str, rounds: int) -> tuple:
+    # Returns (valid, new_hash); new_hash is set when the stored hash was made
+    # with a different cost and should be replaced.
+    return get_crypt_context(rounds).verify_and_update(password, hashed_password)
+
+
+class PasswordHasher:
+    """Runs bcrypt on a dedicated, size-limited executor.
+
+    At most ``workers`` hashes run at once and ``max_queue`` more may wait;
+    anything beyond that is rejected with ``HasherBusy`` straight away so a
+    login burst cannot pile up behind the request threadpool.
+    """
+
+    def __init__(self, workers: int = None, max_queue: int = None, rounds: int = None, executor: str = None):
+        self.workers = workers or int(os.getenv('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv('PASSWORD_HASH_QUEUE', 32))
+        self.rounds = rounds or int(os.getenv('BCRYPT_ROUNDS', 12))
+        self.executor_kind = executor or os.getenv('PASSWORD_HASH_EXECUTOR', 'process')
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.hash_seconds_total = 0.0
+        self.last_hash_seconds = 0.0
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.executor_kind == 'process':
+                        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                    else:
+                        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def _run(self, func, *args):
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise HasherBusy("Too many password checks in progress")
+            self._pending += 1
+        started = time.monotonic()
+        try:
+            return await asyncio.wrap_future(self._get_executor().submit(func, *args))
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self._pending -= 1
+                self.completed += 1
+                self.hash_seconds_total += elapsed
+                self.last_hash_seconds = elapsed
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password, self.rounds)
+
+    async def verify(self, password: str, hashed_password: str) -> tuple:
+        valid, new_hash = await self._run(_verify_and_update, password, hashed_password, self.rounds)
+        if new_hash:
+            with self._lock:
+                self.rehashed += 1
+        return valid, new_hash
+
+    def close(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_depth": max(self._pending - self.workers, 0),
+                "in_flight": self._pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "rehashed": self.rehashed,
+                "hash_seconds_total": round(self.hash_seconds_total, 6),
+                "last_hash_seconds": round(self.last_hash_seconds, 6),
+            }
+
+
+_password_hasher = None
+_password_hasher_lock = threading.Lock()
+
+
+def get_password_hasher() -> PasswordHasher:
+    global _password_hasher
+    if _password_hasher is not None:
+        return _password_hasher
+    with _password_hasher_lock:
+        if _password_hasher is None:
+            _password_hasher = PasswordHasher()
+        return _password_hasher
+
+
+def close_password_hasher() -> None:
+    global _password_hasher
+    with _password_hasher_lock:
+        if _password_hasher is not None:
+            _password_hasher.close()
+            _password_hasher = None
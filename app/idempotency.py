@@ -0,0 +1,66 @@
+import asyncio
+import hashlib
+import json
+import os
+
+# Longest Idempotency-Key header accepted (the idempotency_keys column size).
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+
+class IdempotencyKeyReused(Exception):
+    """An Idempotency-Key was sent again with a different request body."""
+
+
+def request_hash(body: dict) -> str:
+    # Stored next to the key, so a key reused for another request is refused
+    # instead of replaying a response that does not belong to it.
+    return hashlib.sha256(json.dumps(body, sort_keys=True, separators=(",", ":"), default=str).encode()).hexdigest()
+
+
+def idempotency_key_ttl() -> int:
+    # Seconds a stored response is replayed for its key.
+    return int(os.getenv('IDEMPOTENCY_KEY_TTL', 86400))
+
+
+class SingleFlight:
+    """Runs one call per key at a time within this worker.
+
+    Callers arriving while a call for their key is in flight wait for it and
+    share its outcome, result or exception, instead of running their own.
+    Across workers the idempotency_keys row lock does the same job.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.shared = 0
+
+    async def run(self, key, func) -> tuple:
+        # Returns (result, shared), ``shared`` telling whether another
+        # caller's call produced it.
+        future = self._calls.get(key)
+        if future is not None:
+            self.shared += 1
+            return await asyncio.shield(future), True
+        future = asyncio.get_event_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Nobody may be waiting; mark it retrieved so asyncio does not warn.
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self._calls[key]
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+
+calculate_calls = SingleFlight()
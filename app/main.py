@@ -1,7 +1,25 @@
-from fastapi import FastAPI, Request, Response
+import os
+import secrets
+
+from fastapi import FastAPI, Header, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from app import routes
-from app.database import db_session_middleware
+from app.calculator import get_calculator
+from app.metrics import metrics_enabled, metrics_middleware, render, threadpool_stats
+from app.rate_limit import get_rate_limiter, rate_limit_middleware
+from app.records_cache import get_records_cache
+from app.replicas import init_replica_set, close_replica_set, get_replica_set
+from app.slow_queries import get_slow_query_log
+from app.write_behind import get_write_behind, close_write_behind
+from app.hashing import get_password_hasher, close_password_hasher
+from app.random_strings import get_random_strings, close_random_strings
+from app.async_database import init_async_pool, close_async_pool, get_async_pool
+from app import dal
+from app.dal import use_async_driver
+from app.database import db_session_middleware, init_pool, close_pool, get_pool
+from app.tokens import get_secret_key
+from app.warmup import readiness, start_warm_up, stop_warm_up
 
 app = FastAPI()
 
@@ -12,14 +30,120 @@ origins = [
     "https://ntdfrontend-702d74153fdf.herokuapp.com"
 ]
 
+# Middleware to handle database connections
+app.middleware("http")(db_session_middleware)
+# Outside the database middleware, so rejected requests never take a connection.
+app.middleware("http")(rate_limit_middleware)
+# Outside both, so its timings include connection checkout.
+app.middleware("http")(metrics_middleware)
+# Outermost, so 429s and 503s from the middlewares above carry CORS headers
+# and the frontend can read their Retry-After.
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "Idempotent-Replayed", "Retry-After"],
 )
 
-# Middleware to handle database connections
-app.middleware("http")(db_session_middleware)
 
+@app.on_event("startup")
+async def startup():
+    readiness.mark("imports")
+    # Fails here, not on the first login, when the signing key is missing.
+    get_secret_key()
+    get_random_strings().start()
+    if use_async_driver():
+        await init_async_pool()
+    else:
+        init_pool()
+    await init_replica_set()
+    # Replays records a crashed worker left queued.
+    get_write_behind()
+    readiness.mark("startup")
+    # Opens the pool, loads the operation catalog and purges expired
+    # idempotency keys in the background; /ready reports when it is done.
+    start_warm_up()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    stop_warm_up()
+    close_write_behind()
+    await close_replica_set()
+    if use_async_driver():
+        await close_async_pool()
+    else:
+        close_pool()
+    close_random_strings()
+    close_password_hasher()
+
+
+@app.get("/health")
+async def health():
+    pool = await get_async_pool() if use_async_driver() else get_pool()
+    replica_set = await get_replica_set()
+    return {
+        "status": "ok",
+        "db_driver": dal.storage_backend(),
+        "db_pool": pool.stats(),
+        "random_strings": get_random_strings().stats(),
+        "password_hasher": get_password_hasher().stats(),
+        "calculator": get_calculator().stats(),
+        "records_cache": get_records_cache().stats(),
+        "write_behind": get_write_behind().stats() if get_write_behind() else None,
+        "replicas": replica_set.stats() if replica_set else None,
+        "rate_limit": get_rate_limiter().stats() if get_rate_limiter() else None,
+        "startup": readiness.stats(),
+    }
+
+
+@app.get("/ready")
+async def ready():
+    # 503 until this worker has warmed up; for load balancer and deploy checks.
+    if not readiness.ready:
+        return JSONResponse(readiness.stats(), status_code=503, headers={"Retry-After": "1"})
+    return readiness.stats()
+
+
+@app.get("/metrics")
+async def metrics():
+    if not metrics_enabled():
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    pool = await get_async_pool() if use_async_driver() else get_pool()
+    gauges = {
+        "db_pool": pool.stats(),
+        "threadpool": threadpool_stats(),
+        "random_strings": get_random_strings().stats(),
+        "password_hasher": get_password_hasher().stats(),
+        "records_cache": get_records_cache().stats(),
+        "startup": readiness.stats(),
+    }
+    if get_write_behind():
+        gauges["write_behind"] = get_write_behind().stats()
+    replica_set = await get_replica_set()
+    if replica_set:
+        gauges["replicas"] = replica_set.stats()
+    if get_rate_limiter():
+        gauges["rate_limit"] = get_rate_limiter().stats()
+    memo = get_calculator().memo
+    if memo is not None:
+        gauges["calculator_memo"] = memo.stats()
+    return Response(render(gauges), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/admin/slow-queries")
+async def slow_queries(x_admin_token: str = Header(None)):
+    admin_token = os.getenv('ADMIN_TOKEN')
+    if not admin_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, admin_token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    log = get_slow_query_log()
+    return {
+        "enabled": log.enabled,
+        "threshold_ms": log.threshold * 1000,
+        "recorded": log.recorded,
+        "entries": log.entries()[::-1],
+    }
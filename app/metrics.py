@@ -0,0 +1,250 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from starlette.concurrency import run_in_threadpool as _run_in_threadpool
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_enabled = None
+
+
+def metrics_enabled() -> bool:
+    global _enabled
+    if _enabled is None:
+        _enabled = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+    return _enabled
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Sharded:
+    """Per-thread series storage, so recording never takes a lock.
+
+    Each thread writes only to its own dict; the lock is taken once per thread
+    to register that dict and by the scraper, which sums every shard.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._shards = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def _series(self) -> dict:
+        merged = {}
+        with self._lock:
+            shards = list(self._shards)
+        for shard in shards:
+            for labels, values in list(shard.items()):
+                total = merged.setdefault(labels, [0] * len(values))
+                for i, value in enumerate(values):
+                    total[i] += value
+        return merged
+
+
+class Counter(_Sharded):
+    def inc(self, *labels, amount: float = 1) -> None:
+        if not metrics_enabled():
+            return
+        shard = self._shard()
+        series = shard.get(labels)
+        if series is None:
+            series = shard[labels] = [0]
+        series[0] += amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, (value,) in sorted(self._series().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram(_Sharded):
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels) -> None:
+        if not metrics_enabled():
+            return
+        shard = self._shard()
+        series = shard.get(labels)
+        if series is None:
+            # One slot per bucket, one for +Inf, then the sum.
+            series = shard[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+http_request_seconds = Histogram(
+    "ntd_http_request_seconds", "HTTP request latency by route.", ("method", "route", "status")
+)
+db_query_seconds = Histogram("ntd_db_query_seconds", "Latency of app/crud.py functions.", ("function",))
+db_query_rows = Counter("ntd_db_query_rows_total", "Rows returned or written by app/crud.py functions.", ("function",))
+db_query_errors = Counter("ntd_db_query_errors_total", "app/crud.py calls that raised.", ("function",))
+threadpool_wait_seconds = Histogram(
+    "ntd_threadpool_wait_seconds", "Time calls wait for a free threadpool worker.", ("function",)
+)
+external_request_seconds = Histogram(
+    "ntd_external_request_seconds", "Latency of calls to external services.", ("service", "outcome")
+)
+
+METRICS = [
+    http_request_seconds, db_query_seconds, db_query_rows, db_query_errors, threadpool_wait_seconds,
+    external_request_seconds,
+]
+
+_threadpool_in_flight = 0
+
+
+def _count_rows(result) -> int:
+    if result is None:
+        return 0
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    return 1
+
+
+def timed_query(func):
+    """Records latency, row count and errors of a crud function, sync or async."""
+    name = func.__name__
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            if not metrics_enabled():
+                return await func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception:
+                db_query_errors.inc(name)
+                raise
+            finally:
+                db_query_seconds.observe(time.perf_counter() - started, name)
+            db_query_rows.inc(name, amount=_count_rows(result))
+            return result
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not metrics_enabled():
+            return func(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            db_query_errors.inc(name)
+            raise
+        finally:
+            db_query_seconds.observe(time.perf_counter() - started, name)
+        db_query_rows.inc(name, amount=_count_rows(result))
+        return result
+    return wrapper
+
+
+async def run_in_threadpool(func, *args, **kwargs):
+    """starlette's run_in_threadpool, recording how long the call queued."""
+    if not metrics_enabled():
+        return await _run_in_threadpool(func, *args, **kwargs)
+    global _threadpool_in_flight
+    submitted = time.perf_counter()
+    name = getattr(func, "__name__", type(func).__name__)
+
+    def call():
+        threadpool_wait_seconds.observe(time.perf_counter() - submitted, name)
+        return func(*args, **kwargs)
+
+    # Only touched on the event loop thread.
+    _threadpool_in_flight += 1
+    try:
+        return await _run_in_threadpool(call)
+    finally:
+        _threadpool_in_flight -= 1
+
+
+def threadpool_stats() -> dict:
+    executor = getattr(asyncio.get_event_loop(), "_default_executor", None)
+    max_workers = getattr(executor, "_max_workers", None) or min(32, (os.cpu_count() or 1) + 4)
+    return {"in_flight": _threadpool_in_flight, "max_workers": max_workers}
+
+
+_route_paths = None
+
+
+def _route_label(request) -> str:
+    # Label by route template, not raw path, to keep the series count bounded.
+    global _route_paths
+    if _route_paths is None:
+        _route_paths = {
+            route.endpoint: route.path for route in request.app.routes if hasattr(route, "endpoint")
+        }
+    return _route_paths.get(request.scope.get("endpoint"), "unmatched")
+
+
+async def metrics_middleware(request, call_next):
+    if not metrics_enabled():
+        return await call_next(request)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        http_request_seconds.observe(time.perf_counter() - started, request.method, _route_label(request), status)
+
+
+def render_gauges(prefix: str, stats: dict) -> list:
+    lines = []
+    for key, value in stats.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        name = f"ntd_{prefix}_{key}"
+        lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+    return lines
+
+
+def render(gauges: dict = None) -> str:
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    for prefix, stats in (gauges or {}).items():
+        lines += render_gauges(prefix, stats)
+    return "\n".join(lines) + "\n"
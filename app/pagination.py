@@ -0,0 +1,39 @@
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal
+
+# Sort keys accepted by GET /records/, mapped to (column, descending).
+RECORD_SORTS = {
+    "created_at": ("created_at", False),
+    "-created_at": ("created_at", True),
+    "amount": ("amount", False),
+    "-amount": ("amount", True),
+}
+
+
+def encode_cursor(record: dict, sort: str) -> str:
+    column, _ = RECORD_SORTS[sort]
+    value = record[column]
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    elif value is not None:
+        value = str(value)
+    payload = json.dumps([sort, value, record["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str, sort: str) -> tuple:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        cursor_sort, value, record_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if cursor_sort != sort:
+            raise ValueError("Cursor does not match the requested sort")
+        column, _ = RECORD_SORTS[sort]
+        if column == "created_at":
+            value = datetime.fromisoformat(value)
+        else:
+            value = Decimal(value)
+        return value, int(record_id)
+    except (TypeError, KeyError, json.JSONDecodeError, ArithmeticError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
@@ -0,0 +1,183 @@
+import os
+import secrets
+import string
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.metrics import external_request_seconds
+
+ALPHABET = string.ascii_letters + string.digits
+
+
+class RandomStringUnavailable(Exception):
+    pass
+
+
+class RandomStringBuffer:
+    """Buffer of random.org strings refilled in the background.
+
+    Strings are fetched in batches whenever the buffer drops to ``low_water``.
+    When the buffer is empty a caller waits up to ``max_wait`` seconds for an
+    in-flight refill, then falls back to a locally generated string (if
+    ``fallback`` is enabled) or raises ``RandomStringUnavailable``.
+    """
+
+    def __init__(
+        self, url: str = None, batch_size: int = None, low_water: int = None, timeout: float = None,
+        max_wait: float = None, fallback: bool = None, length: int = 8
+    ):
+        self.url = url or os.getenv('RANDOM_ORG_URL', 'https://www.random.org/strings/')
+        self.batch_size = batch_size or int(os.getenv('RANDOM_STRING_BATCH_SIZE', 1000))
+        self.low_water = low_water if low_water is not None else int(os.getenv('RANDOM_STRING_LOW_WATER', 100))
+        self.timeout = timeout or float(os.getenv('RANDOM_STRING_TIMEOUT', 5))
+        self.max_wait = max_wait if max_wait is not None else float(os.getenv('RANDOM_STRING_MAX_WAIT', 0.5))
+        if fallback is None:
+            fallback = os.getenv('RANDOM_STRING_FALLBACK', 'true').lower() == 'true'
+        self.fallback = fallback
+        self.length = length
+
+        self._session = requests.Session()
+        self._session.mount('http://', HTTPAdapter(pool_maxsize=2))
+        self._session.mount('https://', HTTPAdapter(pool_maxsize=2))
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._refilled = threading.Condition(self._lock)
+        self._refilling = False
+        self._retry_at = 0.0
+        self._closed = False
+
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+        self.refills = 0
+        self.refill_errors = 0
+        self.refill_seconds_total = 0.0
+        self.last_refill_seconds = 0.0
+
+    def fetch_batch(self) -> list:
+        response = self._session.get(
+            self.url,
+            params=dict(
+                num=self.batch_size, len=self.length, digits='on', upperalpha='on', loweralpha='on',
+                unique='on', format='plain', rnd='new'
+            ),
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        return [line.strip() for line in response.text.splitlines() if line.strip()]
+
+    def _refill(self) -> None:
+        started = time.monotonic()
+        strings = []
+        failed = False
+        try:
+            strings = self.fetch_batch()
+        except Exception as e:
+            # Not only RequestException: anything escaping here would end the
+            # thread with _refilling still set, and no refill would run again.
+            print(f"Error refilling random strings: {e}")
+            failed = True
+        elapsed = time.monotonic() - started
+        external_request_seconds.observe(elapsed, "random.org", "error" if failed else "ok")
+        with self._lock:
+            self._buffer.extend(strings)
+            self._refilling = False
+            self.refills += 1
+            if failed:
+                # Back off instead of hammering an upstream that is down.
+                self.refill_errors += 1
+                self._retry_at = time.monotonic() + self.timeout
+            self.refill_seconds_total += elapsed
+            self.last_refill_seconds = elapsed
+            self._refilled.notify_all()
+
+    def _maybe_refill(self) -> None:
+        # Must be called with the lock held.
+        if (
+            not self._refilling and not self._closed and len(self._buffer) <= self.low_water
+            and time.monotonic() >= self._retry_at
+        ):
+            self._refilling = True
+            threading.Thread(target=self._refill, name="random-string-refill", daemon=True).start()
+
+    def start(self) -> None:
+        with self._lock:
+            self._maybe_refill()
+
+    def _drain_into(self, result: list, count: int) -> None:
+        while self._buffer and len(result) < count:
+            result.append(self._buffer.popleft())
+
+    def take(self, count: int = 1) -> list:
+        result = []
+        deadline = time.monotonic() + self.max_wait
+        with self._lock:
+            self._drain_into(result, count)
+            self._maybe_refill()
+            while len(result) < count and self._refilling:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._refilled.wait(remaining)
+                self._drain_into(result, count)
+            self._maybe_refill()
+            missing = count - len(result)
+            self.hits += len(result)
+            self.misses += missing
+            if missing and self.fallback:
+                self.fallbacks += missing
+        if missing:
+            if not self.fallback:
+                raise RandomStringUnavailable("Random string service unavailable")
+            result.extend(self.generate_local() for _ in range(missing))
+        return result
+
+    def get(self) -> str:
+        return self.take(1)[0]
+
+    def generate_local(self) -> str:
+        return ''.join(secrets.choice(ALPHABET) for _ in range(self.length))
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+        self._session.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "buffered": len(self._buffer),
+                "hits": self.hits,
+                "misses": self.misses,
+                "fallbacks": self.fallbacks,
+                "refills": self.refills,
+                "refill_errors": self.refill_errors,
+                "refill_seconds_total": round(self.refill_seconds_total, 6),
+                "last_refill_seconds": round(self.last_refill_seconds, 6),
+            }
+
+
+_random_strings = None
+_random_strings_lock = threading.Lock()
+
+
+def get_random_strings() -> RandomStringBuffer:
+    global _random_strings
+    if _random_strings is not None:
+        return _random_strings
+    with _random_strings_lock:
+        if _random_strings is None:
+            _random_strings = RandomStringBuffer()
+        return _random_strings
+
+
+def close_random_strings() -> None:
+    global _random_strings
+    with _random_strings_lock:
+        if _random_strings is not None:
+            _random_strings.close()
+            _random_strings = None
@@ -0,0 +1,266 @@
+import asyncio
+import math
+import os
+import time
+
+from fastapi import Request, Response
+
+from app.cache import LRUCache
+from app.tokens import ACCESS, InvalidToken, decode_token, legacy_tokens_allowed
+
+# Tokens a request costs by "METHOD path"; anything else costs 1. bcrypt and
+# random.org make these the expensive ones.
+DEFAULT_ROUTE_WEIGHTS = {
+    "POST /api/v1/token": 10,
+    "POST /api/v1/users/": 10,
+    "POST /api/v1/calculate/": 2,
+    "POST /api/v1/calculate/batch": 10,
+    "GET /api/v1/records/export": 10,
+}
+
+# Never limited, so monitoring keeps working during overload.
+EXEMPT_PATHS = {"/health", "/ready", "/metrics"}
+
+
+def parse_weights(value: str) -> dict:
+    # "POST /api/v1/token=10,GET /api/v1/records/=2" -> {"POST /api/v1/token": 10, ...}
+    weights = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        route, _, weight = item.rpartition("=")
+        weights[route.strip()] = float(weight)
+    return weights
+
+
+class LocalBuckets:
+    """Token buckets kept in this worker only, least recently used evicted."""
+
+    def __init__(self, maxsize: int = 100000, clock=time.monotonic):
+        self._buckets = LRUCache(maxsize=maxsize)
+        self._clock = clock
+
+    async def take(self, key: str, cost: float, rate: float, burst: float) -> float:
+        # Takes ``cost`` tokens and returns 0, or returns the seconds until
+        # the bucket holds enough and takes nothing.
+        now = self._clock()
+        tokens, updated = self._buckets.get(key) or (burst, now)
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens >= cost:
+            self._buckets.set(key, (tokens - cost, now))
+            return 0.0
+        self._buckets.set(key, (tokens, now))
+        return (cost - tokens) / rate
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+# Same bucket as LocalBuckets.take, atomically on the Redis server's clock.
+TAKE_SCRIPT = """
+local rate, burst, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= cost then tokens = tokens - cost else wait = (cost - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+class SharedBuckets:
+    """Token buckets in Redis, shared by every worker. If Redis fails the
+    worker's own buckets take over, so limits loosen rather than block."""
+
+    def __init__(self, client, prefix: str = "rate-limit:", fallback: LocalBuckets = None):
+        self._client = client
+        self._prefix = prefix
+        self._fallback = fallback or LocalBuckets()
+        self.errors = 0
+
+    async def take(self, key: str, cost: float, rate: float, burst: float) -> float:
+        try:
+            return float(await self._client.eval(TAKE_SCRIPT, 1, f"{self._prefix}{key}", rate, burst, cost))
+        except Exception as e:
+            self.errors += 1
+            print(f"Shared rate limit lookup failed, using this worker's buckets: {e}")
+            return await self._fallback.take(key, cost, rate, burst)
+
+    def __len__(self) -> int:
+        return len(self._fallback)
+
+
+class RateLimiter:
+    """Admission control in front of the database middleware.
+
+    Every request takes its route's weight from a per-IP bucket and, when it
+    carries a valid access token, from its user's bucket; an empty bucket
+    gets a 429 with the seconds until it refills in Retry-After. Admitted
+    requests then need one of ``max_in_flight`` slots, waiting at most
+    ``queue_timeout`` seconds for one before getting a 503, so a surge is
+    shed at the door instead of queuing for pool connections and threads.
+    """
+
+    def __init__(
+        self, user_rate: float = None, user_burst: float = None, ip_rate: float = None, ip_burst: float = None,
+        weights: dict = None, max_in_flight: int = None, queue_timeout: float = None, buckets=None,
+        trust_forwarded: bool = None
+    ):
+        self.user_rate = user_rate or float(os.getenv('RATE_LIMIT_USER_RATE', 10))
+        self.user_burst = user_burst or float(os.getenv('RATE_LIMIT_USER_BURST', 100))
+        self.ip_rate = ip_rate or float(os.getenv('RATE_LIMIT_IP_RATE', 20))
+        self.ip_burst = ip_burst or float(os.getenv('RATE_LIMIT_IP_BURST', 200))
+        if weights is None:
+            weights = dict(DEFAULT_ROUTE_WEIGHTS, **parse_weights(os.getenv('RATE_LIMIT_WEIGHTS', '')))
+        self.weights = weights
+        self.max_in_flight = (
+            int(os.getenv('ADMISSION_MAX_IN_FLIGHT', 100)) if max_in_flight is None else max_in_flight
+        )
+        self.queue_timeout = (
+            float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 0.1)) if queue_timeout is None else queue_timeout
+        )
+        if trust_forwarded is None:
+            trust_forwarded = trust_forwarded_default()
+        self.trust_forwarded = trust_forwarded
+        self.buckets = buckets or LocalBuckets()
+        self._slots = None
+        self.in_flight = 0
+        self.admitted = 0
+        self.limited_ip = 0
+        self.limited_user = 0
+        self.shed = 0
+
+    def _get_slots(self) -> asyncio.Semaphore:
+        # Created on first use so it belongs to the serving event loop.
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+        return self._slots
+
+    def weight(self, method: str, path: str) -> float:
+        return self.weights.get(f"{method} {path}", 1)
+
+    def client_ip(self, request: Request) -> str:
+        # Behind one trusted proxy (Heroku's router) the client is the last
+        # X-Forwarded-For entry; earlier entries are whatever the client sent.
+        forwarded = request.headers.get("x-forwarded-for")
+        if self.trust_forwarded and forwarded:
+            return forwarded.rsplit(",", 1)[-1].strip()
+        return request.client.host if request.client else "unknown"
+
+    @staticmethod
+    def user_key(request: Request) -> str:
+        # The user a bearer token names, checked but without a query; None for
+        # anonymous requests and bad tokens, which only the IP bucket limits.
+        # Legacy tokens are the username itself, so they are keyed by name.
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            return None
+        try:
+            return str(decode_token(token, ACCESS)["sub"])
+        except InvalidToken:
+            if legacy_tokens_allowed() and "." not in token:
+                return f"name:{token}"
+            return None
+
+    async def check(self, request: Request) -> float:
+        # Seconds to wait before retrying, 0 when the request may go ahead.
+        cost = self.weight(request.method, request.url.path)
+        wait = await self.buckets.take(f"ip:{self.client_ip(request)}", cost, self.ip_rate, self.ip_burst)
+        if wait:
+            self.limited_ip += 1
+            return wait
+        user = self.user_key(request)
+        if user is not None:
+            wait = await self.buckets.take(f"user:{user}", cost, self.user_rate, self.user_burst)
+            if wait:
+                self.limited_user += 1
+                return wait
+        return 0.0
+
+    async def acquire(self) -> bool:
+        if not self.max_in_flight:
+            return True
+        slots = self._get_slots()
+        try:
+            if slots.locked() and not self.queue_timeout:
+                raise asyncio.TimeoutError
+            await asyncio.wait_for(slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.shed += 1
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self) -> None:
+        if self.max_in_flight:
+            self.in_flight -= 1
+            self._get_slots().release()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "admitted": self.admitted,
+            "limited_ip": self.limited_ip,
+            "limited_user": self.limited_user,
+            "shed": self.shed,
+            "buckets": len(self.buckets),
+            "shared": isinstance(self.buckets, SharedBuckets),
+        }
+
+
+def trust_forwarded_default() -> bool:
+    # On Heroku (which sets DYNO) every request comes through the router, so
+    # the socket address is the router's and only X-Forwarded-For tells
+    # clients apart.
+    return os.getenv('RATE_LIMIT_TRUST_FORWARDED', 'true' if 'DYNO' in os.environ else 'false').lower() == 'true'
+
+
+def rate_limit_enabled() -> bool:
+    return os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+
+
+def _create_buckets():
+    url = os.getenv('RATE_LIMIT_REDIS_URL')
+    if not url:
+        return LocalBuckets()
+    try:
+        import redis.asyncio
+    except ImportError:
+        print("RATE_LIMIT_REDIS_URL is set but the redis package is not installed; limits will be per worker")
+        return LocalBuckets()
+    return SharedBuckets(redis.asyncio.from_url(url, socket_timeout=0.2))
+
+
+_rate_limiter = None
+
+
+def get_rate_limiter():
+    # None when RATE_LIMIT_ENABLED is false.
+    global _rate_limiter
+    if _rate_limiter is None and rate_limit_enabled():
+        _rate_limiter = RateLimiter(buckets=_create_buckets())
+    return _rate_limiter
+
+
+async def rate_limit_middleware(request: Request, call_next):
+    limiter = get_rate_limiter()
+    if limiter is None or request.url.path in EXEMPT_PATHS:
+        return await call_next(request)
+    wait = await limiter.check(request)
+    if wait:
+        return Response(
+            "Too many requests", status_code=429, headers={"Retry-After": str(max(1, math.ceil(wait)))}
+        )
+    if not await limiter.acquire():
+        return Response("Server busy, try again later", status_code=503, headers={"Retry-After": "1"})
+    limiter.admitted += 1
+    # Streamed bodies (/records/export) finish after the slot is given back;
+    # they hold a connection only per chunk.
+    try:
+        return await call_next(request)
+    finally:
+        limiter.release()
@@ -0,0 +1,119 @@
+import os
+
+from app.cache import LRUCache
+
+
+class LocalGenerations:
+    """Per-user invalidation counters kept in this worker only."""
+
+    def __init__(self):
+        self._generations = {}
+
+    async def get(self, user_id: int) -> int:
+        return self._generations.get(user_id, 0)
+
+    async def bump(self, user_id: int) -> None:
+        self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+
+class SharedGenerations:
+    """Per-user invalidation counters in Redis (or anything speaking its
+    GET/INCR), so a write in one worker invalidates every worker's entries."""
+
+    def __init__(self, client, prefix: str = "records-cache:gen:"):
+        self._client = client
+        self._prefix = prefix
+
+    async def get(self, user_id: int) -> int:
+        value = await self._client.get(f"{self._prefix}{user_id}")
+        return int(value or 0)
+
+    async def bump(self, user_id: int) -> None:
+        await self._client.incr(f"{self._prefix}{user_id}")
+
+
+class RecordsCache:
+    """Per-worker read-through cache of a user's records pages.
+
+    Keys include the user's current generation; invalidating a user bumps it,
+    which makes every cached page of that user unreachable at once (the stale
+    entries age out of the LRU). If the generation store fails the cache is
+    bypassed rather than risking stale pages.
+    """
+
+    def __init__(self, maxsize: int = None, ttl: float = None, generations=None, enabled: bool = None):
+        self.enabled = os.getenv('RECORDS_CACHE_ENABLED', 'true').lower() == 'true' if enabled is None else enabled
+        self._pages = LRUCache(
+            maxsize=int(os.getenv('RECORDS_CACHE_SIZE', 10000)) if maxsize is None else maxsize,
+            ttl=float(os.getenv('RECORDS_CACHE_TTL', 5)) if ttl is None else ttl,
+        )
+        self._generations = generations or LocalGenerations()
+        self.invalidations = 0
+        self.errors = 0
+
+    async def _generation(self, user_id: int):
+        try:
+            return await self._generations.get(user_id)
+        except Exception as e:
+            self.errors += 1
+            print(f"Records cache generation lookup failed: {e}")
+            return None
+
+    async def get_or_load(self, user_id: int, key: tuple, loader):
+        if not self.enabled:
+            return await loader()
+        generation = await self._generation(user_id)
+        if generation is None:
+            return await loader()
+        cache_key = (user_id, generation) + key
+        value = self._pages.get(cache_key)
+        if value is None:
+            value = await loader()
+            self._pages.set(cache_key, value)
+        return value
+
+    async def invalidate(self, user_id: int) -> None:
+        if not self.enabled:
+            return
+        self.invalidations += 1
+        try:
+            await self._generations.bump(user_id)
+        except Exception as e:
+            # Other workers may serve this user's old pages until the TTL ends.
+            self.errors += 1
+            print(f"Records cache invalidation failed: {e}")
+
+    def clear(self) -> None:
+        self._pages.clear()
+
+    def stats(self) -> dict:
+        return dict(
+            self._pages.stats(),
+            invalidations=self.invalidations,
+            errors=self.errors,
+            enabled=self.enabled,
+            shared=isinstance(self._generations, SharedGenerations),
+        )
+
+
+def _create_generations():
+    url = os.getenv('RECORDS_CACHE_REDIS_URL')
+    if not url:
+        return LocalGenerations()
+    try:
+        import redis.asyncio
+    except ImportError:
+        print("RECORDS_CACHE_REDIS_URL is set but the redis package is not installed; "
+              "invalidation will be per worker")
+        return LocalGenerations()
+    return SharedGenerations(redis.asyncio.from_url(url, socket_timeout=0.2))
+
+
+_records_cache = None
+
+
+def get_records_cache() -> RecordsCache:
+    global _records_cache
+    if _records_cache is None:
+        _records_cache = RecordsCache(generations=_create_generations())
+    return _records_cache
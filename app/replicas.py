@@ -0,0 +1,330 @@
+import asyncio
+import contextvars
+import itertools
+import os
+import threading
+
+import mysql.connector
+from mysql.connector import Error
+
+from app.cache import LRUCache
+
+
+# Query intents declared by every crud function, used by app/dal.py to route
+# it. Undeclared functions are treated as writes.
+READ = "read"
+READ_PRIMARY = "read_primary"
+WRITE = "write"
+
+
+def reads(func):
+    # Read-only and fine with slightly stale data: may run on a replica.
+    func.intent = READ
+    return func
+
+
+def reads_primary(func):
+    # Read-only, but must see the latest writes (uniqueness checks, logins,
+    # lookups right before a write): runs on the primary.
+    func.intent = READ_PRIMARY
+    return func
+
+
+def writes(func):
+    # Runs on the primary, and keeps the request and its user off replicas
+    # for the sticky window.
+    func.intent = WRITE
+    return func
+
+
+def parse_hosts(value: str) -> list:
+    # "db-replica-1,db-replica-2:3307" -> [("db-replica-1", 3306), ("db-replica-2", 3307)]
+    hosts = []
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        host, _, port = item.partition(":")
+        hosts.append((host, int(port or 3306)))
+    return hosts
+
+
+class Replica:
+    def __init__(self, name: str, dbconfig: dict, pool=None):
+        self.name = name
+        self.dbconfig = dbconfig
+        self.pool = pool
+        # Unhealthy until the first check says otherwise.
+        self.healthy = False
+        self.lag = None
+        self.checks = 0
+        self.failures = 0
+        self.last_error = None
+        self.probe_connection = None
+
+    def mark_down(self, error: str) -> None:
+        self.healthy = False
+        self.failures += 1
+        self.last_error = error
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "healthy": self.healthy,
+            "lag": self.lag,
+            "checks": self.checks,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "pool": self.pool.stats() if self.pool is not None else None,
+        }
+
+
+def replication_lag(replica: Replica) -> float:
+    # Seconds the replica is behind, None when replication is stopped. A server
+    # that is not replicating at all (a stand-in replica) reports no lag.
+    connection = replica.probe_connection
+    if connection is None or not connection.is_connected():
+        connection = replica.probe_connection = mysql.connector.connect(**replica.dbconfig, connection_timeout=2)
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute("SHOW REPLICA STATUS")
+    except Error:
+        # Before MySQL 8.0.22.
+        cursor.execute("SHOW SLAVE STATUS")
+    rows = cursor.fetchall()
+    if not rows:
+        return 0.0
+    lag = rows[0].get("Seconds_Behind_Source", rows[0].get("Seconds_Behind_Master"))
+    return None if lag is None else float(lag)
+
+
+class SharedStickiness:
+    """Users who just wrote, in Redis (or anything speaking its SET/EXISTS),
+    so a write on one worker keeps the user's reads on the primary on every
+    worker."""
+
+    def __init__(self, client, prefix: str = "replica-sticky:"):
+        self._client = client
+        self._prefix = prefix
+
+    async def stick(self, user_id: int, seconds: float) -> None:
+        await self._client.set(f"{self._prefix}{user_id}", 1, px=max(1, int(seconds * 1000)))
+
+    async def is_sticky(self, user_id: int) -> bool:
+        return bool(await self._client.exists(f"{self._prefix}{user_id}"))
+
+
+class ReplicaSet:
+    """Replica pools for read-only queries, with health checks.
+
+    A background thread probes every replica's replication lag each
+    ``check_interval`` seconds; replicas that are unreachable, not
+    replicating or more than ``max_lag`` seconds behind get no reads until a
+    later check passes. With no healthy replica reads go to the primary.
+    Users who just wrote are kept on the primary for ``sticky_seconds`` so
+    they read their own writes: by this worker, and by every worker when a
+    ``shared`` store is given. If the shared store fails reads go to the
+    primary rather than risking stale data.
+    """
+
+    def __init__(
+        self, replicas: list, max_lag: float = None, check_interval: float = None, sticky_seconds: float = None,
+        probe=replication_lag, shared: SharedStickiness = None
+    ):
+        self.replicas = replicas
+        self.max_lag = max_lag if max_lag is not None else float(os.getenv('DB_REPLICA_MAX_LAG', 2))
+        self.check_interval = check_interval or float(os.getenv('DB_REPLICA_CHECK_INTERVAL', 1))
+        if sticky_seconds is None:
+            sticky_seconds = float(os.getenv('DB_REPLICA_STICKY_SECONDS', 5))
+        self.sticky_seconds = sticky_seconds
+        self._sticky = LRUCache(maxsize=100000, ttl=sticky_seconds)
+        self._shared = shared
+        self.sticky_errors = 0
+        self._probe = probe
+        self._round_robin = itertools.count()
+        self._stop = threading.Event()
+        self._thread = None
+        self.routed = 0
+        self.fallbacks = 0
+
+    def check(self) -> None:
+        for replica in self.replicas:
+            try:
+                lag = self._probe(replica)
+            except Exception as e:
+                replica.mark_down(str(e))
+                replica.probe_connection = None
+                continue
+            replica.checks += 1
+            replica.lag = lag
+            if lag is None:
+                replica.mark_down("Replication is not running")
+            elif lag > self.max_lag:
+                replica.mark_down(f"Replication lag {lag}s exceeds {self.max_lag}s")
+            else:
+                replica.healthy = True
+
+    def _run(self) -> None:
+        while True:
+            self.check()
+            if self._stop.wait(self.check_interval):
+                return
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="replica-health", daemon=True)
+        self._thread.start()
+
+    def choose(self):
+        # Round-robin over healthy replicas; None sends the read to the primary.
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._round_robin) % len(healthy)]
+
+    async def stick(self, user_id: int) -> None:
+        self._sticky.set(user_id, True)
+        if self._shared is not None:
+            try:
+                await self._shared.stick(user_id, self.sticky_seconds)
+            except Exception as e:
+                self.sticky_errors += 1
+                print(f"Shared replica stickiness update failed: {e}")
+
+    async def is_sticky(self, user_id: int) -> bool:
+        if self._sticky.get(user_id) is not None:
+            return True
+        if self._shared is None:
+            return False
+        try:
+            return await self._shared.is_sticky(user_id)
+        except Exception as e:
+            self.sticky_errors += 1
+            print(f"Shared replica stickiness lookup failed, reading from the primary: {e}")
+            return True
+
+    def close(self) -> None:
+        self._stop.set()
+        for replica in self.replicas:
+            if replica.probe_connection is not None:
+                try:
+                    replica.probe_connection.close()
+                except Error:
+                    pass
+
+    def stats(self) -> dict:
+        return {
+            "replicas": len(self.replicas),
+            "healthy": sum(replica.healthy for replica in self.replicas),
+            "routed": self.routed,
+            "fallbacks": self.fallbacks,
+            "sticky_users": len(self._sticky),
+            "sticky_shared": self._shared is not None,
+            "sticky_errors": self.sticky_errors,
+            "hosts": [replica.stats() for replica in self.replicas],
+        }
+
+
+class RequestRouting:
+    """What app/dal.py needs to route one request's queries: its primary
+    connection, its user once known, whether it wrote, and the replica
+    connection lent to it for the rest of the request."""
+
+    def __init__(self, primary):
+        self.primary = primary
+        self.user_id = None
+        self.wrote = False
+        self.replica = None
+        self.replica_connection = None
+
+
+_routing = contextvars.ContextVar("request_routing", default=None)
+
+
+def begin_request(primary) -> RequestRouting:
+    routing = RequestRouting(primary)
+    _routing.set(routing)
+    return routing
+
+
+def current_request():
+    return _routing.get()
+
+
+def set_request_user(user_id: int) -> None:
+    routing = _routing.get()
+    if routing is not None:
+        routing.user_id = user_id
+
+
+async def stick_user(user_id: int) -> None:
+    # For writes whose request does not know the user (app/dal.py sticks the
+    # request's user after every write on its own).
+    replica_set = await get_replica_set()
+    if replica_set is not None:
+        await replica_set.stick(user_id)
+
+
+def _create_shared_stickiness():
+    # The records cache's Redis by default: its invalidations only help other
+    # workers if their reloads see the write too.
+    url = os.getenv('DB_REPLICA_STICKY_REDIS_URL') or os.getenv('RECORDS_CACHE_REDIS_URL')
+    if not url:
+        return None
+    try:
+        import redis.asyncio
+    except ImportError:
+        print("DB_REPLICA_STICKY_REDIS_URL is set but the redis package is not installed; "
+              "read-your-writes will be per worker")
+        return None
+    return SharedStickiness(redis.asyncio.from_url(url, socket_timeout=0.2))
+
+
+_replica_set = None
+_replica_set_loaded = False
+_replica_set_lock = None
+
+
+async def init_replica_set():
+    # None unless DB_REPLICA_HOSTS lists replicas. Replicas share the
+    # primary's database name and credentials.
+    global _replica_set, _replica_set_loaded, _replica_set_lock
+    if _replica_set_lock is None:
+        _replica_set_lock = asyncio.Lock()
+    async with _replica_set_lock:
+        if _replica_set_loaded:
+            return _replica_set
+        from app.async_database import AsyncConnectionPool
+        from app.dal import use_async_driver
+        from app.database import ConnectionPool, get_db_config, worker_pool_size
+
+        size = worker_pool_size()
+        timeout = float(os.getenv('DB_REPLICA_POOL_TIMEOUT', 0.5))
+        recycle = float(os.getenv('DB_POOL_RECYCLE', 3600))
+        replicas = []
+        for host, port in parse_hosts(os.getenv('DB_REPLICA_HOSTS', '')):
+            config = dict(get_db_config(), host=host, port=port)
+            if use_async_driver():
+                pool = await AsyncConnectionPool.create(config, size=size, timeout=timeout, recycle=recycle)
+            else:
+                pool = ConnectionPool(config, size=size, timeout=timeout, recycle=recycle)
+            replicas.append(Replica(f"{host}:{port}", config, pool))
+        if replicas:
+            _replica_set = ReplicaSet(replicas, shared=_create_shared_stickiness())
+            _replica_set.start()
+            print(f"Routing reads to {len(replicas)} replica(s)")
+        _replica_set_loaded = True
+        return _replica_set
+
+
+async def get_replica_set():
+    return _replica_set if _replica_set_loaded else await init_replica_set()
+
+
+async def close_replica_set() -> None:
+    global _replica_set, _replica_set_loaded
+    if _replica_set is not None:
+        _replica_set.close()
+        for replica in _replica_set.replicas:
+            # ConnectionPool.close is sync, AsyncConnectionPool.close a coroutine.
+            result = replica.pool.close()
+            if result is not None:
+                await result
+    _replica_set = None
+    _replica_set_loaded = False
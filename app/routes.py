@@ -1,71 +1,142 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, status, Request, Response, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from app import crud, schemas
-from app.auth import get_current_user, authenticate_user, get_password_hash
+from app import dal, schemas
+from app.catalog import operation_catalog
+from app.export import EXPORT_FORMATS, encode_export, iter_export_rows
+from app.pagination import RECORD_SORTS, encode_cursor, decode_cursor
+from app.records_cache import get_records_cache
+from app.serialization import OPERATION, RECORD, STORED_RECORD, TOKEN, USER, FastJSONResponse
+from app.replicas import stick_user
+from app.auth import (
+    get_current_user, authenticate_user, create_tokens, get_user_from_token, update_cached_balance,
+    invalidate_user
+)
+from app.hashing import HasherBusy, get_password_hasher
+from app.idempotency import (
+    IDEMPOTENCY_KEY_MAX_LENGTH, IdempotencyKeyReused, calculate_calls, idempotency_key_ttl, request_hash
+)
+from app.tokens import REFRESH
 from fastapi.security import OAuth2PasswordRequestForm
+from app.metrics import run_in_threadpool
 from app.consts import Status
-from app.utils import perform_operation
+from app.random_strings import RandomStringUnavailable
+from app.utils import perform_operation, perform_operations
+from app.write_behind import WriteBehindFull, get_write_behind
 
 router = APIRouter()
 
 
 class CalculateRequest(BaseModel):
     operation_id: int
+    # Numbers or numeric strings; strings keep full precision in decimal mode.
+    operands: Optional[List[Decimal]] = None
 
 
-@router.post("/token", response_model=schemas.User)
-def login_for_access_token(
+@router.post("/token", response_model=schemas.Token)
+async def login_for_access_token(
     request: Request, form_data: OAuth2PasswordRequestForm = Depends()
 ):
     connection = request.state.db
-    user = authenticate_user(connection, form_data.username, form_data.password)
+    try:
+        user = await authenticate_user(connection, form_data.username, form_data.password)
+    except HasherBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials"
         )
-    return user
+    return FastJSONResponse(TOKEN.dumps(dict(user, **create_tokens(user))))
+
+
+@router.post("/token/refresh", response_model=schemas.Token)
+async def refresh_access_token(request: Request, refresh_request: schemas.RefreshRequest):
+    connection = request.state.db
+    user = await get_user_from_token(connection, refresh_request.refresh_token, token_type=REFRESH)
+    return FastJSONResponse(TOKEN.dumps(dict(user, **create_tokens(user))))
 
 
 @router.post("/users/", response_model=schemas.User)
-def create_user(request: Request, user: schemas.UserCreate):
+async def create_user(request: Request, user: schemas.UserCreate):
     connection = request.state.db
-    db_user = crud.get_user_by_username(connection, user.username)
+    db_user = await dal.run("get_user_by_username", connection, user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
-    hashed_password = get_password_hash(user.password)
-    return crud.create_user(
-        connection, user=user, hashed_password=hashed_password, status=Status.ACTIVE
+    try:
+        hashed_password = await get_password_hasher().hash(user.password)
+    except HasherBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    created_user = await dal.run(
+        "create_user", connection, user=user, hashed_password=hashed_password, status=Status.ACTIVE
+    )
+    return FastJSONResponse(USER.dumps(created_user))
+
+
+@router.get("/users/me/usage", response_model=schemas.Usage)
+async def read_usage(request: Request, user: dict = Depends(get_current_user)):
+    connection = request.state.db
+    rows = await dal.run("get_user_usage", connection, user_id=user['id'])
+    catalog = await operation_catalog.snapshot(connection)
+    operations = [
+        schemas.OperationUsage(operation_type=(catalog.get(row['operation_id']) or {}).get('type'), **row)
+        for row in rows
+    ]
+    return schemas.Usage(
+        calls=sum(op.calls for op in operations),
+        total_amount=sum(op.total_amount for op in operations),
+        last_activity=max((op.last_created_at for op in operations if op.last_created_at), default=None),
+        operations=operations,
     )
 
 
-@router.get("/operations/", response_model=list)
-def read_operations(request: Request, skip: int = 0, limit: int = 10):
+@router.get("/operations/", response_model=List[schemas.Operation])
+async def read_operations(request: Request, skip: int = 0, limit: int = 10):
     connection = request.state.db
-    operations = crud.get_operations(connection, skip=skip, limit=limit)
-    return operations
+    catalog = await operation_catalog.snapshot(connection)
+    if_none_match = request.headers.get("if-none-match", "")
+    if catalog.etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": catalog.etag})
+    return FastJSONResponse(OPERATION.dumps_many(catalog.list(skip=skip, limit=limit)), headers={"ETag": catalog.etag})
 
 
 @router.post("/operations/", response_model=schemas.Operation)
-def create_operation(request: Request, operation: schemas.OperationCreate):
+async def create_operation(request: Request, operation: schemas.OperationCreate):
     connection = request.state.db
-    operation_id = crud.create_operation(connection, operation=operation)
+    operation_id = await dal.run("create_operation", connection, operation=operation)
     created_operation = {
         "id": operation_id,
         "type": operation.type,
         "cost": operation.cost
     }
-    return created_operation
+    operation_catalog.add(created_operation)
+    return FastJSONResponse(OPERATION.dumps(created_operation))
 
 
-@router.post("/calculate/", response_model=schemas.Record)
-def calculate(
-    request: Request, calc_request: CalculateRequest, user: dict = Depends(get_current_user)
-):
-    connection = request.state.db
-    operations = crud.get_operations(connection)
-    operation = next(
-        (op for op in operations if op['id'] == calc_request.operation_id), None
-    )
+async def charge_records(connection, user_id: int, items: list, idempotency_key: str = None) -> list:
+    # Debits the balance for (operation_id, amount, operation_response) items
+    # and returns their records, or None when the balance is short. With
+    # write-behind the debit commits here once the records are in the queue's
+    # log; a full queue rolls the debit back and answers 503.
+    write_behind = get_write_behind()
+    if write_behind is None:
+        return await dal.run("create_charged_records", connection, user_id=user_id, items=items)
+    ids = await run_in_threadpool(write_behind.allocate_ids, len(items))
+    try:
+        return await dal.run(
+            "charge_records", connection, user_id=user_id, items=items, ids=ids, idempotency_key=idempotency_key,
+            journal=write_behind
+        )
+    except WriteBehindFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+
+async def run_calculation(connection, calc_request: CalculateRequest, user: dict, idempotency_key: str = None):
+    operation = await operation_catalog.get(connection, calc_request.operation_id)
     if not operation:
         raise HTTPException(status_code=404, detail="Operation not found")
 
@@ -73,41 +144,225 @@ def calculate(
         raise HTTPException(status_code=400, detail="Insufficient balance")
 
     try:
-        result = perform_operation(operation['type'])
+        # Off the event loop: random_string may wait for a buffer refill.
+        result = await run_in_threadpool(perform_operation, operation['type'], calc_request.operands)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except RandomStringUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    if get_write_behind():
+        records = await charge_records(
+            connection, user['id'], [(operation['id'], operation['cost'], result)], idempotency_key=idempotency_key
+        )
+        record = records[0] if records else None
+    else:
+        record = await dal.run(
+            "create_charged_record",
+            connection,
+            user_id=user['id'],
+            operation_id=operation['id'],
+            amount=operation['cost'],
+            operation_response=result,
+            idempotency_key=idempotency_key
+        )
+    if not record:
+        invalidate_user(user['id'])
+        raise HTTPException(status_code=400, detail="Insufficient balance")
+    update_cached_balance(user['id'], record['user_balance'])
+    await get_records_cache().invalidate(user['id'])
+    return record
+
+
+async def run_idempotent_calculation(
+    connection, calc_request: CalculateRequest, user: dict, key: str, body_hash: str
+) -> tuple:
+    # Returns (record, replayed). A key used before returns its stored record
+    # without evaluating or charging anything, if it came with the same body.
+    try:
+        stored = await dal.run(
+            "claim_idempotency_key", connection, user_id=user['id'], key=key, ttl=idempotency_key_ttl(),
+            request_hash=body_hash
+        )
+    except IdempotencyKeyReused as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if stored:
+        return stored, True
+    try:
+        return await run_calculation(connection, calc_request, user, idempotency_key=key), False
+    except Exception:
+        # Failed requests are not stored; a retry runs again.
+        await dal.run("release_idempotency_key", connection)
+        raise
 
-    new_balance = user['balance'] - operation['cost']
-    crud.update_user_balance(connection, user['id'], new_balance)
 
-    record = schemas.RecordCreate(
-        operation_id=operation['id'],
-        user_id=user['id'],
-        amount=operation['cost'],
-        user_balance=new_balance,
-        operation_response=result
+@router.post("/calculate/", response_model=schemas.Record)
+async def calculate(
+    request: Request, calc_request: CalculateRequest, user: dict = Depends(get_current_user),
+    idempotency_key: str = Header(None)
+):
+    connection = request.state.db
+    if idempotency_key is None:
+        return FastJSONResponse(RECORD.dumps(await run_calculation(connection, calc_request, user)))
+    if not 0 < len(idempotency_key) <= IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(
+            status_code=400, detail=f"Idempotency-Key must be 1 to {IDEMPOTENCY_KEY_MAX_LENGTH} characters"
+        )
+    # Duplicates arriving while the first request runs wait for its outcome;
+    # the same key with another body waits on the key's row instead, and is
+    # refused once the first has stored its response.
+    body_hash = request_hash(calc_request.dict())
+    (record, replayed), shared = await calculate_calls.run(
+        (user['id'], idempotency_key, body_hash),
+        lambda: run_idempotent_calculation(connection, calc_request, user, idempotency_key, body_hash)
+    )
+    headers = {"Idempotent-Replayed": "true"} if replayed or shared else None
+    return FastJSONResponse(RECORD.dumps(record), headers=headers)
+
+
+@router.post("/calculate/batch", response_model=schemas.CalculateBatchResult)
+async def calculate_batch(
+    request: Request, calc_requests: List[CalculateRequest], user: dict = Depends(get_current_user)
+):
+    # Items that fail (unknown operation, evaluation error) are reported
+    # individually; the rest are charged together in one transaction.
+    max_items = int(os.getenv('CALCULATE_BATCH_MAX_ITEMS', 100))
+    if not calc_requests:
+        raise HTTPException(status_code=400, detail="Empty batch")
+    if len(calc_requests) > max_items:
+        raise HTTPException(status_code=400, detail=f"Batch is limited to {max_items} items")
+
+    connection = request.state.db
+    results = [schemas.CalculateBatchItem(index=index) for index in range(len(calc_requests))]
+    operations = {}
+    for item, calc_request in zip(results, calc_requests):
+        operation = await operation_catalog.get(connection, calc_request.operation_id)
+        if operation:
+            operations[item.index] = operation
+        else:
+            item.error = "Operation not found"
+
+    values = await run_in_threadpool(
+        perform_operations,
+        [(operation['type'], calc_requests[index].operands) for index, operation in operations.items()]
     )
-    record_id = crud.create_record(connection, record=record)
-    record = crud.get_record(connection, record_id)
-    return schemas.Record(**record)
+    charged = []
+    for (index, operation), value in zip(operations.items(), values):
+        if isinstance(value, Exception):
+            results[index].error = str(value)
+        else:
+            charged.append((index, (operation['id'], operation['cost'], value)))
+
+    total = sum(item[1] for _, item in charged)
+    if user['balance'] < total:
+        raise HTTPException(status_code=400, detail="Insufficient balance")
+
+    user_balance = user['balance']
+    if charged:
+        records = await charge_records(connection, user['id'], [item for _, item in charged])
+        if records is None:
+            invalidate_user(user['id'])
+            raise HTTPException(status_code=400, detail="Insufficient balance")
+        for (index, _), record in zip(charged, records):
+            results[index].record = schemas.Record(**record)
+        user_balance = records[-1]['user_balance']
+        update_cached_balance(user['id'], user_balance)
+        await get_records_cache().invalidate(user['id'])
+    return schemas.CalculateBatchResult(results=results, total_amount=total, user_balance=user_balance)
 
 
 @router.delete("/records/{id}", response_model=schemas.Record)
-def delete_record(request: Request, id: int):
+async def delete_record(request: Request, id: int):
     connection = request.state.db
-    record = crud.get_record(connection, record_id=id)
+    record = await dal.run("get_record", connection, record_id=id)
     if not record:
         raise HTTPException(status_code=404, detail="Record not found")
 
-    return crud.soft_delete_record(connection, record_id=id)
+    record = await dal.run("soft_delete_record", connection, record_id=id)
+    if not record:
+        # Archived in between.
+        raise HTTPException(status_code=404, detail="Record not found")
+    await stick_user(record['user_id'])
+    await get_records_cache().invalidate(record['user_id'])
+    return FastJSONResponse(RECORD.dumps(record))
 
 
-@router.get("/records/", response_model=list)
-def read_records(
-    request: Request, skip: int = 0, limit: int = 10, search: str = None, user: dict = Depends(get_current_user)
+def parse_date_bound(value: str, name: str, end: bool = False) -> datetime:
+    # Accepts a date or a datetime; a date-only upper bound covers the whole day.
+    try:
+        if len(value) == 10:
+            day = datetime.fromisoformat(value)
+            return day + timedelta(days=1) if end else day
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be an ISO date or datetime")
+
+
+@router.get("/records/", response_model=List[schemas.StoredRecord])
+async def read_records(
+    request: Request, skip: int = 0, limit: int = 10, search: str = None, cursor: str = None,
+    sort: str = "created_at", operation_id: int = None, min_amount: float = None, max_amount: float = None,
+    from_date: str = Query(None, alias="from"), to_date: str = Query(None, alias="to"), include_archived: bool = False,
+    user: dict = Depends(get_current_user)
 ):
     connection = request.state.db
-    records = crud.get_records(
-        connection, skip=skip, limit=limit, search=search, user_id=user['id']
+    if sort not in RECORD_SORTS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(RECORD_SORTS)}")
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor, sort)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    async def load() -> tuple:
+        # The page's JSON body and next cursor. Fetch one extra row to know
+        # whether there is a next page.
+        records = await dal.run(
+            "get_records", connection, skip=skip, limit=limit + 1, search=search, user_id=user['id'], sort=sort,
+            after=after, operation_id=operation_id, min_amount=min_amount, max_amount=max_amount,
+            from_date=parse_date_bound(from_date, "from") if from_date else None,
+            to_date=parse_date_bound(to_date, "to", end=True) if to_date else None, include_archived=include_archived
+        )
+        next_cursor = None
+        if 0 < limit < len(records):
+            records = records[:limit]
+            next_cursor = encode_cursor(records[-1], sort)
+        return STORED_RECORD.dumps_many(records), next_cursor
+
+    if after is None and operation_id is None and min_amount is None and max_amount is None \
+            and from_date is None and to_date is None:
+        # Plain pages (above all the default first one, re-read after every
+        # calculation) are served from the per-user cache.
+        body, next_cursor = await get_records_cache().get_or_load(
+            user['id'], (skip, limit, search, sort, include_archived), load
+        )
+    else:
+        body, next_cursor = await load()
+    return FastJSONResponse(body, headers={"X-Next-Cursor": next_cursor} if next_cursor else None)
+
+
+@router.get("/records/export")
+async def export_records(
+    export_format: str = Query("ndjson", alias="format"), gzip: bool = False, operation_id: int = None,
+    min_amount: float = None, max_amount: float = None, from_date: str = Query(None, alias="from"),
+    to_date: str = Query(None, alias="to"), include_archived: bool = False, user: dict = Depends(get_current_user)
+):
+    # The request's own connection is only used for authentication; rows are
+    # read in keyset chunks, each on a connection checked out just for it.
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    media_type, extension = EXPORT_FORMATS[export_format]
+    rows = iter_export_rows(
+        user['id'], chunk_size=int(os.getenv('EXPORT_CHUNK_SIZE', 1000)), operation_id=operation_id,
+        min_amount=min_amount, max_amount=max_amount,
+        from_date=parse_date_bound(from_date, "from") if from_date else None,
+        to_date=parse_date_bound(to_date, "to", end=True) if to_date else None, include_archived=include_archived
+    )
+    filename = f"records.{extension}"
+    if gzip:
+        media_type, filename = "application/gzip", filename + ".gz"
+    return StreamingResponse(
+        encode_export(rows, export_format, gzip=gzip), media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
     )
-    return records
@@ -1,4 +1,5 @@
-from typing import Optional
+from datetime import datetime
+from typing import List, Optional
 
 from pydantic import BaseModel
 
@@ -18,6 +19,17 @@ class User(BaseModel):
         orm_mode = True
 
 
+class Token(User):
+    access_token: str
+    refresh_token: str
+    token_type: str
+    expires_in: int
+
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+
 class OperationCreate(BaseModel):
     type: str
     cost: float
@@ -51,3 +63,35 @@ class Record(BaseModel):
 
     class Config:
         orm_mode = True
+
+
+class StoredRecord(Record):
+    # A record as read back from the records table.
+    created_at: Optional[datetime] = None
+
+
+class CalculateBatchItem(BaseModel):
+    index: int
+    record: Optional[Record] = None
+    error: Optional[str] = None
+
+
+class CalculateBatchResult(BaseModel):
+    results: List[CalculateBatchItem]
+    total_amount: float
+    user_balance: Optional[float] = None
+
+
+class OperationUsage(BaseModel):
+    operation_id: int
+    operation_type: Optional[str] = None
+    calls: int
+    total_amount: float
+    last_created_at: Optional[datetime] = None
+
+
+class Usage(BaseModel):
+    calls: int
+    total_amount: float
+    last_activity: Optional[datetime] = None
+    operations: List[OperationUsage]
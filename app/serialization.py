@@ -0,0 +1,82 @@
+import json
+from datetime import datetime
+
+from starlette.responses import JSONResponse
+
+from app import schemas
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(content) -> bytes:
+    # orjson when installed, else the stdlib with JSONResponse's settings.
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson, taking ready-made JSON bytes as is.
+
+    Endpoints that return one (built by a Serializer) skip FastAPI's
+    response_model validation and jsonable_encoder; the response_model then
+    only documents the response.
+    """
+
+    def render(self, content) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
+
+
+def _isoformat(value):
+    return value if isinstance(value, str) else value.isoformat()
+
+
+# What pydantic validation plus jsonable_encoder make of each field type.
+_CONVERTERS = {int: int, float: float, bool: bool, str: str, datetime: _isoformat}
+
+
+def _nullable(convert):
+    return lambda value: None if value is None else convert(value)
+
+
+class Serializer:
+    """Encodes crud rows as JSON for one response model, field by field.
+
+    The per-field conversions (Decimal to float, 0/1 to bool, datetime to ISO
+    string) are worked out once from the model, so encoding a row is a dict
+    comprehension instead of building and validating a model instance and
+    walking it with jsonable_encoder. Rows must already hold valid values:
+    this converts, it does not validate.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._fields = []
+        for name, field in model.__fields__.items():
+            convert = _CONVERTERS[field.type_]
+            if field.allow_none:
+                convert = _nullable(convert)
+            self._fields.append((name, field.default, convert))
+
+    def to_dict(self, row: dict) -> dict:
+        get = row.get
+        return {name: convert(get(name, default)) for name, default, convert in self._fields}
+
+    def dumps(self, row: dict) -> bytes:
+        return dumps(self.to_dict(row))
+
+    def dumps_many(self, rows: list) -> bytes:
+        to_dict = self.to_dict
+        return dumps([to_dict(row) for row in rows])
+
+
+RECORD = Serializer(schemas.Record)
+STORED_RECORD = Serializer(schemas.StoredRecord)
+USER = Serializer(schemas.User)
+TOKEN = Serializer(schemas.Token)
+OPERATION = Serializer(schemas.Operation)
@@ -0,0 +1,135 @@
+import os
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from mysql.connector import Error
+
+EXPLAINABLE = ("SELECT", "UPDATE", "DELETE")
+
+
+class SlowQueryLog:
+    """Bounded ring buffer of statements slower than ``threshold`` seconds.
+
+    Entries carry the normalized SQL, the types of the parameters (never their
+    values), the duration and, with ``explain``, the EXPLAIN plan taken on the
+    same connection right after the statement. With ``fail_on_full_scan``
+    every statement is explained and full table scans outside
+    ``full_scan_allow`` are collected in ``full_scans`` for tests to assert on.
+    """
+
+    def __init__(self, enabled: bool = None, threshold: float = None, explain: bool = None, size: int = None,
+                 fail_on_full_scan: bool = None, full_scan_allow: set = None):
+        self.enabled = os.getenv('SLOW_QUERY_LOG', 'false').lower() == 'true' if enabled is None else enabled
+        self.threshold = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', 200)) / 1000 if threshold is None else threshold
+        self.explain = os.getenv('SLOW_QUERY_EXPLAIN', 'true').lower() == 'true' if explain is None else explain
+        size = int(os.getenv('SLOW_QUERY_LOG_SIZE', 200)) if size is None else size
+        if fail_on_full_scan is None:
+            fail_on_full_scan = os.getenv('SLOW_QUERY_FAIL_ON_FULL_SCAN', 'false').lower() == 'true'
+        self.fail_on_full_scan = fail_on_full_scan
+        if full_scan_allow is None:
+            full_scan_allow = {t for t in os.getenv('SLOW_QUERY_FULL_SCAN_ALLOW', 'operations').split(',') if t}
+        self.full_scan_allow = full_scan_allow
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.full_scans = []
+        self.recorded = 0
+
+    @property
+    def active(self) -> bool:
+        return self.enabled or self.fail_on_full_scan
+
+    def cursor(self, connection, **kwargs):
+        if not self.active:
+            return connection.cursor(**kwargs)
+        if self.explain or self.fail_on_full_scan:
+            # EXPLAIN runs on the same connection, so the statement's own
+            # result must already be read.
+            kwargs["buffered"] = True
+        return RecordingCursor(connection.cursor(**kwargs), connection, self)
+
+    def observe(self, connection, sql: str, params, duration: float) -> None:
+        slow = self.enabled and duration >= self.threshold
+        if not slow and not self.fail_on_full_scan:
+            return
+        normalized = normalize_sql(sql)
+        plan = None
+        if (self.explain and slow or self.fail_on_full_scan) and normalized.upper().startswith(EXPLAINABLE):
+            plan = explain(connection, sql, params)
+        if self.fail_on_full_scan and plan:
+            tables = [row.get("table") for row in plan if row.get("type") == "ALL"]
+            # <derived2>, <union2,3>: reading back a subquery's already-limited result.
+            if any(table not in self.full_scan_allow and not str(table).startswith("<") for table in tables):
+                self.full_scans.append({"sql": normalized, "tables": tables})
+        if slow:
+            entry = {
+                "at": datetime.now(timezone.utc).isoformat(),
+                "sql": normalized,
+                "params": params_shape(params),
+                "duration_ms": round(duration * 1000, 3),
+                "plan": plan,
+            }
+            with self._lock:
+                self._entries.append(entry)
+                self.recorded += 1
+
+    def entries(self) -> list:
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        self.full_scans.clear()
+
+
+class RecordingCursor:
+    def __init__(self, cursor, connection, log: SlowQueryLog):
+        self._cursor = cursor
+        self._connection = connection
+        self._log = log
+
+    def execute(self, operation, params=None, **kwargs):
+        started = time.perf_counter()
+        result = self._cursor.execute(operation, params, **kwargs)
+        self._log.observe(self._connection, operation, params, time.perf_counter() - started)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def normalize_sql(sql: str) -> str:
+    sql = re.sub(r"\s+", " ", sql).strip()
+    # Multi-row VALUES lists collapse to their first row.
+    return re.sub(r"(\([^()]*\))(?:, \1)+", r"\1, ...", sql)
+
+
+def params_shape(params) -> list:
+    if params is None:
+        return []
+    shape = [type(value).__name__ for value in params]
+    return shape if len(shape) <= 10 else shape[:10] + [f"... {len(shape)} total"]
+
+
+def explain(connection, sql: str, params) -> list:
+    cursor = connection.cursor(buffered=True, dictionary=True)
+    try:
+        cursor.execute("EXPLAIN " + sql, params)
+        return cursor.fetchall()
+    except Error as e:
+        return [{"error": str(e)}]
+    finally:
+        cursor.close()
+
+
+_slow_query_log = None
+
+
+def get_slow_query_log() -> SlowQueryLog:
+    global _slow_query_log
+    if _slow_query_log is None:
+        _slow_query_log = SlowQueryLog()
+    return _slow_query_log
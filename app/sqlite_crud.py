@@ -0,0 +1,381 @@
+# SQLite mirror of app/crud.py, selected with DB_DRIVER=sqlite (schema and
+# connections in app/sqlite_database.py). Functions keep the same names,
+# arguments and return values as their MySQL counterparts so app/dal.py can
+# dispatch to either. SQLite takes a database-wide write lock per
+# transaction, which stands in for the row locks the MySQL queries take.
+import json
+import sqlite3
+
+from app.consts import Status
+from app import schemas
+from app.crud import (
+    build_record_ids_lookup, build_records_query, check_record_ids, check_request_hash, plan_charged_records
+)
+from app.metrics import timed_query
+from app.replicas import reads, reads_primary, writes
+
+
+def _sql(query: str) -> str:
+    # The queries shared with app/crud.py use the MySQL paramstyle.
+    return query.replace("%s", "?")
+
+
+def _dict(row) -> dict:
+    return dict(row) if row is not None else None
+
+
+@reads_primary
+@timed_query
+def get_user_by_username(connection: sqlite3.Connection, username: str) -> dict:
+    return _dict(connection.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone())
+
+
+@reads
+@timed_query
+def get_user_by_id(connection: sqlite3.Connection, user_id: int) -> dict:
+    return _dict(connection.execute(
+        "SELECT id, username, balance, status FROM users WHERE id = ?", (user_id,)
+    ).fetchone())
+
+
+@writes
+@timed_query
+def create_user(connection: sqlite3.Connection, user: schemas.UserCreate, hashed_password: str, status: Status) -> dict:
+    connection.execute(
+        "INSERT INTO users (username, hashed_password, status) VALUES (?, ?, ?)",
+        (user.username, hashed_password, status.value)
+    )
+    connection.commit()
+    return get_user_by_username(connection, user.username)
+
+
+@writes
+@timed_query
+def update_user_password_hash(connection: sqlite3.Connection, user_id: int, hashed_password: str) -> None:
+    connection.execute("UPDATE users SET hashed_password = ? WHERE id = ?", (hashed_password, user_id))
+    connection.commit()
+
+
+@reads
+@timed_query
+def get_operations(connection: sqlite3.Connection, skip: int = 0, limit: int = 10) -> list:
+    rows = connection.execute("SELECT * FROM operations LIMIT ? OFFSET ?", (limit, skip)).fetchall()
+    return [dict(row) for row in rows]
+
+
+@reads
+@timed_query
+def get_all_operations(connection: sqlite3.Connection) -> list:
+    rows = connection.execute("SELECT id, type, cost FROM operations ORDER BY id").fetchall()
+    return [dict(row) for row in rows]
+
+
+@writes
+@timed_query
+def create_operation(connection: sqlite3.Connection, operation: schemas.OperationCreate) -> int:
+    cursor = connection.execute("INSERT INTO operations (type, cost) VALUES (?, ?)", (operation.type, operation.cost))
+    connection.commit()
+    return cursor.lastrowid
+
+
+def build_records_insert(records: list, with_ids: bool = False) -> tuple:
+    columns = ("id",) if with_ids else ()
+    columns += ("operation_id", "user_id", "amount", "user_balance", "operation_response")
+    query = (
+        f"INSERT INTO records ({', '.join(columns)}) VALUES "
+        + ", ".join(["(" + ", ".join(["?"] * len(columns)) + ")"] * len(records))
+    )
+    if with_ids:
+        query += " ON CONFLICT (id) DO NOTHING"
+    params = tuple(record[column] for record in records for column in columns)
+    return query, params
+
+
+def build_usage_upsert(user_id: int, records: list) -> tuple:
+    usage = {}
+    for record in records:
+        calls, amount = usage.get(record["operation_id"], (0, 0))
+        usage[record["operation_id"]] = (calls + 1, amount + record["amount"])
+    query = (
+        "INSERT INTO user_usage (user_id, operation_id, calls, total_amount, last_created_at) VALUES "
+        + ", ".join(["(?, ?, ?, ?, CURRENT_TIMESTAMP)"] * len(usage))
+        + " ON CONFLICT (user_id, operation_id) DO UPDATE SET calls = calls + excluded.calls,"
+        " total_amount = total_amount + excluded.total_amount, last_created_at = excluded.last_created_at"
+    )
+    params = tuple(
+        value for operation_id in sorted(usage) for value in (user_id, operation_id, *usage[operation_id])
+    )
+    return query, params
+
+
+def build_idempotent_response(user_id: int, idempotency_key: str, record: dict) -> tuple:
+    return (
+        "UPDATE idempotency_keys SET record_id = ?, response = ? WHERE user_id = ? AND idempotency_key = ?",
+        (record["id"], json.dumps(record, default=str), user_id, idempotency_key)
+    )
+
+
+def _debit(connection: sqlite3.Connection, user_id: int, total: float):
+    # The users balance after debiting ``total`` (rounded to cents, as
+    # crud.build_debit does), or None (with the transaction rolled back) when
+    # the user does not exist or the balance does not cover it. SQLite counts
+    # matched rows, so a zero-cost charge still finds its user; the SELECT
+    # stays in process (RETURNING needs SQLite 3.35).
+    cursor = connection.execute(
+        "UPDATE users SET balance = ROUND(balance - ?, 2) WHERE id = ? AND balance >= ?", (total, user_id, total)
+    )
+    if cursor.rowcount == 0:
+        connection.rollback()
+        return None
+    return connection.execute("SELECT balance FROM users WHERE id = ?", (user_id,)).fetchone()[0]
+
+
+@writes
+@timed_query
+def create_record(connection: sqlite3.Connection, record: schemas.RecordCreate) -> int:
+    cursor = connection.execute(
+        "INSERT INTO records (operation_id, user_id, amount,"
+        " user_balance, operation_response) VALUES (?, ?, ?, ?, ?)",
+        (record.operation_id, record.user_id, record.amount, record.user_balance, record.operation_response)
+    )
+    connection.execute(*build_usage_upsert(record.user_id, [record.dict()]))
+    connection.commit()
+    return cursor.lastrowid
+
+
+@writes
+@timed_query
+def create_charged_record(
+    connection: sqlite3.Connection, user_id: int, operation_id: int, amount: float, operation_response: str,
+    idempotency_key: str = None
+) -> dict:
+    try:
+        user_balance = _debit(connection, user_id, amount)
+        if user_balance is None:
+            return None
+        cursor = connection.execute(
+            "INSERT INTO records (operation_id, user_id, amount,"
+            " user_balance, operation_response) VALUES (?, ?, ?, ?, ?)",
+            (operation_id, user_id, amount, user_balance, operation_response)
+        )
+        record = {
+            "id": cursor.lastrowid,
+            "operation_id": operation_id,
+            "user_id": user_id,
+            "amount": amount,
+            "user_balance": user_balance,
+            "operation_response": operation_response,
+            "deleted": False,
+        }
+        connection.execute(*build_usage_upsert(user_id, [record]))
+        if idempotency_key is not None:
+            connection.execute(*build_idempotent_response(user_id, idempotency_key, record))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return record
+
+
+@writes
+@timed_query
+def create_charged_records(connection: sqlite3.Connection, user_id: int, items: list) -> list:
+    total = sum(amount for _, amount, _ in items)
+    try:
+        final_balance = _debit(connection, user_id, total)
+        if final_balance is None:
+            return None
+        records = plan_charged_records(user_id, items, final_balance)
+        cursor = connection.execute(*build_records_insert(records))
+        # The write lock keeps other inserts out, so the ids are consecutive
+        # and end at the last one inserted.
+        for record_id, record in enumerate(records, start=cursor.lastrowid - len(records) + 1):
+            record["id"] = record_id
+        connection.execute(*build_usage_upsert(user_id, records))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return records
+
+
+@writes
+@timed_query
+def charge_records(
+    connection: sqlite3.Connection, user_id: int, items: list, ids: list = None, idempotency_key: str = None,
+    journal=None
+) -> list:
+    total = sum(amount for _, amount, _ in items)
+    logged = False
+    try:
+        final_balance = _debit(connection, user_id, total)
+        if final_balance is None:
+            return None
+        records = plan_charged_records(user_id, items, final_balance)
+        for record, record_id in zip(records, ids or ()):
+            record["id"] = record_id
+        connection.execute(*build_usage_upsert(user_id, records))
+        if idempotency_key is not None:
+            connection.execute(*build_idempotent_response(user_id, idempotency_key, records[0]))
+        if journal is not None:
+            records = journal.prepare(records)
+            logged = True
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        if logged:
+            journal.abort(records)
+        raise
+    if journal is not None:
+        journal.confirm(records)
+    return records
+
+
+@writes
+@timed_query
+def insert_records(connection: sqlite3.Connection, records: list) -> None:
+    try:
+        connection.execute(*build_records_insert(records, with_ids=True))
+        check_record_ids(connection.execute(*build_record_ids_lookup(records, "?")).fetchall(), records)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+
+@writes
+@timed_query
+def reserve_record_ids(connection: sqlite3.Connection, count: int) -> int:
+    try:
+        connection.execute("INSERT OR IGNORE INTO id_sequences (name, next_id) VALUES ('records', 1)")
+        connection.execute(
+            "UPDATE id_sequences SET next_id = MAX(next_id, (SELECT COALESCE(MAX(id), 0) + 1 FROM records)) + ?"
+            " WHERE name = 'records'", (count,)
+        )
+        end = connection.execute("SELECT next_id FROM id_sequences WHERE name = 'records'").fetchone()[0]
+        # AUTOINCREMENT's counter, moved past the block like AUTO_INCREMENT in app/crud.py.
+        connection.execute(
+            "INSERT INTO sqlite_sequence (name, seq) SELECT 'records', 0"
+            " WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'records')"
+        )
+        connection.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'records'", (end - 1,))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return end - count
+
+
+@writes
+@timed_query
+def claim_idempotency_key(
+    connection: sqlite3.Connection, user_id: int, key: str, ttl: int, request_hash: str = None
+) -> dict:
+    # Same contract as app/crud.py. The INSERT takes the write lock, so a
+    # concurrent claim of the same key waits for this transaction to end.
+    while True:
+        try:
+            connection.execute(
+                "INSERT INTO idempotency_keys (user_id, idempotency_key, request_hash) VALUES (?, ?, ?)",
+                (user_id, key, request_hash)
+            )
+            return None
+        except sqlite3.IntegrityError:
+            pass
+        row = connection.execute(
+            "SELECT response, created_at >= datetime('now', ?), request_hash FROM idempotency_keys"
+            " WHERE user_id = ? AND idempotency_key = ?",
+            (f"{-ttl} seconds", user_id, key)
+        ).fetchone()
+        if row is None:
+            continue
+        response, live, stored_hash = row
+        if live and response is not None:
+            connection.rollback()
+            check_request_hash(stored_hash, request_hash)
+            return json.loads(response)
+        connection.execute(
+            "UPDATE idempotency_keys SET record_id = NULL, response = NULL, request_hash = ?,"
+            " created_at = CURRENT_TIMESTAMP WHERE user_id = ? AND idempotency_key = ?",
+            (request_hash, user_id, key)
+        )
+        return None
+
+
+@writes
+@timed_query
+def release_idempotency_key(connection: sqlite3.Connection) -> None:
+    connection.rollback()
+
+
+@writes
+@timed_query
+def purge_idempotency_keys(connection: sqlite3.Connection, ttl: int, batch_size: int = 1000) -> int:
+    purged = 0
+    while True:
+        cursor = connection.execute(
+            "DELETE FROM idempotency_keys WHERE rowid IN (SELECT rowid FROM idempotency_keys"
+            " WHERE created_at < datetime('now', ?) LIMIT ?)",
+            (f"{-ttl} seconds", batch_size)
+        )
+        connection.commit()
+        purged += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            return purged
+
+
+@reads_primary
+@timed_query
+def get_record(connection: sqlite3.Connection, record_id: int) -> dict:
+    return _dict(connection.execute("SELECT * FROM records WHERE id = ?", (record_id,)).fetchone())
+
+
+@reads
+@timed_query
+def get_records(connection: sqlite3.Connection, **filters) -> list:
+    # See app/crud.py's build_records_query for the accepted filters. Without
+    # a FULLTEXT index free-text search uses LIKE.
+    query, params = build_records_query(**filters, fulltext=False)
+    return [dict(row) for row in connection.execute(_sql(query), params).fetchall()]
+
+
+@writes
+@timed_query
+def soft_delete_record(connection: sqlite3.Connection, record_id: int) -> dict:
+    record = connection.execute(
+        "SELECT user_id, operation_id, amount, deleted FROM records WHERE id = ?", (record_id,)
+    ).fetchone()
+    if record and not record["deleted"]:
+        try:
+            cursor = connection.execute(
+                "UPDATE records SET deleted = TRUE WHERE id = ? AND deleted = FALSE", (record_id,)
+            )
+            if cursor.rowcount:
+                connection.execute(
+                    "UPDATE user_usage SET calls = calls - 1, total_amount = total_amount - ?"
+                    " WHERE user_id = ? AND operation_id = ?",
+                    (record["amount"], record["user_id"], record["operation_id"])
+                )
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+    return _dict(connection.execute("SELECT * FROM records WHERE id = ?", (record_id,)).fetchone())
+
+
+@reads
+@timed_query
+def get_user_usage(connection: sqlite3.Connection, user_id: int) -> list:
+    rows = connection.execute(
+        "SELECT operation_id, calls, total_amount, last_created_at FROM user_usage"
+        " WHERE user_id = ? AND calls > 0 ORDER BY operation_id",
+        (user_id,)
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+
+@writes
+@timed_query
+def update_user_balance(connection: sqlite3.Connection, user_id: int, new_balance: float) -> None:
+    connection.execute("UPDATE users SET balance = ? WHERE id = ?", (new_balance, user_id))
+    connection.commit()
@@ -0,0 +1,141 @@
+# SQLite storage for DB_DRIVER=sqlite: the MySQL schema of create_tables.py
+# in SQLite terms, and the connections app/sqlite_crud.py runs on. Meant for
+# laptops and CI (tests, benchmarks), not for production traffic.
+import os
+import sqlite3
+from datetime import date, datetime
+from decimal import Decimal
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username VARCHAR(255) UNIQUE,
+        hashed_password VARCHAR(255),
+        balance FLOAT DEFAULT 100.0,
+        status VARCHAR(255) DEFAULT 'active'
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS operations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        type VARCHAR(255),
+        cost FLOAT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS records (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        operation_id INT REFERENCES operations(id),
+        user_id INT REFERENCES users(id),
+        amount DECIMAL(10, 2),
+        user_balance DECIMAL(10, 2),
+        operation_response TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        deleted BOOLEAN DEFAULT FALSE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS records_archive (
+        id INTEGER PRIMARY KEY,
+        operation_id INT,
+        user_id INT,
+        amount DECIMAL(10, 2),
+        user_balance DECIMAL(10, 2),
+        operation_response TEXT,
+        created_at TIMESTAMP NULL,
+        deleted BOOLEAN DEFAULT FALSE,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_usage (
+        user_id INT NOT NULL REFERENCES users(id),
+        operation_id INT NOT NULL REFERENCES operations(id),
+        calls INT NOT NULL DEFAULT 0,
+        total_amount DECIMAL(14, 2) NOT NULL DEFAULT 0,
+        last_created_at TIMESTAMP NULL,
+        PRIMARY KEY (user_id, operation_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS id_sequences (
+        name VARCHAR(64) PRIMARY KEY,
+        next_id BIGINT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        user_id INT NOT NULL REFERENCES users(id),
+        idempotency_key VARCHAR(255) NOT NULL,
+        record_id INT NULL,
+        response TEXT NULL,
+        request_hash CHAR(64) NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, idempotency_key)
+    )
+    """,
+    # The secondary indexes of create_tables.py; SQLite has no FULLTEXT index,
+    # search falls back to LIKE (see app/sqlite_crud.py).
+    "CREATE INDEX IF NOT EXISTS idx_records_user_created ON records (user_id, deleted, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS idx_records_user_amount ON records (user_id, deleted, amount, id)",
+    "CREATE INDEX IF NOT EXISTS idx_records_user_operation"
+    " ON records (user_id, deleted, operation_id, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS idx_records_archive_user_created ON records_archive (user_id, deleted, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS idx_records_archive_user_amount ON records_archive (user_id, deleted, amount, id)",
+    "CREATE INDEX IF NOT EXISTS idx_records_archive_user_operation"
+    " ON records_archive (user_id, deleted, operation_id, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (created_at)",
+]
+
+# Column values come back as the types mysql-connector returns for them, and
+# parameters of those types are stored in the format SQLite compares with
+# CURRENT_TIMESTAMP.
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_converter("TIMESTAMP", lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter("DECIMAL", lambda value: Decimal(value.decode()))
+sqlite3.register_converter("BOOLEAN", lambda value: value not in (b"0", b""))
+
+
+def sqlite_path() -> str:
+    # ":memory:" (default) keeps the database in this worker only.
+    return os.getenv('SQLITE_PATH', ':memory:')
+
+
+def create_tables(connection: sqlite3.Connection) -> None:
+    for statement in SCHEMA:
+        connection.execute(statement)
+    connection.commit()
+
+
+def connect(path: str) -> sqlite3.Connection:
+    # check_same_thread is off because the pool hands connections to whichever
+    # threadpool thread runs the query; the pool never shares one at a time.
+    connection = sqlite3.connect(
+        path, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False, uri=path.startswith("file:"),
+        timeout=float(os.getenv('DB_POOL_TIMEOUT', 2))
+    )
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA foreign_keys = ON")
+    if path != ":memory:":
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+    create_tables(connection)
+    return connection
+
+
+def create_sqlite_pool(path: str = None, size: int = None, timeout: float = None):
+    # An in-memory database lives and dies with its only connection, so it gets
+    # a pool of one that never recycles it. A database file gets a pool of
+    # DB_POOL_SIZE connections in WAL mode: readers run alongside the writer.
+    from app.database import ConnectionPool
+
+    path = path or sqlite_path()
+    if path == ":memory:":
+        size, recycle = 1, 0
+    else:
+        size, recycle = size or int(os.getenv('DB_POOL_SIZE', 5)), float(os.getenv('DB_POOL_RECYCLE', 3600))
+    timeout = timeout if timeout is not None else float(os.getenv('DB_POOL_TIMEOUT', 2))
+    return ConnectionPool({"path": path}, size=size, timeout=timeout, recycle=recycle, pre_ping=False, connect=connect)
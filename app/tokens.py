@@ -0,0 +1,93 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+
+ACCESS = "access"
+REFRESH = "refresh"
+
+_secret_key = None
+
+# Placeholders that have shipped in example .env files; as good as no key.
+PLACEHOLDER_KEYS = {"change-me-in-production"}
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def secret_key_required() -> bool:
+    # On Heroku (which sets DYNO) or with AUTH_REQUIRE_SECRET_KEY=true.
+    return 'DYNO' in os.environ or os.getenv('AUTH_REQUIRE_SECRET_KEY', 'false').lower() == 'true'
+
+
+def get_secret_key() -> bytes:
+    global _secret_key
+    if _secret_key is None:
+        key = os.getenv('AUTH_SECRET_KEY')
+        if key in PLACEHOLDER_KEYS:
+            key = None
+        if not key and secret_key_required():
+            raise RuntimeError("AUTH_SECRET_KEY must be set to a long random value")
+        if not key:
+            # Tokens then only verify on this worker and die with it.
+            print("AUTH_SECRET_KEY is not set, using a random per-process key")
+            key = secrets.token_urlsafe(32)
+        _secret_key = key.encode()
+    return _secret_key
+
+
+def _sign(payload: str) -> str:
+    return _b64encode(hmac.new(get_secret_key(), payload.encode(), hashlib.sha256).digest())
+
+
+def create_token(user: dict, token_type: str, ttl: int) -> str:
+    claims = {
+        "sub": user["id"],
+        "name": user["username"],
+        "st": user["status"],
+        "typ": token_type,
+        "exp": int(time.time()) + ttl,
+    }
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+    return f"{payload}.{_sign(payload)}"
+
+
+def decode_token(token: str, token_type: str) -> dict:
+    payload, _, signature = token.partition(".")
+    # Compared as bytes: compare_digest refuses str with non-ASCII characters.
+    if not signature or not hmac.compare_digest(signature.encode(), _sign(payload).encode()):
+        raise InvalidToken("Invalid token signature")
+    try:
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        raise InvalidToken("Malformed token")
+    if claims.get("typ") != token_type:
+        raise InvalidToken("Wrong token type")
+    if claims.get("exp", 0) < time.time():
+        raise InvalidToken("Token expired")
+    return claims
+
+
+def access_token_ttl() -> int:
+    return int(os.getenv('ACCESS_TOKEN_TTL', 900))
+
+
+def refresh_token_ttl() -> int:
+    return int(os.getenv('REFRESH_TOKEN_TTL', 7 * 24 * 3600))
+
+
+def legacy_tokens_allowed() -> bool:
+    # Whether the bare username is still accepted as an access token.
+    return os.getenv('AUTH_ALLOW_LEGACY_TOKENS', 'false').lower() == 'true'
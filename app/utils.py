@@ -1,22 +1,31 @@
-import requests
+from app.calculator import get_calculator
+from app.random_strings import RandomStringUnavailable, get_random_strings
 
 
-def perform_operation(operation_type: str) -> str:
-    if operation_type == "addition":
-        return str(1 + 1)
-    elif operation_type == "subtraction":
-        return str(1 - 1)
-    elif operation_type == "multiplication":
-        return str(1 * 1)
-    elif operation_type == "division":
-        return str(1 / 1)
-    elif operation_type == "square_root":
-        return str(1 ** 0.5)
-    elif operation_type == "random_string":
-        response = requests.get(
-            "https://www.random.org/strings/?num=1&len=8&digits=on&upperalpha=on"
-            "&loweralpha=on&unique=on&format=plain&rnd=new"
-        )
-        return response.text.strip()
-    else:
-        raise ValueError("Invalid operation type")
+def perform_operation(operation_type: str, operands: list = None) -> str:
+    return get_calculator().evaluate(operation_type, operands)
+
+
+def perform_operations(calls: list) -> list:
+    # Batch form of perform_operation for (operation_type, operands) pairs.
+    # Deterministic results come from the calculator's memo after the first
+    # evaluation and random strings are drawn from the buffer in a single
+    # take. Returns one result per input, or the exception raised for it.
+    results = [None] * len(calls)
+    random_indexes = []
+    for index, (operation_type, operands) in enumerate(calls):
+        if operation_type == "random_string" and not operands:
+            random_indexes.append(index)
+            continue
+        try:
+            results[index] = perform_operation(operation_type, operands)
+        except ValueError as e:
+            results[index] = e
+    if random_indexes:
+        try:
+            strings = get_random_strings().take(len(random_indexes))
+        except RandomStringUnavailable as e:
+            strings = [e] * len(random_indexes)
+        for index, value in zip(random_indexes, strings):
+            results[index] = value
+    return results
@@ -0,0 +1,133 @@
+import asyncio
+import os
+import time
+
+from app import IMPORTED_AT, dal
+from app.async_database import get_async_pool
+from app.calculator import get_calculator
+from app.catalog import operation_catalog
+from app.dal import use_async_driver
+from app.database import acquire_connection, get_pool, release_connection
+from app.hashing import get_password_hasher
+from app.idempotency import idempotency_key_ttl
+from app.metrics import run_in_threadpool
+from app.rate_limit import get_rate_limiter
+from app.records_cache import get_records_cache
+
+
+class Readiness:
+    """Startup timings of this worker, and whether it has warmed up.
+
+    ``mark(phase)`` records the milliseconds since the previous mark, the
+    first one counting from the first import of the app package: ``imports``,
+    then ``startup`` (the startup hook), then one per warm-up step. /ready
+    answers 503 until ``set_ready``; its ``total_ms`` is the cold-start time
+    to track. Under ``gunicorn --preload`` imports happen once in the master,
+    so ``imports_ms`` also covers the wait for the fork.
+    """
+
+    def __init__(self, started_at: float = IMPORTED_AT, clock=time.monotonic):
+        self._clock = clock
+        self.started_at = started_at
+        self._last_mark = started_at
+        self.phases = {}
+        self.errors = {}
+        self.ready = False
+
+    def mark(self, phase: str) -> None:
+        now = self._clock()
+        self.phases[phase] = round((now - self._last_mark) * 1000, 1)
+        self._last_mark = now
+
+    def set_ready(self) -> None:
+        self.phases["total"] = round((self._last_mark - self.started_at) * 1000, 1)
+        self.ready = True
+
+    def stats(self) -> dict:
+        stats = {"ready": self.ready, "pid": os.getpid()}
+        stats.update((f"{phase}_ms", millis) for phase, millis in self.phases.items())
+        if self.errors:
+            stats["errors"] = dict(self.errors)
+        return stats
+
+
+readiness = Readiness()
+
+
+async def prefill_pool() -> None:
+    # DB_POOL_PREFILL connections (default the whole pool) opened up front.
+    count = int(os.getenv('DB_POOL_PREFILL')) if os.getenv('DB_POOL_PREFILL') else None
+    if use_async_driver():
+        await (await get_async_pool()).prefill(count)
+    else:
+        await run_in_threadpool(get_pool().prefill, count)
+
+
+async def load_catalog() -> None:
+    connection = await acquire_connection()
+    try:
+        await operation_catalog.refresh(connection)
+        purged = await dal.run("purge_idempotency_keys", connection, ttl=idempotency_key_ttl())
+        if purged:
+            print(f"Purged {purged} expired idempotency keys")
+    finally:
+        await release_connection(connection)
+
+
+async def prime_hot_paths() -> None:
+    # What the first requests would otherwise pay for: building the
+    # operation registry and caches, and starting a bcrypt worker process
+    # (which imports passlib) with one hash.
+    get_calculator()
+    get_records_cache()
+    get_rate_limiter()
+    await get_password_hasher().hash("warm-up")
+
+
+# (name, step, required): /ready stays 503 until every required step has
+# succeeded, since a worker without a database cannot serve anything.
+WARM_UP_STEPS = (
+    ("db_pool", prefill_pool, True), ("operation_catalog", load_catalog, True), ("hot_paths", prime_hot_paths, False)
+)
+
+
+async def warm_up(
+    readiness: Readiness = readiness, steps: tuple = WARM_UP_STEPS, retry_interval: float = None
+) -> Readiness:
+    # A failed required step is retried every ``retry_interval`` seconds; a
+    # failed optional one is logged and reported by /ready but does not hold
+    # the worker back, as what it would have prepared is loaded on first use.
+    if retry_interval is None:
+        retry_interval = float(os.getenv('WARM_UP_RETRY_INTERVAL', 1))
+    for name, step, required in steps:
+        while True:
+            try:
+                await step()
+                readiness.errors.pop(name, None)
+                break
+            except Exception as e:
+                readiness.errors[name] = str(e)
+                print(f"Warm-up step {name} failed: {e}")
+                if not required:
+                    break
+            await asyncio.sleep(retry_interval)
+        readiness.mark(name)
+    readiness.set_ready()
+    print(f"Worker {os.getpid()} ready in {readiness.phases['total']} ms: {readiness.stats()}")
+    return readiness
+
+
+_warm_up_task = None
+
+
+def start_warm_up() -> asyncio.Task:
+    # Runs after the startup hook returns, so the worker serves (and answers
+    # /ready with 503) while it warms up.
+    global _warm_up_task
+    _warm_up_task = asyncio.get_event_loop().create_task(warm_up())
+    return _warm_up_task
+
+
+def stop_warm_up() -> None:
+    if _warm_up_task is not None and not _warm_up_task.done():
+        _warm_up_task.cancel()
@@ -0,0 +1,383 @@
+import asyncio
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+def write_behind_enabled() -> bool:
+    return os.getenv('WRITE_BEHIND_ENABLED', 'false').lower() == 'true'
+
+
+class WriteBehindFull(Exception):
+    pass
+
+
+class IdBlockAllocator:
+    """Hands out record ids from blocks reserved in the database (hi/lo).
+
+    Records written behind need their id before they reach the table, so
+    ``reserve(count)`` claims ``count`` consecutive ids and returns the first;
+    one round trip covers ``block_size`` records.
+    """
+
+    def __init__(self, reserve, block_size: int = None):
+        self.block_size = block_size or int(os.getenv('RECORD_ID_BLOCK_SIZE', 1000))
+        self._reserve = reserve
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+        self.blocks = 0
+
+    def allocate(self, count: int = 1) -> list:
+        ids = []
+        with self._lock:
+            while len(ids) < count:
+                if self._next >= self._end:
+                    self._next = self._reserve(self.block_size)
+                    self._end = self._next + self.block_size
+                    self.blocks += 1
+                take = min(count - len(ids), self._end - self._next)
+                ids.extend(range(self._next, self._next + take))
+                self._next += take
+        return ids
+
+
+class WriteBehindQueue:
+    """Group commit for record inserts.
+
+    ``prepare`` gives each record an id and appends it to this worker's log
+    file before the charge that produced it commits; ``confirm`` then queues
+    it, or ``abort`` strikes it from the log when the commit fails
+    (``submit`` does both steps for records with nothing to commit). A
+    flusher thread writes the queue with one multi-row INSERT as soon as
+    ``max_rows`` records wait, or ``interval`` seconds after the first of
+    them arrived. The log is emptied whenever the queue drains; logs left
+    behind by a worker that died are replayed on start. ``insert`` must skip
+    rows that already exist, since a crash between the commit and the log
+    truncation replays records that were written.
+
+    A batch failing with one of ``poison_errors`` is retried row by row and
+    the rows that still fail are moved to ``quarantine.jsonl`` in the log
+    directory; other errors (the database is down) keep the batch queued.
+    Past ``max_queued`` records, ``prepare`` raises ``WriteBehindFull``.
+    """
+
+    def __init__(
+        self, insert, allocator: IdBlockAllocator, wal_dir: str = None, interval: float = None,
+        max_rows: int = None, fsync: bool = None, on_flush=None, retry_delay: float = 1.0,
+        max_queued: int = None, poison_errors: tuple = ()
+    ):
+        self.wal_dir = wal_dir or os.getenv('WRITE_BEHIND_DIR', 'write_behind')
+        self.interval = interval if interval is not None else int(os.getenv('WRITE_BEHIND_INTERVAL_MS', 10)) / 1000
+        self.max_rows = max_rows or int(os.getenv('WRITE_BEHIND_MAX_ROWS', 500))
+        if fsync is None:
+            fsync = os.getenv('WRITE_BEHIND_FSYNC', 'false').lower() == 'true'
+        self.fsync = fsync
+        self.retry_delay = retry_delay
+        self.max_queued = max_queued or int(os.getenv('WRITE_BEHIND_MAX_QUEUED', 100000))
+        self.poison_errors = poison_errors
+        self._insert = insert
+        self._allocator = allocator
+        self._on_flush = on_flush
+        self._queue = deque()
+        # Records logged whose charge has not committed (or failed) yet.
+        self._preparing = 0
+        self._cond = threading.Condition()
+        self._wal = None
+        self._wal_path = None
+        self._thread = None
+        self._closing = False
+        self._closed = False
+
+        self.submitted = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.replayed = 0
+        self.last_flush_rows = 0
+        self.quarantined = 0
+        self.rejected = 0
+
+    def start(self) -> None:
+        os.makedirs(self.wal_dir, exist_ok=True)
+        self._wal_path = os.path.join(self.wal_dir, f"records-{os.getpid()}-{time.time_ns()}.wal")
+        self._wal = open(self._wal_path, "a", encoding="utf-8")
+        # Held for the life of the worker: a log nobody holds belongs to a dead one.
+        fcntl.flock(self._wal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        for path in sorted(glob.glob(os.path.join(self.wal_dir, "records-*.wal"))):
+            if path != self._wal_path:
+                self._replay(path)
+        self._thread = threading.Thread(target=self._run, name="write-behind-flusher", daemon=True)
+        self._thread.start()
+
+    def _replay(self, path: str) -> None:
+        with open(path, encoding="utf-8") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            records = []
+            aborted = set()
+            for line in f:
+                if not line.endswith("\n"):
+                    # Torn final write: the worker died before it returned the record.
+                    break
+                entry = json.loads(line)
+                if "aborted" in entry:
+                    aborted.update(entry["aborted"])
+                else:
+                    records.append(entry)
+            records = [record for record in records if record["id"] not in aborted]
+            # Re-logged here before the orphan goes, so a second crash loses nothing.
+            self._enqueue(records)
+            os.remove(path)
+        self.replayed += len(records)
+        if records:
+            print(f"Replayed {len(records)} queued records from {path}")
+
+    def _log(self, entries: list, wal=None) -> None:
+        wal = wal or self._wal
+        wal.write("".join(json.dumps(entry, default=str) + "\n" for entry in entries))
+        wal.flush()
+        if self.fsync:
+            os.fsync(wal.fileno())
+
+    def _enqueue(self, records: list) -> None:
+        if not records:
+            return
+        with self._cond:
+            if self._closed or self._wal is None:
+                raise RuntimeError("Write-behind queue is not running")
+            self._log(records)
+            self._queue.extend(records)
+            self._cond.notify_all()
+
+    def allocate_ids(self, count: int) -> list:
+        return self._allocator.allocate(count)
+
+    def prepare(self, records: list) -> list:
+        # Returns the records with ids, allocated here for those without one,
+        # once they are in the log. Raises (and logs nothing) when the queue
+        # is closed or full, so the caller's charge rolls back.
+        ids = iter(self._allocator.allocate(sum(1 for record in records if record.get("id") is None)))
+        records = [record if record.get("id") is not None else dict(record, id=next(ids)) for record in records]
+        with self._cond:
+            if self._closing or self._closed or self._wal is None:
+                raise RuntimeError("Write-behind queue is not running")
+            if len(self._queue) + self._preparing + len(records) > self.max_queued:
+                self.rejected += len(records)
+                raise WriteBehindFull(f"Write-behind queue holds {len(self._queue)} records, try again later")
+            self._log(records)
+            self._preparing += len(records)
+        return records
+
+    def confirm(self, records: list) -> None:
+        # The charge committed: the records reach the table within about
+        # ``interval`` seconds.
+        with self._cond:
+            self._preparing -= len(records)
+            self._queue.extend(records)
+            self.submitted += len(records)
+            self._cond.notify_all()
+
+    def abort(self, records: list) -> None:
+        # The charge rolled back: a replay of the log skips the records.
+        entry = {"aborted": [record["id"] for record in records]}
+        with self._cond:
+            self._preparing -= len(records)
+            if self._wal is not None:
+                self._log([entry])
+            else:
+                # Closed in between; the log stays behind for the next worker.
+                with open(self._wal_path, "a", encoding="utf-8") as wal:
+                    self._log([entry], wal)
+            self._cond.notify_all()
+
+    def submit(self, records: list) -> list:
+        records = self.prepare(records)
+        self.confirm(records)
+        return records
+
+    def _next_batch(self) -> list:
+        with self._cond:
+            while not self._queue and not self._closing:
+                self._cond.wait()
+            if not self._queue:
+                return []
+            deadline = time.monotonic() + self.interval
+            while len(self._queue) < self.max_rows and not self._closing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return [self._queue[i] for i in range(min(len(self._queue), self.max_rows))]
+
+    def _isolate(self, batch: list) -> list:
+        # Inserts a batch that failed with a poison error one row at a time
+        # and returns (record, error) for the rows that fail on their own.
+        # Any other error propagates and leaves the whole batch queued.
+        poisoned = []
+        for record in batch:
+            try:
+                self._insert([record])
+            except self.poison_errors as e:
+                poisoned.append((record, e))
+        return poisoned
+
+    def _quarantine(self, poisoned: list) -> None:
+        path = os.path.join(self.wal_dir, "quarantine.jsonl")
+        with open(path, "a", encoding="utf-8") as f:
+            self._log([{"record": record, "error": str(error)} for record, error in poisoned], f)
+        with self._cond:
+            self.quarantined += len(poisoned)
+        for record, error in poisoned:
+            print(f"Quarantined queued record {record['id']} of user {record['user_id']} in {path}: {error}")
+
+    def _run(self) -> None:
+        while not self._closed:
+            batch = self._next_batch()
+            if not batch:
+                return
+            try:
+                try:
+                    self._insert(batch)
+                    poisoned = []
+                except self.poison_errors:
+                    poisoned = self._isolate(batch)
+            except Exception as e:
+                print(f"Error flushing {len(batch)} queued records: {e}")
+                with self._cond:
+                    self.flush_errors += 1
+                # Keep them queued (and logged) and try again.
+                time.sleep(self.retry_delay)
+                continue
+            if poisoned:
+                self._quarantine(poisoned)
+            with self._cond:
+                for _ in batch:
+                    self._queue.popleft()
+                self.flushed += len(batch) - len(poisoned)
+                self.flushes += 1
+                self.last_flush_rows = len(batch)
+                if not self._queue and not self._preparing and not self._closed:
+                    self._wal.truncate(0)
+                self._cond.notify_all()
+            if self._on_flush:
+                try:
+                    self._on_flush({record["user_id"] for record in batch})
+                except Exception as e:
+                    print(f"Error in write-behind flush callback: {e}")
+
+    def drain(self, timeout: float = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._queue:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout: float = 5.0) -> None:
+        # Flushes what is queued; anything still pending after ``timeout``
+        # stays in the log for the next worker to replay.
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            if self._wal is not None:
+                self._wal.close()
+                if not self._queue and not self._preparing:
+                    os.remove(self._wal_path)
+                self._wal = None
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "queued": len(self._queue),
+                "submitted": self.submitted,
+                "flushed": self.flushed,
+                "flushes": self.flushes,
+                "flush_errors": self.flush_errors,
+                "last_flush_rows": self.last_flush_rows,
+                "replayed": self.replayed,
+                "quarantined": self.quarantined,
+                "rejected": self.rejected,
+                "id_blocks": self._allocator.blocks,
+            }
+
+
+def _database_queue(loop) -> WriteBehindQueue:
+    import sqlite3
+
+    import mysql.connector
+
+    from app import crud, sqlite_crud
+    from app.crud import RecordIdConflict
+    from app.dal import storage_backend
+    from app.database import ConnectionPool, get_db_config, get_pool
+    from app.records_cache import get_records_cache
+
+    if storage_backend() == "sqlite":
+        # An in-memory database has a single connection; share the request pool.
+        crud, pool = sqlite_crud, get_pool()
+    else:
+        # Its own two connections (flusher and id reservations), outside the
+        # request pool so a busy pool cannot stall the flusher.
+        pool = ConnectionPool(get_db_config(), size=2, timeout=30)
+
+    def with_connection(func, *args):
+        connection = pool.acquire()
+        try:
+            return func(connection, *args)
+        finally:
+            pool.release(connection)
+
+    def on_flush(user_ids):
+        # Pages cached before the flush do not show the new records yet.
+        for user_id in user_ids:
+            asyncio.run_coroutine_threadsafe(get_records_cache().invalidate(user_id), loop)
+
+    return WriteBehindQueue(
+        insert=lambda records: with_connection(crud.insert_records, records),
+        allocator=IdBlockAllocator(lambda count: with_connection(crud.reserve_record_ids, count)),
+        on_flush=on_flush,
+        # Rows the database rejects for their content: a retry cannot help.
+        poison_errors=(
+            RecordIdConflict, mysql.connector.IntegrityError, mysql.connector.DataError, sqlite3.IntegrityError
+        ),
+    )
+
+
+_write_behind = None
+_write_behind_lock = threading.Lock()
+
+
+def get_write_behind():
+    # None unless WRITE_BEHIND_ENABLED. Call from the event loop: flushes
+    # invalidate the records cache on it.
+    global _write_behind
+    if _write_behind is not None or not write_behind_enabled():
+        return _write_behind
+    with _write_behind_lock:
+        if _write_behind is None:
+            queue = _database_queue(asyncio.get_event_loop())
+            queue.start()
+            _write_behind = queue
+        return _write_behind
+
+
+def close_write_behind() -> None:
+    global _write_behind
+    with _write_behind_lock:
+        if _write_behind is not None:
+            _write_behind.close()
+            _write_behind = None
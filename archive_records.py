@@ -0,0 +1,83 @@
+"""Move soft-deleted and old records from records to records_archive.
+
+Walks records by primary key in windows of ``--batch-size`` ids. Each window
+is one short transaction: it locks the window's rows that qualify (deleted,
+or created more than ``--older-than-days`` days ago), copies them to
+records_archive and deletes them from records, then sleeps ``--pause``
+seconds so replication and live traffic keep up. Ids past the highest one at
+start are left alone. Run it from a scheduler (e.g. Heroku Scheduler, daily):
+
+    python archive_records.py --older-than-days 365 --batch-size 1000 --pause 0.1
+    python archive_records.py --dry-run
+
+Archived records stay in user_usage (backfill_usage.py counts both tables)
+and in GET /records/?include_archived=true. Cached /records/ pages may list
+moved rows until RECORDS_CACHE_TTL runs out.
+"""
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+
+from app.database import create_connection
+
+COLUMNS = "id, operation_id, user_id, amount, user_balance, operation_response, created_at, deleted"
+
+
+def archive_batch(cursor, first_id: int, last_id: int, before: datetime, dry_run: bool = False) -> int:
+    # Locking the rows first keeps a concurrent soft delete from changing one
+    # between the copy and the delete.
+    cursor.execute(
+        "SELECT id FROM records WHERE id BETWEEN %s AND %s AND (deleted = TRUE OR created_at < %s) FOR UPDATE",
+        (first_id, last_id, before)
+    )
+    ids = [row[0] for row in cursor.fetchall()]
+    if not ids or dry_run:
+        return len(ids)
+    placeholders = ", ".join(["%s"] * len(ids))
+    cursor.execute(
+        f"INSERT INTO records_archive ({COLUMNS}) SELECT {COLUMNS} FROM records WHERE id IN ({placeholders})", ids
+    )
+    cursor.execute(f"DELETE FROM records WHERE id IN ({placeholders})", ids)
+    return len(ids)
+
+
+def archive(connection, before: datetime, batch_size: int = 1000, pause: float = 0.1, dry_run: bool = False) -> dict:
+    cursor = connection.cursor()
+    cursor.execute("SELECT MIN(id), MAX(id) FROM records")
+    first_id, last_id = cursor.fetchone()
+    connection.commit()
+    moved = batches = 0
+    if first_id is None:
+        return {"moved": moved, "batches": batches}
+    for start in range(first_id, last_id + 1, batch_size):
+        try:
+            moved += archive_batch(cursor, start, min(start + batch_size - 1, last_id), before, dry_run)
+            if dry_run:
+                connection.rollback()
+            else:
+                connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        batches += 1
+        time.sleep(pause)
+    return {"moved": moved, "batches": batches}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--older-than-days", type=float, default=float(os.getenv('RECORDS_ARCHIVE_AFTER_DAYS', 365)),
+        help="Archive live records created more than this many days ago"
+    )
+    parser.add_argument("--batch-size", type=int, default=1000, help="Record ids per transaction")
+    parser.add_argument("--pause", type=float, default=0.1, help="Seconds to sleep between batches")
+    parser.add_argument("--dry-run", action="store_true", help="Count the records to archive without moving them")
+    args = parser.parse_args()
+    cutoff = datetime.now() - timedelta(days=args.older_than_days)
+    result = archive(create_connection(), cutoff, args.batch_size, args.pause, args.dry_run)
+    print(
+        f"{'Would archive' if args.dry_run else 'Archived'} {result['moved']} records"
+        f" in {result['batches']} batches (created before {cutoff:%Y-%m-%d %H:%M} or deleted)"
+    )
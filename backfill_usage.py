@@ -0,0 +1,95 @@
+"""Rebuild or reconcile the user_usage summary from records (and records_archive).
+
+Walks users in batches. For each batch it locks the batch's users rows, which
+every write path that touches user_usage also locks first, so the totals
+cannot move while they are recomputed. The records themselves are read with a
+plain consistent read: neither the records table nor other users are locked.
+Only rows that differ are rewritten. ``--dry-run`` takes no locks and writes
+nothing: it only runs the grouped reads and reports the differences.
+
+    python backfill_usage.py --batch-size 500 --pause 0.05
+    python backfill_usage.py --dry-run
+"""
+import argparse
+import time
+
+from app.database import create_connection
+
+UPSERT = (
+    "INSERT INTO user_usage (user_id, operation_id, calls, total_amount, last_created_at)"
+    " VALUES (%s, %s, %s, %s, %s) AS new ON DUPLICATE KEY UPDATE calls = new.calls,"
+    " total_amount = new.total_amount, last_created_at = COALESCE(new.last_created_at, user_usage.last_created_at)"
+)
+
+
+def find_differences(cursor, first_id: int, last_id: int) -> list:
+    # (user_id, operation_id, calls, total, last_created_at) for every
+    # user_usage row of the range that does not match the records.
+    # Live records archived by archive_records.py still count.
+    cursor.execute(
+        "SELECT user_id, operation_id, COUNT(*), COALESCE(SUM(amount), 0), MAX(created_at) FROM ("
+        " SELECT user_id, operation_id, amount, created_at FROM records"
+        " WHERE user_id BETWEEN %s AND %s AND deleted = FALSE"
+        " UNION ALL SELECT user_id, operation_id, amount, created_at FROM records_archive"
+        " WHERE user_id BETWEEN %s AND %s AND deleted = FALSE"
+        ") AS live GROUP BY user_id, operation_id",
+        (first_id, last_id, first_id, last_id)
+    )
+    expected = {(user_id, operation_id): rest for user_id, operation_id, *rest in cursor.fetchall()}
+    cursor.execute(
+        "SELECT user_id, operation_id, calls, total_amount FROM user_usage WHERE user_id BETWEEN %s AND %s",
+        (first_id, last_id)
+    )
+    actual = {(user_id, operation_id): (calls, total) for user_id, operation_id, calls, total in cursor.fetchall()}
+
+    fixes = []
+    for key in sorted(set(expected) | set(actual)):
+        calls, total, last_created_at = expected.get(key, (0, 0, None))
+        if actual.get(key) != (calls, total):
+            fixes.append((*key, calls, total, last_created_at))
+    return fixes
+
+
+def reconcile_batch(cursor, first_id: int, last_id: int) -> list:
+    cursor.execute("SELECT id FROM users WHERE id BETWEEN %s AND %s FOR UPDATE", (first_id, last_id))
+    cursor.fetchall()
+    fixes = find_differences(cursor, first_id, last_id)
+    if fixes:
+        cursor.executemany(UPSERT, fixes)
+    return fixes
+
+
+def backfill(connection, batch_size: int = 500, pause: float = 0.05, dry_run: bool = False) -> dict:
+    cursor = connection.cursor()
+    # Each batch reads the records committed before its users rows were locked.
+    cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED")
+    after = 0
+    users = fixed = 0
+    while True:
+        cursor.execute("SELECT id FROM users WHERE id > %s ORDER BY id LIMIT %s", (after, batch_size))
+        ids = [row[0] for row in cursor.fetchall()]
+        connection.commit()
+        if not ids:
+            break
+        if dry_run:
+            fixes = find_differences(cursor, ids[0], ids[-1])
+            for user_id, operation_id, calls, total, _ in fixes:
+                print(f"user {user_id} operation {operation_id}: expected {calls} calls, {total} total")
+        else:
+            fixes = reconcile_batch(cursor, ids[0], ids[-1])
+        connection.commit()
+        users += len(ids)
+        fixed += len(fixes)
+        after = ids[-1]
+        time.sleep(pause)
+    return {"users": users, "fixed": fixed}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.05, help="Seconds to sleep between batches")
+    parser.add_argument("--dry-run", action="store_true", help="Report differences without writing them")
+    args = parser.parse_args()
+    result = backfill(create_connection(), args.batch_size, args.pause, args.dry_run)
+    print(f"Checked {result['users']} users, {'found' if args.dry_run else 'fixed'} {result['fixed']} usage rows")
@@ -0,0 +1,146 @@
+"""Throughput and latency of the hot endpoints, through the real FastAPI app.
+
+Drives POST /token, POST /calculate/ and GET /records/ in-process with
+TestClient, so it needs neither a server nor MySQL: DB_DRIVER defaults to
+sqlite on an in-memory database (set DB_DRIVER and the DB_* variables to run
+it against MySQL instead). Each endpoint gets ``--warmup`` unmeasured requests,
+then ``--requests`` measured ones sent one at a time. BCRYPT_ROUNDS defaults
+to 4 here so /token measures the app rather than bcrypt, and rate limiting is
+off since every request comes from one client.
+
+Save a run per commit and compare them:
+
+    python -m benchmarks.api --json before.json
+    git checkout my-branch
+    python -m benchmarks.api --json after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+import uuid
+
+os.environ.setdefault('DB_DRIVER', 'sqlite')
+os.environ.setdefault('BCRYPT_ROUNDS', '4')
+os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.main import app  # noqa: E402
+
+ENDPOINTS = ("token", "calculate", "records")
+
+
+def percentile(samples: list, fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def setup(client: TestClient) -> dict:
+    username = f"bench-{uuid.uuid4().hex[:12]}"
+    client.post("/api/v1/users/", json={"username": username, "password": "bench"}).raise_for_status()
+    response = client.post("/api/v1/token", data={"username": username, "password": "bench"})
+    response.raise_for_status()
+    # A free operation, so the balance never runs out.
+    operation = client.post("/api/v1/operations/", json={"type": "addition", "cost": 0.0})
+    operation.raise_for_status()
+    return {
+        "username": username,
+        "headers": {"Authorization": f"Bearer {response.json()['access_token']}"},
+        "operation_id": operation.json()["id"],
+    }
+
+
+def send(client: TestClient, endpoint: str, context: dict):
+    if endpoint == "token":
+        return client.post("/api/v1/token", data={"username": context["username"], "password": "bench"})
+    if endpoint == "calculate":
+        return client.post(
+            "/api/v1/calculate/", json={"operation_id": context["operation_id"], "operands": ["2", "3"]},
+            headers=context["headers"]
+        )
+    return client.get("/api/v1/records/", headers=context["headers"])
+
+
+def run_endpoint(client: TestClient, endpoint: str, context: dict, requests: int, warmup: int) -> dict:
+    for _ in range(warmup):
+        send(client, endpoint, context)
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        sent = time.perf_counter()
+        response = send(client, endpoint, context)
+        if response.status_code == 200:
+            latencies.append((time.perf_counter() - sent) * 1000)
+        else:
+            errors += 1
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies), 3) if latencies else None,
+        "p90_ms": round(percentile(latencies, 0.90), 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99), 3) if latencies else None,
+        "max_ms": round(max(latencies), 3) if latencies else None,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict) -> None:
+    print(f"\nvs {baseline.get('commit') or 'baseline'}:")
+    for endpoint, result in results.items():
+        before = baseline["results"].get(endpoint)
+        if not before or not before["rps"] or not before["p99_ms"] or not result["p99_ms"]:
+            continue
+        print(
+            f"{endpoint:<10} rps {(result['rps'] / before['rps'] - 1) * 100:+6.1f}%"
+            f"  p99 {(result['p99_ms'] / before['p99_ms'] - 1) * 100:+6.1f}%"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--json", dest="json_path")
+    parser.add_argument("--compare", dest="baseline_path")
+    args = parser.parse_args()
+
+    results = {}
+    # The context manager runs the startup hooks (pool, schema, catalog).
+    with TestClient(app) as client:
+        context = setup(client)
+        for endpoint in args.endpoints.split(","):
+            result = results[endpoint] = run_endpoint(client, endpoint, context, args.requests, args.warmup)
+            print(
+                f"{endpoint:<10} rps={result['rps']:<9} p50={result['p50_ms']} ms  p90={result['p90_ms']} ms"
+                f"  p99={result['p99_ms']} ms  errors={result['errors']}"
+            )
+
+    if args.baseline_path:
+        with open(args.baseline_path) as f:
+            compare(results, json.load(f))
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({
+                "commit": git_commit(), "db_driver": os.getenv('DB_DRIVER'), "python": platform.python_version(),
+                "requests": args.requests, "warmup": args.warmup, "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
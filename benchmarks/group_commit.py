@@ -0,0 +1,121 @@
+"""Record insert throughput: one INSERT and commit per record vs write-behind.
+
+Writes ``--records`` records from ``--clients`` threads into the database
+configured by the usual DB_* variables (point DB_NAME at a scratch database),
+first each with its own INSERT and commit, then through a WriteBehindQueue
+that groups them into multi-row INSERTs. Grouped throughput counts until the
+queue has drained, i.e. until every record is committed:
+
+    DB_NAME=calculator_bench python -m benchmarks.group_commit --records 20000 --clients 16
+"""
+import argparse
+import json
+import tempfile
+import threading
+import time
+
+from app import crud
+from app.database import ConnectionPool, get_db_config
+from app.write_behind import IdBlockAllocator, WriteBehindQueue
+from create_tables import create_tables
+
+BENCH_USER = "bench_group_commit"
+
+
+def setup(pool: ConnectionPool) -> tuple:
+    connection = pool.acquire()
+    try:
+        create_tables(connection)
+        cursor = connection.cursor()
+        cursor.execute("SELECT id FROM users WHERE username = %s", (BENCH_USER,))
+        row = cursor.fetchone()
+        if row:
+            user_id = row[0]
+        else:
+            cursor.execute("INSERT INTO users (username, hashed_password) VALUES (%s, '')", (BENCH_USER,))
+            user_id = cursor.lastrowid
+        cursor.execute("INSERT INTO operations (type, cost) VALUES ('addition', 1.0)")
+        operation_id = cursor.lastrowid
+        connection.commit()
+        return user_id, operation_id
+    finally:
+        pool.release(connection)
+
+
+def run_clients(clients: int, records: int, write) -> float:
+    per_client = records // clients
+
+    def client():
+        for _ in range(per_client):
+            write()
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--interval-ms", type=int, default=10)
+    parser.add_argument("--max-rows", type=int, default=500)
+    parser.add_argument("--json", dest="json_path")
+    args = parser.parse_args()
+
+    pool = ConnectionPool(get_db_config(), size=args.clients + 2, timeout=30)
+    user_id, operation_id = setup(pool)
+    record = {
+        "operation_id": operation_id, "user_id": user_id, "amount": 1.0, "user_balance": 100.0,
+        "operation_response": "2",
+    }
+
+    def with_connection(func, *func_args):
+        connection = pool.acquire()
+        try:
+            return func(connection, *func_args)
+        finally:
+            pool.release(connection)
+
+    allocator = IdBlockAllocator(lambda count: with_connection(crud.reserve_record_ids, count))
+
+    def immediate():
+        with_connection(crud.insert_records, [dict(record, id=allocator.allocate()[0])])
+
+    immediate_seconds = run_clients(args.clients, args.records, immediate)
+
+    with tempfile.TemporaryDirectory() as wal_dir:
+        queue = WriteBehindQueue(
+            insert=lambda records: with_connection(crud.insert_records, records), allocator=allocator,
+            wal_dir=wal_dir, interval=args.interval_ms / 1000, max_rows=args.max_rows
+        )
+        queue.start()
+        started = time.perf_counter()
+        run_clients(args.clients, args.records, lambda: queue.submit([record]))
+        queue.drain()
+        grouped_seconds = time.perf_counter() - started
+        stats = queue.stats()
+        queue.close()
+
+    written = args.records // args.clients * args.clients
+    results = {
+        "immediate": round(written / immediate_seconds, 1),
+        "grouped": round(written / grouped_seconds, 1),
+    }
+    for label, rate in results.items():
+        print(f"{label:<10} {rate:>10} records/s")
+    print(f"grouped flushes: {stats['flushes']} (avg {written / max(stats['flushes'], 1):.1f} rows)")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({
+                "records": written, "clients": args.clients, "interval_ms": args.interval_ms,
+                "max_rows": args.max_rows, "flushes": stats["flushes"], "unit": "records/s", "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
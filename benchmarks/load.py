@@ -0,0 +1,108 @@
+"""Closed-loop load test of a running API: requests/sec and latency percentiles.
+
+Start a MySQL stand-in and the API once per driver, then run this script
+against each server and compare the output:
+
+    docker run -d --name ntd-mysql -p 3306:3306 -e MYSQL_ROOT_PASSWORD=root \\
+        -e MYSQL_DATABASE=calculator_bench -e MYSQL_USER=calculator_user -e MYSQL_PASSWORD=password mysql:8
+    DB_NAME=calculator_bench python create_tables.py
+    DB_NAME=calculator_bench DB_DRIVER=sync DB_POOL_SIZE=20 uvicorn app.main:app --port 8000
+    python -m benchmarks.load --label sync --json sync.json
+    # restart uvicorn with DB_DRIVER=async, then
+    python -m benchmarks.load --label async --json async.json
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+import httpx
+
+
+def percentile(samples: list, fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+async def setup(client: httpx.AsyncClient) -> tuple:
+    username = f"load-{uuid.uuid4().hex[:12]}"
+    await client.post("/api/v1/users/", json={"username": username, "password": "load"})
+    response = await client.post("/api/v1/token", data={"username": username, "password": "load"})
+    response.raise_for_status()
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    # A free operation, so the balance never runs out during the test.
+    response = await client.post("/api/v1/operations/", json={"type": "addition", "cost": 0.0})
+    response.raise_for_status()
+    return headers, response.json()["id"]
+
+
+async def run_level(client: httpx.AsyncClient, endpoint: str, concurrency: int, duration: float,
+                    headers: dict, operation_id: int) -> dict:
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                if endpoint == "calculate":
+                    response = await client.post(
+                        "/api/v1/calculate/", json={"operation_id": operation_id}, headers=headers
+                    )
+                else:
+                    response = await client.get("/api/v1/records/", headers=headers)
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append((time.perf_counter() - started) * 1000)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies), 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99), 2) if latencies else None,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--endpoint", choices=["calculate", "records"], default="calculate")
+    parser.add_argument("--concurrency", default="50,200,1000")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--label", default="")
+    parser.add_argument("--json", dest="json_path")
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.concurrency.split(",")]
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30) as client:
+        headers, operation_id = await setup(client)
+        results = []
+        for concurrency in levels:
+            result = await run_level(client, args.endpoint, concurrency, args.duration, headers, operation_id)
+            results.append(result)
+            print(
+                f"{args.label:>6} c={concurrency:<5} rps={result['rps']:<9} p50={result['p50_ms']} ms"
+                f"  p99={result['p99_ms']} ms  errors={result['errors']}"
+            )
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"label": args.label, "endpoint": args.endpoint, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
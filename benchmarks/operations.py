@@ -0,0 +1,74 @@
+"""Dispatch plus evaluation cost of a single calculation.
+
+Times the original if/elif chain against the operation registry with and
+without its memo, in float and decimal mode. Needs no database:
+
+    python -m benchmarks.operations --json operations.json
+"""
+import argparse
+import json
+import timeit
+from decimal import Decimal
+
+from app.calculator import Calculator, CalculatorConfig, register_builtin_operations
+
+OPERATION_TYPES = ["addition", "subtraction", "multiplication", "division", "square_root"]
+
+
+def legacy_perform_operation(operation_type: str) -> str:
+    if operation_type == "addition":
+        return str(1 + 1)
+    elif operation_type == "subtraction":
+        return str(1 - 1)
+    elif operation_type == "multiplication":
+        return str(1 * 1)
+    elif operation_type == "division":
+        return str(1 / 1)
+    elif operation_type == "square_root":
+        return str(1 ** 0.5)
+    else:
+        raise ValueError("Invalid operation type")
+
+
+def time_per_call(func, number: int, repeat: int) -> float:
+    # Best of ``repeat`` runs, in microseconds per call over all operation types.
+    best = min(timeit.repeat(func, number=number, repeat=repeat))
+    return round(best / (number * len(OPERATION_TYPES)) * 1e6, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", dest="json_path")
+    args = parser.parse_args()
+
+    operands = {name: [Decimal("12.5")] if name == "square_root" else [Decimal("12.5"), Decimal("3")]
+                for name in OPERATION_TYPES}
+    calculators = {
+        "float": register_builtin_operations(Calculator(CalculatorConfig(mode="float"), memo_size=0)),
+        "float+memo": register_builtin_operations(Calculator(CalculatorConfig(mode="float"), memo_size=1024)),
+        "decimal": register_builtin_operations(Calculator(CalculatorConfig(mode="decimal"), memo_size=0)),
+        "decimal+memo": register_builtin_operations(Calculator(CalculatorConfig(mode="decimal"), memo_size=1024)),
+    }
+
+    results = {"legacy": time_per_call(
+        lambda: [legacy_perform_operation(name) for name in OPERATION_TYPES], args.number, args.repeat
+    )}
+    for label, calculator in calculators.items():
+        results[f"{label} (constants)"] = time_per_call(
+            lambda: [calculator.evaluate(name) for name in OPERATION_TYPES], args.number, args.repeat
+        )
+        results[f"{label} (operands)"] = time_per_call(
+            lambda: [calculator.evaluate(name, operands[name]) for name in OPERATION_TYPES], args.number, args.repeat
+        )
+
+    for label, micros in results.items():
+        print(f"{label:<24} {micros:>8} us/call")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"unit": "us/call", "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Page-N latency of GET /records/ queries: OFFSET pagination vs keyset cursors.
+
+Seeds one user with ``--rows`` records into the database configured by the
+usual DB_* variables (point DB_NAME at a scratch database), then times the
+query behind each page depth both ways:
+
+    DB_NAME=calculator_bench python -m benchmarks.records_pagination --rows 2000000
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from app import crud
+from app.database import create_connection
+from app.pagination import RECORD_SORTS
+from create_tables import create_tables
+
+BENCH_USER = "bench_pagination"
+
+
+def seed(connection, rows: int, batch_size: int = 10000) -> int:
+    cursor = connection.cursor()
+    cursor.execute("SELECT id FROM users WHERE username = %s", (BENCH_USER,))
+    row = cursor.fetchone()
+    if row:
+        user_id = row[0]
+    else:
+        cursor.execute("INSERT INTO users (username, hashed_password) VALUES (%s, '')", (BENCH_USER,))
+        user_id = cursor.lastrowid
+    cursor.execute("INSERT INTO operations (type, cost) VALUES ('addition', 1.0)")
+    operation_id = cursor.lastrowid
+    cursor.execute("SELECT COUNT(*) FROM records WHERE user_id = %s", (user_id,))
+    existing = cursor.fetchone()[0]
+    started = datetime(2020, 1, 1)
+    for offset in range(existing, rows, batch_size):
+        batch = [
+            (operation_id, user_id, random.randint(1, 500) / 100, 100.0, "2", started + timedelta(seconds=i))
+            for i in range(offset, min(offset + batch_size, rows))
+        ]
+        cursor.executemany(
+            "INSERT INTO records (operation_id, user_id, amount, user_balance, operation_response, created_at)"
+            " VALUES (%s, %s, %s, %s, %s, %s)",
+            batch
+        )
+        connection.commit()
+        print(f"seeded {offset + len(batch)}/{rows}", end="\r")
+    print()
+    return user_id
+
+
+def time_query(func, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2000000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--sort", default="created_at")
+    parser.add_argument("--json", dest="json_path")
+    args = parser.parse_args()
+
+    connection = create_connection()
+    create_tables(connection)
+    user_id = seed(connection, args.rows)
+
+    results = []
+    depth = 1
+    while depth * args.limit < args.rows:
+        skip = depth * args.limit
+        # The cursor a client would hold after reading ``depth`` pages.
+        previous = crud.get_records(connection, skip=skip - 1, limit=1, user_id=user_id, sort=args.sort)[0]
+        after = (previous[RECORD_SORTS[args.sort][0]], previous["id"])
+        offset_ms = time_query(
+            lambda: crud.get_records(connection, skip=skip, limit=args.limit, user_id=user_id, sort=args.sort),
+            args.repeat
+        )
+        keyset_ms = time_query(
+            lambda: crud.get_records(connection, limit=args.limit, user_id=user_id, sort=args.sort, after=after),
+            args.repeat
+        )
+        results.append({"page": depth, "offset_ms": round(offset_ms, 3), "keyset_ms": round(keyset_ms, 3)})
+        print(f"page {depth:>9}: offset {offset_ms:9.3f} ms   keyset {keyset_ms:7.3f} ms")
+        depth *= 10
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"rows": args.rows, "sort": args.sort, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Encoding cost of a /records/ page, per response path.
+
+Times the rows as /records/ used to return them (``response_model=list``, so
+jsonable_encoder walks the dicts), as a typed response model would (one
+pydantic model per row, then jsonable_encoder), and through the precomputed
+serializer in app/serialization.py, for pages of 100 and 1000 records. Needs
+no database:
+
+    python -m benchmarks.serialization --json serialization.json
+
+Install orjson for the serializer's fast path; without it the stdlib encoder
+is used and the run says so.
+"""
+import argparse
+import json
+import timeit
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from fastapi.encoders import jsonable_encoder
+
+from app import schemas, serialization
+from app.serialization import STORED_RECORD
+
+
+def make_rows(count: int) -> list:
+    # As the MySQL driver returns them: DECIMAL amounts, 0/1 flags.
+    created_at = datetime(2024, 1, 1)
+    return [
+        {
+            "id": n, "operation_id": 1, "user_id": 1, "amount": Decimal("1.50"),
+            "user_balance": Decimal(100) - n, "operation_response": str(n * 7),
+            "created_at": created_at + timedelta(seconds=n), "deleted": 0,
+        }
+        for n in range(1, count + 1)
+    ]
+
+
+def untyped(rows: list) -> bytes:
+    return serialization.dumps(jsonable_encoder(rows))
+
+
+def typed_model(rows: list) -> bytes:
+    return serialization.dumps(jsonable_encoder([schemas.StoredRecord(**row) for row in rows]))
+
+
+def precomputed(rows: list) -> bytes:
+    return STORED_RECORD.dumps_many(rows)
+
+
+PATHS = {"untyped": untyped, "typed model": typed_model, "serializer": precomputed}
+
+
+def time_per_page(func, rows: list, number: int, repeat: int) -> float:
+    # Best of ``repeat`` runs, in milliseconds per page.
+    best = min(timeit.repeat(lambda: func(rows), number=number, repeat=repeat))
+    return round(best / number * 1e3, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="100,1000")
+    parser.add_argument("--number", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", dest="json_path")
+    args = parser.parse_args()
+
+    encoder = "orjson" if serialization.orjson is not None else "json"
+    print(f"encoder: {encoder}")
+    results = {}
+    for size in map(int, args.sizes.split(",")):
+        rows = make_rows(size)
+        for label, func in PATHS.items():
+            millis = results[f"{label} ({size})"] = time_per_page(func, rows, args.number, args.repeat)
+            print(f"{label:<12} {size:>6} records {millis:>9} ms/page")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"unit": "ms/page", "encoder": encoder, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
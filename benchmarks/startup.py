@@ -0,0 +1,83 @@
+"""Cold-start time of a worker, from process start to a green /ready.
+
+Each run starts a fresh Python process that imports the app, runs its
+startup hook through TestClient and polls /ready until warm-up is done, then
+reports the worker's own phase timings (imports, startup hook, each warm-up
+step) next to the wall time measured from outside, interpreter start
+included. Needs no database: DB_DRIVER defaults to sqlite in memory, so the
+pool steps time SQLite rather than MySQL connects. BCRYPT_ROUNDS defaults to
+4 so the hot_paths step times starting the bcrypt worker rather than bcrypt.
+
+    python -m benchmarks.startup --json before.json
+    python -m benchmarks.startup --json after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+def child():
+    os.environ.setdefault('DB_DRIVER', 'sqlite')
+    os.environ.setdefault('BCRYPT_ROUNDS', '4')
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    with TestClient(app) as client:
+        while True:
+            response = client.get("/ready")
+            if response.status_code == 200:
+                break
+            time.sleep(0.005)
+    print(json.dumps(response.json()))
+
+
+def run_once() -> dict:
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--child"], capture_output=True, text=True, check=True
+    ).stdout
+    wall_ms = round((time.perf_counter() - started) * 1000, 1)
+    stats = json.loads(output.strip().splitlines()[-1])
+    stats["wall_ms"] = wall_ms
+    return stats
+
+
+def summarize(runs: list) -> dict:
+    # Median of each timing over the runs.
+    keys = [key for key in runs[0] if key.endswith("_ms")]
+    return {key: round(statistics.median(run[key] for run in runs), 1) for key in keys}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", dest="json_path")
+    parser.add_argument("--compare", dest="baseline_path")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child()
+
+    results = summarize([run_once() for _ in range(args.runs)])
+    for key, millis in results.items():
+        print(f"{key:<24} {millis:>9} ms")
+    if args.baseline_path:
+        with open(args.baseline_path) as f:
+            baseline = json.load(f)["results"]
+        print("\nvs baseline:")
+        for key, millis in results.items():
+            if baseline.get(key):
+                print(f"{key:<24} {(millis / baseline[key] - 1) * 100:+6.1f}%")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"unit": "ms", "runs": args.runs, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
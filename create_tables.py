@@ -1,7 +1,5 @@
 from app.database import create_connection
 
-connection = create_connection()
-
 create_users_table = """
 CREATE TABLE IF NOT EXISTS users (
     id INT AUTO_INCREMENT, 
@@ -37,10 +35,131 @@ CREATE TABLE IF NOT EXISTS records (
 );
 """
 
-cursor = connection.cursor()
-cursor.execute(create_users_table)
-cursor.execute(create_operations_table)
-cursor.execute(create_records_table)
+# Soft-deleted records and records older than RECORDS_ARCHIVE_AFTER_DAYS, moved
+# out of records by archive_records.py so the hot table and its indexes stay
+# small. ids are those the rows had in records.
+create_records_archive_table = """
+CREATE TABLE IF NOT EXISTS records_archive (
+    id INT PRIMARY KEY,
+    operation_id INT,
+    user_id INT,
+    amount DECIMAL(10, 2),
+    user_balance DECIMAL(10, 2),
+    operation_response TEXT,
+    created_at TIMESTAMP NULL,
+    deleted BOOLEAN DEFAULT FALSE,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+# Per-user, per-operation totals of live records, kept in step with records
+# by the crud write paths. backfill_usage.py rebuilds it from records.
+create_user_usage_table = """
+CREATE TABLE IF NOT EXISTS user_usage (
+    user_id INT NOT NULL,
+    operation_id INT NOT NULL,
+    calls INT NOT NULL DEFAULT 0,
+    total_amount DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    last_created_at TIMESTAMP NULL,
+    PRIMARY KEY (user_id, operation_id),
+    FOREIGN KEY (operation_id) REFERENCES operations(id),
+    FOREIGN KEY (user_id) REFERENCES users(id)
+)
+"""
+
+# Record id blocks handed out to workers running with WRITE_BEHIND_ENABLED,
+# which need a record's id before the record is inserted.
+create_id_sequences_table = """
+CREATE TABLE IF NOT EXISTS id_sequences (
+    name VARCHAR(64) PRIMARY KEY,
+    next_id BIGINT NOT NULL
+)
+"""
+
+# Responses of /calculate/ requests sent with an Idempotency-Key, replayed to
+# retries for IDEMPOTENCY_KEY_TTL seconds; workers purge older rows on start.
+create_idempotency_keys_table = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    user_id INT NOT NULL,
+    idempotency_key VARCHAR(255) NOT NULL,
+    record_id INT NULL,
+    response TEXT NULL,
+    request_hash CHAR(64) NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, idempotency_key),
+    INDEX idx_idempotency_keys_created (created_at),
+    FOREIGN KEY (user_id) REFERENCES users(id)
+)
+"""
+
+# Columns added since their table was first created, added to existing
+# databases by re-running this script.
+columns = [
+    # SHA-256 of the request an idempotency key was first used with.
+    ("idempotency_keys", "request_hash", "CHAR(64) NULL AFTER response"),
+]
+
+# Secondary indexes, added to existing databases by re-running this script.
+indexes = [
+    # Keyset pagination of a user's records by created_at or amount, plus the
+    # date range and amount filters.
+    ("records", "idx_records_user_created", "(user_id, deleted, created_at, id)", "INDEX"),
+    ("records", "idx_records_user_amount", "(user_id, deleted, amount, id)", "INDEX"),
+    ("records", "idx_records_user_operation", "(user_id, deleted, operation_id, created_at, id)", "INDEX"),
+    # Free-text search on operation responses.
+    ("records", "ft_records_operation_response", "(operation_response)", "FULLTEXT INDEX"),
+    # GET /records/?include_archived=true and backfill_usage.py.
+    ("records_archive", "idx_records_archive_user_created", "(user_id, deleted, created_at, id)", "INDEX"),
+    ("records_archive", "idx_records_archive_user_amount", "(user_id, deleted, amount, id)", "INDEX"),
+    ("records_archive", "idx_records_archive_user_operation", "(user_id, deleted, operation_id, created_at, id)",
+     "INDEX"),
+    ("records_archive", "ft_records_archive_operation_response", "(operation_response)", "FULLTEXT INDEX"),
+]
+
+
+def add_column(cursor, table: str, name: str, definition: str) -> None:
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.columns"
+        " WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s",
+        (table, name)
+    )
+    if cursor.fetchone()[0] == 0:
+        # A nullable column is added in place, without copying the table.
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}, ALGORITHM=INPLACE, LOCK=NONE")
+        print(f"Added column {name} to {table}")
+
+
+def create_index(cursor, table: str, name: str, columns: str, kind: str = "INDEX") -> None:
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.statistics"
+        " WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s",
+        (table, name)
+    )
+    if cursor.fetchone()[0] == 0:
+        # Online DDL: the table stays readable and writable while a regular index
+        # builds. FULLTEXT indexes only allow concurrent reads.
+        options = " ALGORITHM=INPLACE LOCK=NONE" if kind == "INDEX" else ""
+        cursor.execute(f"CREATE {kind} {name} ON {table} {columns}{options}")
+        print(f"Created index {name} on {table}")
+
+
+def create_tables(connection) -> None:
+    cursor = connection.cursor()
+    cursor.execute(create_users_table)
+    cursor.execute(create_operations_table)
+    cursor.execute(create_records_table)
+    cursor.execute(create_records_archive_table)
+    cursor.execute(create_user_usage_table)
+    cursor.execute(create_id_sequences_table)
+    cursor.execute(create_idempotency_keys_table)
+    for table, name, definition in columns:
+        add_column(cursor, table, name, definition)
+    for table, name, columns, kind in indexes:
+        create_index(cursor, table, name, columns, kind)
+    connection.commit()
+
 
-print("Tables created successfully!")
+if __name__ == "__main__":
+    create_tables(create_connection())
+    print("Tables created successfully!")
 
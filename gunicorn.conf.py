@@ -0,0 +1,27 @@
+"""gunicorn settings for running several uvicorn workers per dyno (the Procfile):
+
+    gunicorn app.main:app -c gunicorn.conf.py
+
+WEB_CONCURRENCY sets the worker count (default one per CPU); each worker
+sizes its database pools from DB_CONNECTION_BUDGET using the same count (see
+``worker_pool_size`` in app/database.py) and answers /ready once warmed up.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.getenv('WEB_CONCURRENCY') or multiprocessing.cpu_count())
+# Workers inherit the environment, so their pool sizing sees the real count.
+os.environ['WEB_CONCURRENCY'] = str(workers)
+# Import the app once in the master and fork it, so workers start without
+# re-importing and share those pages copy-on-write. Pools, threads and
+# caches are still created per worker, by the startup hook.
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+# Heroku sends SIGTERM and waits 30 seconds before SIGKILL.
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 25))
+accesslog = "-"
+# Only Heroku's router can reach a dyno, and its addresses are not fixed, so
+# uvicorn takes the client address from X-Forwarded-For for any peer.
+forwarded_allow_ips = os.getenv('FORWARDED_ALLOW_IPS', '*')
@@ -0,0 +1,203 @@
+"""Check users.balance against the records ledger, and optionally fix it.
+
+A user's expected balance is the starting balance (``--initial-balance``,
+the users.balance column default) minus the amounts of all their records,
+deleted ones included since deleting does not refund, in records and
+records_archive. It is computed in DECIMAL, one grouped query per chunk of
+``--chunk-size`` user ids, and compared with the FLOAT column within
+``--tolerance``. Chunks run on ``--workers`` connections at once, each read
+in its own short READ COMMITTED statement, so no table is locked while
+checking. With ``--fix`` each chunk's mismatched users are locked, checked
+again and corrected in one short transaction.
+
+Completed chunks are saved to ``--checkpoint`` as the run goes; a run that
+finds the file resumes after the last user it covers (``--restart`` ignores
+it, and it is removed once a run finishes):
+
+    python reconcile_balances.py --workers 4 --chunk-size 1000
+    python reconcile_balances.py --fix --pause 0.05
+
+Balances changed outside /calculate/ (update_user_balance, top-ups made by
+hand) show up as mismatches. With WRITE_BEHIND_ENABLED, records still queued
+make balances look short; run --fix with the queue drained.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from app.database import create_connection
+
+# Expected balance of the users in a range, computed in the database.
+LEDGER = (
+    "SELECT u.id, u.balance, CAST(%s AS DECIMAL(20, 2)) - COALESCE(ledger.spent, 0) FROM users AS u"
+    " LEFT JOIN (SELECT user_id, SUM(amount) AS spent FROM ("
+    " SELECT user_id, amount FROM records WHERE user_id BETWEEN %s AND %s"
+    " UNION ALL SELECT user_id, amount FROM records_archive WHERE user_id BETWEEN %s AND %s"
+    ") AS entries GROUP BY user_id) AS ledger ON ledger.user_id = u.id"
+    " WHERE u.id BETWEEN %s AND %s"
+)
+
+
+def find_mismatches(cursor, first_id: int, last_id: int, initial_balance: Decimal, tolerance: Decimal) -> tuple:
+    # (users checked, [(user_id, balance, expected), ...]) for one id range.
+    cursor.execute(LEDGER, (initial_balance, first_id, last_id, first_id, last_id, first_id, last_id))
+    rows = cursor.fetchall()
+    mismatches = [
+        (user_id, balance, expected) for user_id, balance, expected in rows
+        if balance is None or abs(Decimal(str(balance)) - expected) > tolerance
+    ]
+    return len(rows), mismatches
+
+
+def fix_mismatches(cursor, mismatches: list, initial_balance: Decimal, tolerance: Decimal) -> list:
+    # Locks the mismatched users rows, which charges lock too, then checks
+    # them again so a charge committed since the first check is not undone.
+    ids = [user_id for user_id, _, _ in mismatches]
+    placeholders = ", ".join(["%s"] * len(ids))
+    cursor.execute(f"SELECT id FROM users WHERE id IN ({placeholders}) ORDER BY id FOR UPDATE", ids)
+    cursor.fetchall()
+    _, still = find_mismatches(cursor, ids[0], ids[-1], initial_balance, tolerance)
+    fixed = [mismatch for mismatch in still if mismatch[0] in ids]
+    if fixed:
+        cursor.executemany(
+            "UPDATE users SET balance = %s WHERE id = %s", [(expected, user_id) for user_id, _, expected in fixed]
+        )
+    return fixed
+
+
+class Reconciler:
+    """Runs chunks on a bounded pool of threads, one connection per thread."""
+
+    def __init__(
+        self, connect=create_connection, initial_balance: Decimal = Decimal("100"),
+        tolerance: Decimal = Decimal("0.01"), fix: bool = False, pause: float = 0.05
+    ):
+        self.connect = connect
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self.initial_balance = initial_balance
+        self.tolerance = tolerance
+        self.fix = fix
+        self.pause = pause
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = self.connect()
+            cursor = connection.cursor()
+            # Every statement reads what is committed when it starts, and a
+            # commit after each chunk keeps no snapshot open.
+            cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED")
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def check_chunk(self, bounds: tuple) -> dict:
+        first_id, last_id = bounds
+        connection = self._connection()
+        cursor = connection.cursor()
+        try:
+            checked, mismatches = find_mismatches(cursor, first_id, last_id, self.initial_balance, self.tolerance)
+            fixed = []
+            if mismatches and self.fix:
+                fixed = fix_mismatches(cursor, mismatches, self.initial_balance, self.tolerance)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        time.sleep(self.pause)
+        return {"last_id": last_id, "checked": checked, "mismatches": mismatches, "fixed": fixed}
+
+    def close(self) -> None:
+        for connection in self._connections:
+            connection.close()
+
+
+def load_checkpoint(path: str) -> dict:
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {"after": 0, "checked": 0, "mismatched": 0, "fixed": 0}
+
+
+def save_checkpoint(path: str, state: dict) -> None:
+    # Written aside and renamed, so a crash never leaves half a file.
+    if path:
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(f"{path}.tmp", path)
+
+
+def reconcile(
+    reconciler: Reconciler, chunk_size: int = 1000, workers: int = 4, checkpoint: str = None, report=print
+) -> dict:
+    state = load_checkpoint(checkpoint)
+    connection = reconciler.connect()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT MAX(id) FROM users")
+        [last_id] = cursor.fetchone()
+        connection.commit()
+    finally:
+        connection.close()
+    chunks = (
+        (start, min(start + chunk_size - 1, last_id))
+        for start in range(state["after"] + 1, (last_id or 0) + 1, chunk_size)
+    )
+
+    def record(result: dict) -> None:
+        for user_id, balance, expected in result["mismatches"]:
+            report(f"user {user_id}: balance {balance}, ledger says {expected}")
+        state["after"] = result["last_id"]
+        state["checked"] += result["checked"]
+        state["mismatched"] += len(result["mismatches"])
+        state["fixed"] += len(result["fixed"])
+        save_checkpoint(checkpoint, state)
+
+    # At most two chunks per worker are in flight, and results are recorded
+    # in chunk order, so the checkpoint only covers chunks that are all done
+    # and a failure stops the run after the chunks already started.
+    pending = deque()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for bounds in chunks:
+                pending.append(executor.submit(reconciler.check_chunk, bounds))
+                if len(pending) >= workers * 2:
+                    record(pending.popleft().result())
+            while pending:
+                record(pending.popleft().result())
+    finally:
+        reconciler.close()
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunk-size", type=int, default=1000, help="User ids per grouped query")
+    parser.add_argument("--workers", type=int, default=4, help="Chunks checked at once, one connection each")
+    parser.add_argument("--pause", type=float, default=0.05, help="Seconds each worker sleeps between chunks")
+    parser.add_argument("--initial-balance", type=Decimal, default=Decimal("100"))
+    parser.add_argument("--tolerance", type=Decimal, default=Decimal("0.01"), help="Largest difference ignored")
+    parser.add_argument("--fix", action="store_true", help="Set mismatched balances to the ledger's")
+    parser.add_argument("--checkpoint", default="reconcile_balances.checkpoint")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start from the first user")
+    args = parser.parse_args()
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    started = time.monotonic()
+    result = reconcile(
+        Reconciler(initial_balance=args.initial_balance, tolerance=args.tolerance, fix=args.fix, pause=args.pause),
+        args.chunk_size, args.workers, args.checkpoint
+    )
+    print(
+        f"Checked {result['checked']} users in {time.monotonic() - started:.1f}s: {result['mismatched']} mismatched,"
+        f" {result['fixed']} fixed"
+    )
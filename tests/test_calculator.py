@@ -1,8 +1,13 @@
+from datetime import datetime, timedelta
+
 import pytest
 import mysql.connector
 from mysql.connector import Error
 from fastapi.testclient import TestClient
 from app.main import app
+from app.slow_queries import get_slow_query_log
+from archive_records import archive
+from reconcile_balances import Reconciler, reconcile
 import os
 
 client = TestClient(app)
@@ -13,6 +18,8 @@ os.environ['DB_NAME'] = 'calculator_test'
 os.environ['DB_USER'] = 'calculator_user'
 os.environ['DB_PASSWORD'] = 'password'
 os.environ['DB_POOL_SIZE'] = '5'
+# Every test logs in from the same client address.
+os.environ['RATE_LIMIT_ENABLED'] = 'false'
 
 
 def create_test_connection():
@@ -39,6 +46,9 @@ def setup_and_teardown():
     cursor.execute("SET FOREIGN_KEY_CHECKS=0")
 
     # Drop tables if they exist
+    cursor.execute("DROP TABLE IF EXISTS idempotency_keys")
+    cursor.execute("DROP TABLE IF EXISTS user_usage")
+    cursor.execute("DROP TABLE IF EXISTS records_archive")
     cursor.execute("DROP TABLE IF EXISTS records")
     cursor.execute("DROP TABLE IF EXISTS operations")
     cursor.execute("DROP TABLE IF EXISTS users")
@@ -72,11 +82,60 @@ def setup_and_teardown():
         operation_response TEXT,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         deleted BOOLEAN DEFAULT FALSE,
+        INDEX idx_records_user_created (user_id, deleted, created_at, id),
+        INDEX idx_records_user_amount (user_id, deleted, amount, id),
+        INDEX idx_records_user_operation (user_id, deleted, operation_id, created_at, id),
+        FULLTEXT INDEX ft_records_operation_response (operation_response),
+        FOREIGN KEY (operation_id) REFERENCES operations(id),
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    """)
+
+    cursor.execute("""
+    CREATE TABLE records_archive (
+        id INT PRIMARY KEY,
+        operation_id INT,
+        user_id INT,
+        amount FLOAT,
+        user_balance FLOAT,
+        operation_response TEXT,
+        created_at TIMESTAMP NULL,
+        deleted BOOLEAN DEFAULT FALSE,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        INDEX idx_records_archive_user_created (user_id, deleted, created_at, id),
+        INDEX idx_records_archive_user_amount (user_id, deleted, amount, id),
+        INDEX idx_records_archive_user_operation (user_id, deleted, operation_id, created_at, id),
+        FULLTEXT INDEX ft_records_archive_operation_response (operation_response)
+    )
+    """)
+
+    cursor.execute("""
+    CREATE TABLE user_usage (
+        user_id INT NOT NULL,
+        operation_id INT NOT NULL,
+        calls INT NOT NULL DEFAULT 0,
+        total_amount DECIMAL(14, 2) NOT NULL DEFAULT 0,
+        last_created_at TIMESTAMP NULL,
+        PRIMARY KEY (user_id, operation_id),
         FOREIGN KEY (operation_id) REFERENCES operations(id),
         FOREIGN KEY (user_id) REFERENCES users(id)
     )
     """)
 
+    cursor.execute("""
+    CREATE TABLE idempotency_keys (
+        user_id INT NOT NULL,
+        idempotency_key VARCHAR(255) NOT NULL,
+        record_id INT NULL,
+        response TEXT NULL,
+        request_hash CHAR(64) NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, idempotency_key),
+        INDEX idx_idempotency_keys_created (created_at),
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    """)
+
     connection.commit()
 
     # Re-enable foreign key checks
@@ -86,6 +145,9 @@ def setup_and_teardown():
 
     # Teardown: Clean up after tests
     cursor.execute("SET FOREIGN_KEY_CHECKS=0")
+    cursor.execute("DROP TABLE IF EXISTS idempotency_keys")
+    cursor.execute("DROP TABLE IF EXISTS user_usage")
+    cursor.execute("DROP TABLE IF EXISTS records_archive")
     cursor.execute("DROP TABLE IF EXISTS records")
     cursor.execute("DROP TABLE IF EXISTS operations")
     cursor.execute("DROP TABLE IF EXISTS users")
@@ -95,6 +157,17 @@ def setup_and_teardown():
     connection.close()
 
 
+@pytest.fixture(autouse=True)
+def no_full_table_scans(monkeypatch):
+    # Every crud statement is explained; a full scan of anything but the
+    # operations catalog fails the test that issued it.
+    log = get_slow_query_log()
+    monkeypatch.setattr(log, "fail_on_full_scan", True)
+    log.full_scans.clear()
+    yield
+    assert log.full_scans == []
+
+
 def test_create_user():
     response = client.post("/api/v1/users/", json={"username": "testuser", "password": "testpassword"})
     assert response.status_code == 200
@@ -111,6 +184,24 @@ def test_login():
     assert data["username"] == "testuser"
 
 
+def test_access_token_and_refresh():
+    response = client.post("/api/v1/token", data={"username": "testuser", "password": "testpassword"})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["token_type"] == "bearer"
+    headers = {"Authorization": f"Bearer {data['access_token']}"}
+    response = client.get("/api/v1/records/", headers=headers)
+    assert response.status_code == 200
+
+    response = client.post("/api/v1/token/refresh", json={"refresh_token": data["refresh_token"]})
+    assert response.status_code == 200
+    assert response.json()["username"] == "testuser"
+
+    # An access token cannot be used as a refresh token.
+    response = client.post("/api/v1/token/refresh", json={"refresh_token": data["access_token"]})
+    assert response.status_code == 401
+
+
 def test_create_operation():
     response = client.post("/api/v1/operations/", json={"type": "addition", "cost": 1.0})
     assert response.status_code == 200
@@ -120,6 +211,17 @@ def test_create_operation():
     assert "id" in data
 
 
+def test_read_operations_etag():
+    client.post("/api/v1/operations/", json={"type": "subtraction", "cost": 1.0})
+    response = client.get("/api/v1/operations/", params={"limit": 100})
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert any(op["type"] == "subtraction" for op in response.json())
+
+    response = client.get("/api/v1/operations/", params={"limit": 100}, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+
 def test_calculate():
     response = client.post("/api/v1/operations/", json={"type": "addition", "cost": 1.0})
     assert response.status_code == 200
@@ -127,7 +229,7 @@ def test_calculate():
     client.post("/api/v1/users/", json={"username": "testuser", "password": "testpassword"})
     response = client.post("/api/v1/token", data={"username": "testuser", "password": "testpassword"})
     assert response.status_code == 200
-    token = response.json()["username"]
+    token = response.json()["access_token"]
 
     response = client.post(
         "/api/v1/calculate/",
@@ -140,6 +242,83 @@ def test_calculate():
     assert data["operation_response"] == "2"
 
 
+def test_calculate_insufficient_balance():
+    response = client.post("/api/v1/operations/", json={"type": "addition", "cost": 1000.0})
+    assert response.status_code == 200
+    operation_id = response.json()["id"]
+    client.post("/api/v1/users/", json={"username": "testuser", "password": "testpassword"})
+    response = client.post("/api/v1/token", data={"username": "testuser", "password": "testpassword"})
+    token = response.json()["access_token"]
+    balance = response.json()["balance"]
+
+    response = client.post(
+        "/api/v1/calculate/",
+        json={"operation_id": operation_id},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 400
+
+    response = client.post("/api/v1/token", data={"username": "testuser", "password": "testpassword"})
+    assert response.json()["balance"] == balance
+
+
+def test_calculate_idempotency_key():
+    response = client.post("/api/v1/operations/", json={"type": "random_string", "cost": 1.0})
+    operation_id = response.json()["id"]
+    client.post("/api/v1/users/", json={"username": "testuser", "password": "testpassword"})
+    response = client.post("/api/v1/token", data={"username": "testuser", "password": "testpassword"})
+    token = response.json()["access_token"]
+    balance = response.json()["balance"]
+    headers = {"Authorization": f"Bearer {token}", "Idempotency-Key": "retry-1"}
+
+    first = client.post("/api/v1/calculate/", json={"operation_id": operation_id}, headers=headers)
+    retry = client.post("/api/v1/calculate/", json={"operation_id": operation_id}, headers=headers)
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+    # The same key with another body is refused, not answered with the first response.
+    reused = client.post("/api/v1/calculate/", json={"operation_id": operation_id, "operands": []}, headers=headers)
+    assert reused.status_code == 422
+
+    response = client.post("/api/v1/token", data={"username": "testuser", "password": "testpassword"})
+    assert response.json()["balance"] == balance - 1.0
+
+    headers["Idempotency-Key"] = "retry-2"
+    other = client.post("/api/v1/calculate/", json={"operation_id": operation_id}, headers=headers)
+    assert other.json()["id"] != first.json()["id"]
+
+
+def test_calculate_batch():
+    response = client.post("/api/v1/operations/", json={"type": "addition", "cost": 1.0})
+    addition_id = response.json()["id"]
+    response = client.post("/api/v1/operations/", json={"type": "subtraction", "cost": 2.0})
+    subtraction_id = response.json()["id"]
+    client.post("/api/v1/users/", json={"username": "testuser", "password": "testpassword"})
+    response = client.post("/api/v1/token", data={"username": "testuser", "password": "testpassword"})
+    token = response.json()["access_token"]
+    balance = response.json()["balance"]
+
+    response = client.post(
+        "/api/v1/calculate/batch",
+        json=[{"operation_id": addition_id}, {"operation_id": 999999}, {"operation_id": subtraction_id}],
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["total_amount"] == 3.0
+    assert data["user_balance"] == balance - 3.0
+    first, missing, last = data["results"]
+    assert first["record"]["operation_response"] == "2"
+    assert first["record"]["user_balance"] == balance - 1.0
+    assert missing["record"] is None and missing["error"] == "Operation not found"
+    assert last["record"]["operation_response"] == "0"
+    assert last["record"]["user_balance"] == balance - 3.0
+
+    response = client.get("/api/v1/records/", headers={"Authorization": f"Bearer {token}"})
+    assert len(response.json()) == 2
+
+
 def test_soft_delete_record():
     response = client.post("/api/v1/operations/", json={"type": "addition", "cost": 1.0})
     assert response.status_code == 200
@@ -147,7 +326,7 @@ def test_soft_delete_record():
     client.post("/api/v1/users/", json={"username": "testuser", "password": "testpassword"})
     response = client.post("/api/v1/token", data={"username": "testuser", "password": "testpassword"})
     assert response.status_code == 200
-    token = response.json()["username"]
+    token = response.json()["access_token"]
 
     response = client.post(
         "/api/v1/calculate/",
@@ -167,3 +346,146 @@ def test_soft_delete_record():
     records = response.json()
     for record in records:
         assert record["id"] != record_id  # Ensure the soft deleted record is not returned
+
+
+def test_usage_summary():
+    response = client.post("/api/v1/operations/", json={"type": "multiplication", "cost": 1.5})
+    operation_id = response.json()["id"]
+    client.post("/api/v1/users/", json={"username": "usageuser", "password": "testpassword"})
+    response = client.post("/api/v1/token", data={"username": "usageuser", "password": "testpassword"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    record_ids = []
+    for _ in range(3):
+        response = client.post("/api/v1/calculate/", json={"operation_id": operation_id}, headers=headers)
+        record_ids.append(response.json()["id"])
+    client.delete(f"/api/v1/records/{record_ids[0]}", headers=headers)
+    # Deleting twice must not decrement twice.
+    client.delete(f"/api/v1/records/{record_ids[0]}", headers=headers)
+
+    response = client.get("/api/v1/users/me/usage", headers=headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["calls"] == 2
+    assert data["total_amount"] == 3.0
+    assert data["last_activity"] is not None
+    assert data["operations"] == [{
+        "operation_id": operation_id, "operation_type": "multiplication", "calls": 2, "total_amount": 3.0,
+        "last_created_at": data["last_activity"],
+    }]
+
+
+def test_read_records_keyset_pagination():
+    response = client.post("/api/v1/operations/", json={"type": "addition", "cost": 1.0})
+    operation_id = response.json()["id"]
+    client.post("/api/v1/users/", json={"username": "pageuser", "password": "testpassword"})
+    response = client.post("/api/v1/token", data={"username": "pageuser", "password": "testpassword"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    created_ids = []
+    for _ in range(5):
+        response = client.post("/api/v1/calculate/", json={"operation_id": operation_id}, headers=headers)
+        created_ids.append(response.json()["id"])
+
+    seen_ids = []
+    params = {"limit": 2, "sort": "-created_at"}
+    while True:
+        response = client.get("/api/v1/records/", params=params, headers=headers)
+        assert response.status_code == 200
+        seen_ids.extend(record["id"] for record in response.json())
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params["cursor"] = response.headers["X-Next-Cursor"]
+    assert sorted(seen_ids) == sorted(created_ids)
+    assert len(seen_ids) == len(set(seen_ids))
+
+    response = client.get("/api/v1/records/", params={"cursor": "not-a-cursor"}, headers=headers)
+    assert response.status_code == 400
+
+
+def test_search_records():
+    addition_id = client.post("/api/v1/operations/", json={"type": "addition", "cost": 1.0}).json()["id"]
+    subtraction_id = client.post("/api/v1/operations/", json={"type": "subtraction", "cost": 2.0}).json()["id"]
+    client.post("/api/v1/users/", json={"username": "searchuser", "password": "testpassword"})
+    response = client.post("/api/v1/token", data={"username": "searchuser", "password": "testpassword"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    client.post("/api/v1/calculate/", json={"operation_id": addition_id}, headers=headers)
+    client.post("/api/v1/calculate/", json={"operation_id": subtraction_id}, headers=headers)
+
+    response = client.get("/api/v1/records/", params={"search": "2"}, headers=headers)
+    assert response.status_code == 200
+    assert [record["operation_id"] for record in response.json()] == [addition_id, subtraction_id]
+
+    response = client.get("/api/v1/records/", params={"operation_id": subtraction_id}, headers=headers)
+    assert [record["operation_response"] for record in response.json()] == ["0"]
+
+    response = client.get("/api/v1/records/", params={"min_amount": 1.5}, headers=headers)
+    assert [record["operation_id"] for record in response.json()] == [subtraction_id]
+
+    response = client.get("/api/v1/records/", params={"from": "2000-01-01", "to": "2000-12-31"}, headers=headers)
+    assert response.json() == []
+
+    response = client.get("/api/v1/records/", params={"from": "yesterday"}, headers=headers)
+    assert response.status_code == 400
+
+
+def test_archive_records():
+    operation_id = client.post("/api/v1/operations/", json={"type": "addition", "cost": 1.0}).json()["id"]
+    client.post("/api/v1/users/", json={"username": "archiveuser", "password": "testpassword"})
+    response = client.post("/api/v1/token", data={"username": "archiveuser", "password": "testpassword"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    record_ids = [
+        client.post("/api/v1/calculate/", json={"operation_id": operation_id}, headers=headers).json()["id"]
+        for _ in range(3)
+    ]
+    client.delete(f"/api/v1/records/{record_ids[0]}", headers=headers)
+
+    connection = create_test_connection()
+    try:
+        # Everything created before tomorrow is old enough.
+        result = archive(connection, datetime.now() + timedelta(days=1), batch_size=2, pause=0)
+    finally:
+        connection.close()
+    assert result["moved"] >= 3
+
+    response = client.get("/api/v1/records/", params={"sort": "amount"}, headers=headers)
+    assert response.json() == []
+    response = client.get("/api/v1/records/", params={"sort": "amount", "include_archived": True}, headers=headers)
+    assert [record["id"] for record in response.json()] == record_ids[1:]
+    assert client.get("/api/v1/users/me/usage", headers=headers).json()["calls"] == 2
+
+
+def test_reconcile_balances(tmp_path):
+    operation_id = client.post("/api/v1/operations/", json={"type": "addition", "cost": 2.5}).json()["id"]
+    user_id = client.post("/api/v1/users/", json={"username": "ledgeruser", "password": "testpassword"}).json()["id"]
+    response = client.post("/api/v1/token", data={"username": "ledgeruser", "password": "testpassword"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    for _ in range(2):
+        client.post("/api/v1/calculate/", json={"operation_id": operation_id, "operands": ["1", "2"]}, headers=headers)
+
+    connection = create_test_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("UPDATE users SET balance = 90 WHERE id = %s", (user_id,))
+        connection.commit()
+    finally:
+        connection.close()
+
+    checkpoint = str(tmp_path / "checkpoint")
+    reports = []
+    result = reconcile(Reconciler(create_test_connection, pause=0), chunk_size=2, workers=2, checkpoint=checkpoint,
+                       report=reports.append)
+    assert result["mismatched"] >= 1 and result["fixed"] == 0
+    assert any(report.startswith(f"user {user_id}:") for report in reports)
+
+    result = reconcile(Reconciler(create_test_connection, fix=True, pause=0), chunk_size=2, checkpoint=checkpoint)
+    assert result["fixed"] >= 1
+    connection = create_test_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT balance FROM users WHERE id = %s", (user_id,))
+        assert cursor.fetchone()[0] == 95.0
+    finally:
+        connection.close()
+    reports.clear()
+    reconcile(Reconciler(create_test_connection, pause=0), chunk_size=2, checkpoint=checkpoint, report=reports.append)
+    assert not any(report.startswith(f"user {user_id}:") for report in reports)
@@ -0,0 +1,42 @@
+import asyncio
+
+from app.catalog import OperationCatalog
+
+
+class CountingLoader:
+    def __init__(self, operations):
+        self.operations = operations
+        self.calls = 0
+
+    async def __call__(self, connection):
+        self.calls += 1
+        return list(self.operations)
+
+
+def test_catalog_serves_lookups_from_memory():
+    loader = CountingLoader([{"id": 1, "type": "addition", "cost": 1.0}])
+    catalog = OperationCatalog(loader=loader, ttl=60)
+    assert asyncio.run(catalog.get(None, 1))["type"] == "addition"
+    assert asyncio.run(catalog.get(None, 1))["type"] == "addition"
+    assert loader.calls == 1
+
+
+def test_catalog_reloads_after_ttl_and_changes_etag():
+    loader = CountingLoader([{"id": 1, "type": "addition", "cost": 1.0}])
+    catalog = OperationCatalog(loader=loader, ttl=0)
+    etag = asyncio.run(catalog.snapshot(None)).etag
+    loader.operations.append({"id": 2, "type": "subtraction", "cost": 2.0})
+    snapshot = asyncio.run(catalog.snapshot(None))
+    assert loader.calls == 2
+    assert snapshot.etag != etag
+    assert [op["id"] for op in snapshot.list(skip=1, limit=10)] == [2]
+
+
+def test_catalog_add_applies_local_writes():
+    loader = CountingLoader([{"id": 1, "type": "addition", "cost": 1.0}])
+    catalog = OperationCatalog(loader=loader, ttl=60)
+    etag = asyncio.run(catalog.snapshot(None)).etag
+    catalog.add({"id": 12, "type": "division", "cost": 3.0})
+    assert asyncio.run(catalog.get(None, 12))["type"] == "division"
+    assert asyncio.run(catalog.snapshot(None)).etag != etag
+    assert loader.calls == 1
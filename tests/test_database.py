@@ -0,0 +1,102 @@
+import threading
+import time
+
+import pytest
+
+from app.database import ConnectionPool, PoolTimeout, worker_pool_size
+
+
+class FakeConnection:
+    def __init__(self):
+        self.alive = True
+        self.closed = False
+        self.in_transaction = False
+        self.rollbacks = 0
+
+    def is_connected(self):
+        return self.alive
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = True
+
+
+def make_pool(**kwargs):
+    return ConnectionPool({}, connect=lambda **config: FakeConnection(), **kwargs)
+
+
+def test_pool_reuses_idle_connections():
+    pool = make_pool(size=2)
+    connection = pool.acquire()
+    pool.release(connection)
+    assert pool.acquire() is connection
+    assert pool.stats()["created"] == 1
+
+
+def test_pool_times_out_when_exhausted():
+    pool = make_pool(size=1, timeout=0.05)
+    pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    stats = pool.stats()
+    assert stats["in_use"] == 1
+    assert stats["waits"] == 1
+    assert stats["timeouts"] == 1
+
+
+def test_pool_waiter_gets_released_connection():
+    pool = make_pool(size=1, timeout=2)
+    connection = pool.acquire()
+    threading.Timer(0.05, pool.release, args=(connection,)).start()
+    assert pool.acquire() is connection
+    assert pool.stats()["waits"] == 1
+
+
+def test_pool_replaces_dead_and_old_connections():
+    pool = make_pool(size=1, recycle=0.05)
+    connection = pool.acquire()
+    connection.alive = False
+    pool.release(connection)
+    replacement = pool.acquire()
+    assert replacement is not connection and connection.closed
+    pool.release(replacement)
+    time.sleep(0.06)
+    assert pool.acquire() is not replacement
+    assert pool.stats()["recycled"] == 1
+
+
+def test_pool_rolls_back_open_transactions_on_release():
+    pool = make_pool(size=1)
+    connection = pool.acquire()
+    connection.in_transaction = True
+    pool.release(connection)
+    assert connection.rollbacks == 1
+
+
+def test_pool_prefill_opens_idle_connections_up_to_size():
+    pool = make_pool(size=3)
+    busy = pool.acquire()
+    assert pool.prefill(2) == 1
+    assert pool.prefill() == 1
+    assert pool.prefill() == 0
+    assert pool.stats()["idle"] == 2 and pool.stats()["created"] == 3
+    pool.release(busy)
+
+
+def test_worker_pool_size_splits_the_connection_budget(monkeypatch):
+    monkeypatch.delenv("DB_POOL_SIZE", raising=False)
+    monkeypatch.delenv("DB_CONNECTION_BUDGET", raising=False)
+    assert worker_pool_size() == 5
+    monkeypatch.setenv("DB_CONNECTION_BUDGET", "40")
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    monkeypatch.setenv("WEB_DYNOS", "2")
+    assert worker_pool_size() == 5
+    monkeypatch.setenv("WRITE_BEHIND_ENABLED", "true")
+    assert worker_pool_size() == 3
+    monkeypatch.setenv("WEB_DYNOS", "20")
+    assert worker_pool_size() == 1
+    monkeypatch.setenv("DB_POOL_SIZE", "7")
+    assert worker_pool_size() == 7
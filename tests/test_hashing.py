@@ -0,0 +1,28 @@
+import asyncio
+
+from app.hashing import HasherBusy, PasswordHasher
+
+
+def test_hasher_verifies_and_rehashes_on_cost_change():
+    old_hasher = PasswordHasher(workers=1, rounds=4, executor="thread")
+    hasher = PasswordHasher(workers=1, rounds=5, executor="thread")
+    hashed = asyncio.run(old_hasher.hash("secret"))
+
+    valid, new_hash = asyncio.run(hasher.verify("secret", hashed))
+    assert valid
+    assert new_hash.startswith("$2b$05$")
+    assert asyncio.run(hasher.verify("secret", new_hash)) == (True, None)
+    assert asyncio.run(hasher.verify("wrong", new_hash))[0] is False
+    assert hasher.stats()["rehashed"] == 1
+
+
+def test_hasher_sheds_load_beyond_queue_limit():
+    hasher = PasswordHasher(workers=1, max_queue=1, rounds=10, executor="thread")
+
+    async def burst():
+        return await asyncio.gather(*(hasher.hash("secret") for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(burst())
+    assert sum(isinstance(result, HasherBusy) for result in results) == 1
+    assert hasher.stats()["rejected"] == 1
+    assert hasher.stats()["in_flight"] == 0
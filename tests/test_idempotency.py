@@ -0,0 +1,51 @@
+import asyncio
+
+from app.idempotency import SingleFlight
+
+
+def test_concurrent_calls_share_one_result():
+    flight = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"id": len(calls)}
+
+    async def run():
+        results = await asyncio.gather(*(flight.run("key", work) for _ in range(5)))
+        later = await flight.run("key", work)
+        return results, later
+
+    results, later = asyncio.run(run())
+    assert [result for result, _ in results] == [{"id": 1}] * 5
+    assert [shared for _, shared in results] == [False, True, True, True, True]
+    # Once the first call is done the key runs again; replaying is the database's job.
+    assert later == ({"id": 2}, False)
+    assert flight.shared == 4 and flight.in_flight() == 0
+
+
+def test_waiters_get_the_first_call_error():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("Invalid operands")
+
+    async def run():
+        return await asyncio.gather(flight.run("key", fail), flight.run("key", fail), return_exceptions=True)
+
+    first, second = asyncio.run(run())
+    assert isinstance(first, ValueError) and second is first
+
+
+def test_different_keys_run_independently():
+    flight = SingleFlight()
+
+    async def run():
+        return await asyncio.gather(
+            flight.run((1, "a"), lambda: asyncio.sleep(0, result="a")),
+            flight.run((2, "a"), lambda: asyncio.sleep(0, result="b")),
+        )
+
+    assert asyncio.run(run()) == [("a", False), ("b", False)]
@@ -0,0 +1,62 @@
+import asyncio
+import threading
+
+import pytest
+
+from app import metrics
+from app.metrics import Counter, Histogram, timed_query
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("test_seconds", "Test latency.", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, "/a")
+    lines = histogram.render()
+    assert 'test_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{route="/a",le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{route="/a"} 3' in lines
+
+
+def test_counter_merges_per_thread_shards():
+    counter = Counter("test_total", "Test counter.", ("name",))
+
+    def work():
+        for _ in range(1000):
+            counter.inc("x")
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert 'test_total{name="x"} 4000' in counter.render()
+
+
+def test_timed_query_records_sync_and_async_calls():
+    @timed_query
+    def fetch_rows(connection):
+        return [1, 2, 3]
+
+    @timed_query
+    async def fetch_row(connection):
+        return {"id": 1}
+
+    fetch_rows(None)
+    asyncio.run(fetch_row(None))
+    rendered = metrics.render()
+    assert 'ntd_db_query_rows_total{function="fetch_rows"} 3' in rendered
+    assert 'ntd_db_query_rows_total{function="fetch_row"} 1' in rendered
+    assert 'ntd_db_query_seconds_count{function="fetch_row"} 1' in rendered
+
+
+def test_recording_is_skipped_when_disabled(monkeypatch):
+    monkeypatch.setattr(metrics, "_enabled", False)
+    counter = Counter("test_disabled_total", "Test counter.")
+    counter.inc()
+    assert counter.render() == ["# HELP test_disabled_total Test counter.", "# TYPE test_disabled_total counter"]
+
+
+@pytest.fixture(autouse=True)
+def enable_metrics(monkeypatch):
+    monkeypatch.setattr(metrics, "_enabled", True)
@@ -0,0 +1,53 @@
+from decimal import Decimal
+
+import pytest
+
+from app.calculator import Calculator, CalculatorConfig, register_builtin_operations
+
+
+def make_calculator(mode: str = "float", **config) -> Calculator:
+    return register_builtin_operations(Calculator(CalculatorConfig(mode=mode, **config), memo_size=16))
+
+
+def test_default_operands_keep_legacy_results():
+    calculator = make_calculator()
+    assert calculator.evaluate("addition") == "2"
+    assert calculator.evaluate("subtraction") == "0"
+    assert calculator.evaluate("division") == "1.0"
+    assert calculator.evaluate("square_root") == "1.0"
+
+
+def test_operands_in_float_and_decimal_mode():
+    assert make_calculator().evaluate("addition", [Decimal("0.1"), Decimal("0.2")]) == str(0.1 + 0.2)
+    calculator = make_calculator("decimal", precision=50)
+    assert calculator.evaluate("addition", [Decimal("0.1"), Decimal("0.2")]) == "0.3"
+    assert calculator.evaluate("division", [Decimal(1), Decimal(3)]) == "0." + "3" * 50
+    assert calculator.evaluate("power", [Decimal(2), Decimal(100)]) == str(2 ** 100)
+
+
+def test_deterministic_results_are_memoized():
+    calculator = make_calculator()
+    calculator.evaluate("multiplication", [Decimal(6), Decimal(7)])
+    assert calculator.evaluate("multiplication", [Decimal(6), Decimal(7)]) == "42"
+    assert calculator.memo.stats()["hits"] == 1
+
+
+@pytest.mark.parametrize("operation_type, operands, message", [
+    ("unknown", None, "Invalid operation type"),
+    ("addition", [Decimal(1)], "takes 2 operand"),
+    ("division", [Decimal(1), Decimal(0)], "Division by zero"),
+    ("square_root", [Decimal(-1)], "negative"),
+    ("addition", [Decimal("1" * 101), Decimal(1)], "digits"),
+    ("addition", [Decimal("1e5000"), Decimal(1)], "exponents"),
+    ("power", [Decimal(2), Decimal(10 ** 6)], "Exponents are limited"),
+    ("power", [Decimal(10 ** 50), Decimal(1000)], "Results are limited"),
+    ("power", [Decimal(2), Decimal("0.5")], "integer"),
+])
+def test_rejects_invalid_and_pathological_operands(operation_type, operands, message):
+    for mode in ("float", "decimal"):
+        with pytest.raises(ValueError, match=message):
+            make_calculator(mode).evaluate(operation_type, operands)
+
+
+def test_precision_is_capped():
+    assert make_calculator("decimal", precision=10 ** 9, max_precision=100).config.precision == 100
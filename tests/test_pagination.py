@@ -0,0 +1,20 @@
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from app.pagination import encode_cursor, decode_cursor
+
+
+def test_cursor_round_trip():
+    record = {"id": 7, "created_at": datetime(2024, 6, 30, 21, 57, 47), "amount": Decimal("1.50")}
+    assert decode_cursor(encode_cursor(record, "-created_at"), "-created_at") == (record["created_at"], 7)
+    assert decode_cursor(encode_cursor(record, "amount"), "amount") == (Decimal("1.50"), 7)
+
+
+def test_cursor_must_match_sort():
+    record = {"id": 7, "created_at": datetime(2024, 6, 30, 21, 57, 47), "amount": Decimal("1.50")}
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor(record, "amount"), "created_at")
+    with pytest.raises(ValueError):
+        decode_cursor("garbage", "created_at")
@@ -0,0 +1,91 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from app.random_strings import RandomStringBuffer, RandomStringUnavailable
+
+
+class FakeRandomOrg(BaseHTTPRequestHandler):
+    delay = 0.0
+    requests = []
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        FakeRandomOrg.requests.append(query)
+        time.sleep(FakeRandomOrg.delay)
+        count = int(query["num"][0])
+        body = "\n".join(f"s{i:07d}" for i in range(count)).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_random_org():
+    FakeRandomOrg.delay = 0.0
+    FakeRandomOrg.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeRandomOrg)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/strings/"
+    server.shutdown()
+    server.server_close()
+
+
+def test_buffer_fetches_in_batches(fake_random_org):
+    buffer = RandomStringBuffer(url=fake_random_org, batch_size=50, low_water=5, max_wait=2)
+    strings = [buffer.get() for _ in range(10)]
+    assert strings[0] == "s0000000"
+    assert len(set(strings)) == 10
+    assert len(FakeRandomOrg.requests) == 1
+    assert FakeRandomOrg.requests[0]["num"] == ["50"]
+    stats = buffer.stats()
+    assert stats["hits"] == 10 and stats["misses"] == 0
+    buffer.close()
+
+
+def test_buffer_refills_at_low_water_mark(fake_random_org):
+    buffer = RandomStringBuffer(url=fake_random_org, batch_size=10, low_water=5, max_wait=2)
+    buffer.take(6)
+    deadline = time.monotonic() + 2
+    while buffer.stats()["refills"] < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert buffer.stats()["buffered"] == 14
+    buffer.close()
+
+
+def test_buffer_falls_back_when_upstream_is_slow(fake_random_org):
+    FakeRandomOrg.delay = 0.5
+    buffer = RandomStringBuffer(url=fake_random_org, batch_size=10, max_wait=0.05)
+    value = buffer.get()
+    assert len(value) == 8 and value.isalnum()
+    assert buffer.stats()["fallbacks"] == 1
+    buffer.close()
+
+
+def test_buffer_raises_without_fallback():
+    buffer = RandomStringBuffer(url="http://127.0.0.1:9/strings/", timeout=0.5, max_wait=1, fallback=False)
+    with pytest.raises(RandomStringUnavailable):
+        buffer.get()
+    assert buffer.stats()["refill_errors"] == 1
+    buffer.close()
+
+
+def test_unexpected_refill_errors_do_not_stop_refills(fake_random_org, monkeypatch):
+    buffer = RandomStringBuffer(url=fake_random_org, batch_size=10, timeout=0.05, max_wait=1, fallback=False)
+    fetch_batch = buffer.fetch_batch
+    monkeypatch.setattr(buffer, "fetch_batch", lambda: [][0])
+    with pytest.raises(RandomStringUnavailable):
+        buffer.get()
+    assert buffer.stats()["refill_errors"] == 1
+    monkeypatch.setattr(buffer, "fetch_batch", fetch_batch)
+    time.sleep(0.06)
+    assert buffer.get() == "s0000000"
+    buffer.close()
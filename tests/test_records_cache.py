@@ -0,0 +1,78 @@
+import asyncio
+
+from app.records_cache import RecordsCache, SharedGenerations
+
+
+class FakeRedis:
+    """In-memory stand-in for the two Redis commands the cache uses."""
+
+    def __init__(self):
+        self.data = {}
+        self.fail = False
+
+    async def get(self, key):
+        if self.fail:
+            raise ConnectionError("redis is down")
+        return self.data.get(key)
+
+    async def incr(self, key):
+        if self.fail:
+            raise ConnectionError("redis is down")
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+
+
+def make_loader(pages: list):
+    async def load():
+        pages.append(len(pages))
+        return [{"id": len(pages)}], None
+    return load
+
+
+def test_pages_are_cached_until_the_user_is_invalidated():
+    cache = RecordsCache(maxsize=10, ttl=60, enabled=True)
+    loads = []
+
+    async def run():
+        first = await cache.get_or_load(1, (0, 10, None, "created_at"), make_loader(loads))
+        again = await cache.get_or_load(1, (0, 10, None, "created_at"), make_loader(loads))
+        await cache.get_or_load(2, (0, 10, None, "created_at"), make_loader(loads))
+        await cache.invalidate(1)
+        fresh = await cache.get_or_load(1, (0, 10, None, "created_at"), make_loader(loads))
+        return first, again, fresh
+
+    first, again, fresh = asyncio.run(run())
+    assert first == again and fresh != first
+    assert len(loads) == 3
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["invalidations"]) == (1, 3, 1)
+
+
+def test_shared_generations_invalidate_every_worker():
+    redis = FakeRedis()
+    worker_a = RecordsCache(maxsize=10, ttl=60, generations=SharedGenerations(redis), enabled=True)
+    worker_b = RecordsCache(maxsize=10, ttl=60, generations=SharedGenerations(redis), enabled=True)
+    loads = []
+
+    async def run():
+        await worker_b.get_or_load(1, (0, 10, None, "created_at"), make_loader(loads))
+        await worker_a.invalidate(1)
+        await worker_b.get_or_load(1, (0, 10, None, "created_at"), make_loader(loads))
+
+    asyncio.run(run())
+    assert len(loads) == 2
+
+
+def test_cache_is_bypassed_when_the_shared_store_fails():
+    redis = FakeRedis()
+    cache = RecordsCache(maxsize=10, ttl=60, generations=SharedGenerations(redis), enabled=True)
+    loads = []
+    redis.fail = True
+
+    async def run():
+        for _ in range(2):
+            await cache.get_or_load(1, (0, 10, None, "created_at"), make_loader(loads))
+
+    asyncio.run(run())
+    assert len(loads) == 2
+    assert cache.stats()["errors"] == 2
@@ -0,0 +1,153 @@
+import asyncio
+
+import mysql.connector
+import pytest
+
+from app import crud, dal, replicas
+from app.replicas import Replica, ReplicaSet, SharedStickiness, begin_request, reads, set_request_user
+
+
+class FakeConnection:
+    def __init__(self, name):
+        self.name = name
+
+
+class FakePool:
+    """In-process stand-in for a replica's connection pool."""
+
+    def __init__(self, name):
+        self.name = name
+        self.released = 0
+
+    def acquire(self):
+        return FakeConnection(self.name)
+
+    def release(self, connection):
+        self.released += 1
+
+    def stats(self):
+        return {}
+
+
+@pytest.fixture
+def replica_set(monkeypatch):
+    lags = {"replica-1": 0.0}
+    replica_set = ReplicaSet(
+        [Replica("replica-1", {}, FakePool("replica-1"))], max_lag=2, sticky_seconds=60,
+        probe=lambda replica: lags[replica.name]
+    )
+    replica_set.lags = lags
+    replica_set.check()
+    monkeypatch.setattr(replicas, "_replica_set", replica_set)
+    monkeypatch.setattr(replicas, "_replica_set_loaded", True)
+    monkeypatch.setattr(dal, "_async_driver", False)
+
+    @reads
+    def get_records(connection, **filters):
+        if getattr(connection, "fail", False):
+            raise mysql.connector.errors.OperationalError("Lost connection to MySQL server")
+        return connection.name
+
+    def create_operation(connection, operation):
+        return connection.name
+
+    monkeypatch.setattr(crud, "get_records", get_records)
+    monkeypatch.setattr(crud, "create_operation", create_operation)
+    return replica_set
+
+
+def request(user_id, *calls):
+    # Runs dal calls the way one request would and returns where each ran.
+    async def run():
+        routing = begin_request(FakeConnection("primary"))
+        set_request_user(user_id)
+        try:
+            return [await dal.run(name, routing.primary, **kwargs) for name, kwargs in calls]
+        finally:
+            await dal.release_replica(routing)
+    return asyncio.run(run())
+
+
+def test_reads_go_to_a_healthy_replica_and_writes_to_the_primary(replica_set):
+    assert request(1, ("get_records", {}), ("get_records", {})) == ["replica-1", "replica-1"]
+    assert request(2, ("create_operation", {"operation": None})) == ["primary"]
+    assert replica_set.routed == 2
+    assert replica_set.replicas[0].pool.released == 1
+
+
+def test_users_read_their_own_writes(replica_set):
+    assert request(1, ("get_records", {}), ("create_operation", {"operation": None}), ("get_records", {})) == [
+        "replica-1", "primary", "primary"
+    ]
+    # The next request of the same user stays on the primary; other users do not.
+    assert request(1, ("get_records", {})) == ["primary"]
+    assert request(2, ("get_records", {})) == ["replica-1"]
+
+
+class FakeRedis:
+    """Just enough of redis.asyncio for SharedStickiness; ``down`` makes it fail."""
+
+    def __init__(self):
+        self.keys = {}
+        self.down = False
+
+    async def set(self, key, value, px):
+        if self.down:
+            raise ConnectionError("Redis is down")
+        self.keys[key] = value
+
+    async def exists(self, key):
+        if self.down:
+            raise ConnectionError("Redis is down")
+        return int(key in self.keys)
+
+
+def test_stickiness_is_shared_between_workers(replica_set, monkeypatch):
+    redis = FakeRedis()
+    replica_set._shared = SharedStickiness(redis)
+    assert request(1, ("create_operation", {"operation": None})) == ["primary"]
+    # Another worker: same replica, its own local window.
+    other = ReplicaSet(
+        replica_set.replicas, max_lag=2, sticky_seconds=60, probe=lambda replica: 0.0, shared=SharedStickiness(redis)
+    )
+    monkeypatch.setattr(replicas, "_replica_set", other)
+    assert request(1, ("get_records", {})) == ["primary"]
+    assert request(2, ("get_records", {})) == ["replica-1"]
+    # Without Redis nobody can tell, so reads stay on the primary.
+    redis.down = True
+    assert request(2, ("get_records", {})) == ["primary"]
+    assert other.stats()["sticky_errors"] == 1
+
+
+def test_lagging_replicas_fail_over_to_the_primary(replica_set):
+    replica_set.lags["replica-1"] = 30.0
+    replica_set.check()
+    assert not replica_set.replicas[0].healthy
+    assert request(1, ("get_records", {})) == ["primary"]
+    assert replica_set.fallbacks == 1
+
+    replica_set.lags["replica-1"] = None
+    replica_set.check()
+    assert replica_set.replicas[0].last_error == "Replication is not running"
+
+    replica_set.lags["replica-1"] = 0.5
+    replica_set.check()
+    assert request(1, ("get_records", {})) == ["replica-1"]
+
+
+def test_failed_replica_reads_are_retried_on_the_primary(replica_set, monkeypatch):
+    pool = replica_set.replicas[0].pool
+    monkeypatch.setattr(pool, "acquire", lambda: type("Broken", (FakeConnection,), {"fail": True})("replica-1"))
+    assert request(1, ("get_records", {}), ("get_records", {})) == ["primary", "primary"]
+    assert not replica_set.replicas[0].healthy
+    assert pool.released == 1
+
+
+def test_unreachable_replicas_are_marked_down():
+    def probe(replica):
+        raise mysql.connector.errors.InterfaceError("Can't connect to MySQL server")
+
+    replica_set = ReplicaSet([Replica("replica-1", {})], probe=probe)
+    replica_set.check()
+    assert replica_set.choose() is None
+    assert replica_set.stats()["healthy"] == 0
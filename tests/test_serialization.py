@@ -0,0 +1,44 @@
+import json
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+
+from app import schemas, serialization
+from app.serialization import OPERATION, RECORD, STORED_RECORD, FastJSONResponse
+
+ROW = {
+    "id": 7, "operation_id": 2, "user_id": 3, "amount": Decimal("1.50"), "user_balance": Decimal("98.25"),
+    "operation_response": "5", "created_at": datetime(2024, 1, 2, 3, 4, 5, 678000), "deleted": 1,
+}
+
+
+def through_pydantic(model, row: dict):
+    return json.loads(json.dumps(jsonable_encoder(model(**row))))
+
+
+@pytest.fixture(params=["orjson", "json"])
+def encoder(request, monkeypatch):
+    if request.param == "json":
+        monkeypatch.setattr(serialization, "orjson", None)
+    elif serialization.orjson is None:
+        pytest.skip("orjson is not installed")
+
+
+def test_serializers_match_the_response_models(encoder):
+    assert json.loads(STORED_RECORD.dumps(ROW)) == through_pydantic(schemas.StoredRecord, ROW)
+    assert json.loads(RECORD.dumps(ROW)) == through_pydantic(schemas.Record, ROW)
+    # Fields the row lacks take the model's default.
+    row = dict(ROW, created_at=None)
+    del row["deleted"]
+    assert json.loads(STORED_RECORD.dumps(row)) == through_pydantic(schemas.StoredRecord, row)
+
+    operations = [{"id": 1, "type": "addition", "cost": Decimal("0.10")}, {"id": 2, "type": "random_string", "cost": 2}]
+    assert json.loads(OPERATION.dumps_many(operations)) == [through_pydantic(schemas.Operation, op) for op in operations]
+
+
+def test_response_passes_encoded_bodies_through(encoder):
+    body = STORED_RECORD.dumps_many([ROW])
+    assert FastJSONResponse(body).body == body
+    assert json.loads(FastJSONResponse({"detail": "ünïcode"}).body) == {"detail": "ünïcode"}
@@ -0,0 +1,62 @@
+from app.slow_queries import SlowQueryLog, normalize_sql, params_shape
+
+
+class FakeCursor:
+    def __init__(self, connection, **kwargs):
+        self.connection = connection
+        self.kwargs = kwargs
+        self.rowcount = 1
+
+    def execute(self, operation, params=None):
+        self.connection.statements.append((operation, params, self.kwargs))
+
+    def fetchall(self):
+        return [dict(self.connection.plan)]
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, plan: dict):
+        self.plan = plan
+        self.statements = []
+
+    def cursor(self, **kwargs):
+        return FakeCursor(self, **kwargs)
+
+
+def test_disabled_log_hands_out_plain_cursors():
+    connection = FakeConnection({"table": "records", "type": "ref"})
+    cursor = SlowQueryLog(enabled=False, fail_on_full_scan=False).cursor(connection, dictionary=True)
+    assert isinstance(cursor, FakeCursor) and cursor.kwargs == {"dictionary": True}
+
+
+def test_slow_statements_are_recorded_with_plan():
+    connection = FakeConnection({"table": "records", "type": "ref"})
+    log = SlowQueryLog(enabled=True, threshold=0, explain=True, size=2, fail_on_full_scan=False)
+    cursor = log.cursor(connection)
+    for user_id in (1, 2, 3):
+        cursor.execute("SELECT *\n  FROM records WHERE user_id = %s", (user_id,))
+    assert cursor.rowcount == 1
+    assert connection.statements[1][0] == "EXPLAIN SELECT *\n  FROM records WHERE user_id = %s"
+    entries = log.entries()
+    assert len(entries) == 2 and log.recorded == 3
+    assert entries[0]["sql"] == "SELECT * FROM records WHERE user_id = %s"
+    assert entries[0]["params"] == ["int"]
+    assert entries[0]["plan"] == [{"table": "records", "type": "ref"}]
+
+
+def test_full_scans_are_collected_outside_the_allow_list():
+    log = SlowQueryLog(enabled=False, explain=False, fail_on_full_scan=True, full_scan_allow={"operations"})
+    log.cursor(FakeConnection({"table": "operations", "type": "ALL"})).execute("SELECT * FROM operations")
+    log.cursor(FakeConnection({"table": "records", "type": "ALL"})).execute("UPDATE records SET deleted = TRUE")
+    log.cursor(FakeConnection({"table": "records", "type": "ALL"})).execute("INSERT INTO records VALUES (%s)", (1,))
+    assert log.full_scans == [{"sql": "UPDATE records SET deleted = TRUE", "tables": ["records"]}]
+    assert log.entries() == []
+
+
+def test_normalize_sql_and_params_shape():
+    assert normalize_sql("INSERT INTO t VALUES (%s, %s), (%s, %s), (%s, %s)") == "INSERT INTO t VALUES (%s, %s), ..."
+    assert params_shape(("a", 1, None)) == ["str", "int", "NoneType"]
+    assert params_shape(tuple(range(12)))[-1] == "... 12 total"
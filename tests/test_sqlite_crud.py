@@ -0,0 +1,170 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app import async_crud, crud, dal, database, sqlite_crud
+from app.crud import RecordIdConflict
+from app.idempotency import IdempotencyKeyReused
+from app.consts import Status
+from app.schemas import OperationCreate, UserCreate
+from app.sqlite_database import create_sqlite_pool
+from archive_records import COLUMNS
+
+
+@pytest.fixture
+def connection():
+    pool = create_sqlite_pool(":memory:")
+    connection = pool.acquire()
+    yield connection
+    pool.release(connection)
+    pool.close()
+
+
+def public_functions(module) -> dict:
+    return {
+        name: getattr(func, "intent", None) for name, func in vars(module).items()
+        if callable(func) and getattr(func, "__module__", None) == module.__name__ and hasattr(func, "intent")
+    }
+
+
+def seed(connection, balance: float = 100.0) -> tuple:
+    user = sqlite_crud.create_user(connection, UserCreate(username="ada", password="x"), "hash", Status.ACTIVE)
+    sqlite_crud.update_user_balance(connection, user["id"], balance)
+    operation_id = sqlite_crud.create_operation(connection, OperationCreate(type="addition", cost=1.5))
+    return user["id"], operation_id
+
+
+def test_backends_implement_the_same_functions():
+    functions = public_functions(crud)
+    assert "get_records" in functions
+    assert public_functions(sqlite_crud) == functions
+    # Write-behind flushes through the sync functions on either MySQL driver.
+    assert public_functions(async_crud).items() <= functions.items()
+
+
+def test_charges_debit_the_balance_and_track_usage(connection):
+    user_id, operation_id = seed(connection, balance=10)
+    record = sqlite_crud.create_charged_record(connection, user_id, operation_id, 1.5, "3")
+    items = [(operation_id, 1.5, "4"), (operation_id, 1.5, "5")]
+    records = sqlite_crud.create_charged_records(connection, user_id, items)
+    assert [r["id"] for r in records] == [record["id"] + 1, record["id"] + 2]
+    assert [r["user_balance"] for r in records] == [7.0, 5.5]
+    assert sqlite_crud.create_charged_records(connection, user_id, [(operation_id, 6.0, "6")]) is None
+    # Free operations still need a user to charge.
+    assert sqlite_crud.create_charged_record(connection, user_id + 1, operation_id, 0, "0") is None
+
+    page = sqlite_crud.get_records(connection, user_id=user_id, sort="amount", limit=2)
+    assert [row["operation_response"] for row in page] == ["3", "4"]
+    assert page[0]["deleted"] is False
+    assert [row["id"] for row in sqlite_crud.get_records(connection, user_id=user_id, search="5")] == [records[1]["id"]]
+    assert sqlite_crud.get_records(connection, user_id=user_id, search="nothing") == []
+
+    deleted = sqlite_crud.soft_delete_record(connection, record["id"])
+    assert deleted["deleted"] is True
+    [usage] = sqlite_crud.get_user_usage(connection, user_id)
+    assert usage["calls"] == 2 and float(usage["total_amount"]) == 3.0
+    assert sqlite_crud.get_user_by_id(connection, user_id)["balance"] == 5.5
+
+
+def test_archived_records_are_listed_on_request(connection):
+    user_id, operation_id = seed(connection)
+    records = sqlite_crud.create_charged_records(connection, user_id, [(operation_id, 1.5, str(n)) for n in range(3)])
+    ids = [record["id"] for record in records]
+    # What archive_records.py does on MySQL.
+    connection.execute(f"INSERT INTO records_archive ({COLUMNS}) SELECT {COLUMNS} FROM records WHERE id = ?", (ids[0],))
+    connection.execute("DELETE FROM records WHERE id = ?", (ids[0],))
+    connection.commit()
+
+    assert [row["id"] for row in sqlite_crud.get_records(connection, user_id=user_id)] == ids[1:]
+    rows = sqlite_crud.get_records(connection, user_id=user_id, include_archived=True)
+    assert [row["id"] for row in rows] == ids
+    rows = sqlite_crud.get_records(connection, user_id=user_id, include_archived=True, sort="-amount", skip=1, limit=1)
+    assert [row["id"] for row in rows] == [ids[1]]
+
+
+def test_idempotency_keys_replay_the_stored_record(connection):
+    user_id, operation_id = seed(connection)
+    assert sqlite_crud.claim_idempotency_key(connection, user_id, "key-1", ttl=60) is None
+    record = sqlite_crud.create_charged_record(connection, user_id, operation_id, 1.5, "3", idempotency_key="key-1")
+    assert sqlite_crud.claim_idempotency_key(connection, user_id, "key-1", ttl=60)["id"] == record["id"]
+
+    # Keys are tied to the request they were first used with.
+    assert sqlite_crud.claim_idempotency_key(connection, user_id, "key-2", ttl=60, request_hash="a") is None
+    sqlite_crud.create_charged_record(connection, user_id, operation_id, 1.5, "4", idempotency_key="key-2")
+    assert sqlite_crud.claim_idempotency_key(connection, user_id, "key-2", ttl=60, request_hash="a")["id"]
+    with pytest.raises(IdempotencyKeyReused):
+        sqlite_crud.claim_idempotency_key(connection, user_id, "key-2", ttl=60, request_hash="b")
+
+    # Expired keys are claimed again, then purged.
+    assert sqlite_crud.claim_idempotency_key(connection, user_id, "key-1", ttl=-60) is None
+    connection.commit()
+    assert sqlite_crud.purge_idempotency_keys(connection, ttl=-60, batch_size=1) == 2
+
+
+def test_write_behind_inserts_are_repeatable(connection):
+    user_id, operation_id = seed(connection)
+    first = sqlite_crud.reserve_record_ids(connection, 3)
+    assert sqlite_crud.reserve_record_ids(connection, 3) == first + 3
+    records = sqlite_crud.charge_records(connection, user_id, [(operation_id, 1.5, "3")], ids=[first])
+    sqlite_crud.insert_records(connection, records)
+    sqlite_crud.insert_records(connection, records)
+    assert [row["id"] for row in sqlite_crud.get_records(connection, user_id=user_id)] == [first]
+
+    # Inserts without an id (write-behind off) skip the reserved blocks, and
+    # a reserved id holding another record fails loudly.
+    record = sqlite_crud.create_charged_record(connection, user_id, operation_id, 1.5, "4")
+    assert record["id"] >= first + 6
+    clash = dict(records[0], id=record["id"])
+    with pytest.raises(RecordIdConflict):
+        sqlite_crud.insert_records(connection, [clash])
+    # After a switch back on, blocks start past the plain inserts.
+    assert sqlite_crud.reserve_record_ids(connection, 3) > record["id"]
+
+
+@pytest.fixture
+def sqlite_app(monkeypatch):
+    from app.auth import user_cache
+    from app.catalog import operation_catalog
+    from app.main import app
+    from app.records_cache import get_records_cache
+
+    pool = create_sqlite_pool(":memory:")
+    monkeypatch.setattr(dal, "_backend", "sqlite")
+    monkeypatch.setattr(dal, "_async_driver", False)
+    monkeypatch.setattr(database, "_pool", pool)
+    yield app
+    pool.close()
+    # Per-worker caches hold this database's ids.
+    user_cache.clear()
+    operation_catalog.invalidate()
+    get_records_cache().clear()
+
+
+def test_api_runs_on_sqlite(sqlite_app):
+    client = TestClient(sqlite_app)
+
+    assert client.post("/api/v1/users/", json={"username": "grace", "password": "secret"}).status_code == 200
+    token = client.post("/api/v1/token", data={"username": "grace", "password": "secret"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    operation = client.post("/api/v1/operations/", json={"type": "addition", "cost": 2.0}).json()
+
+    response = client.post(
+        "/api/v1/calculate/", json={"operation_id": operation["id"], "operands": ["2", "3"]}, headers=headers
+    )
+    assert response.status_code == 200, response.text
+    assert response.json()["user_balance"] == 98.0
+    replay_headers = dict(headers, **{"Idempotency-Key": "key-1"})
+    body = {"operation_id": operation["id"], "operands": ["2", "2"]}
+    first = client.post("/api/v1/calculate/", json=body, headers=replay_headers)
+    replay = client.post("/api/v1/calculate/", json=body, headers=replay_headers)
+    assert replay.json() == first.json() and replay.headers["Idempotent-Replayed"] == "true"
+    reused = client.post("/api/v1/calculate/", json=dict(body, operands=["2", "9"]), headers=replay_headers)
+    assert reused.status_code == 422
+    records = client.get("/api/v1/records/?limit=1", headers=headers)
+    assert [record["operation_response"] for record in records.json()] == ["5"]
+    assert records.json()[0]["deleted"] is False and "X-Next-Cursor" in records.headers
+
+
+def test_non_ascii_tokens_are_rejected_not_crashed_on(sqlite_app):
+    client = TestClient(sqlite_app)
+    assert client.get("/api/v1/records/", headers={"Authorization": "Bearer a.é"}).status_code == 401
+    assert client.post("/api/v1/token/refresh", json={"refresh_token": "a.é"}).status_code == 401
@@ -0,0 +1,40 @@
+import pytest
+
+from app import tokens
+from app.tokens import ACCESS, REFRESH, InvalidToken, create_token, decode_token
+
+USER = {"id": 1, "username": "testuser", "status": "active"}
+
+
+def test_token_round_trip():
+    claims = decode_token(create_token(USER, ACCESS, 60), ACCESS)
+    assert claims["sub"] == 1
+    assert claims["name"] == "testuser"
+    assert claims["st"] == "active"
+
+
+def test_token_rejects_tampering_expiry_and_wrong_type():
+    token = create_token(USER, ACCESS, 60)
+    payload, signature = token.split(".")
+    forged = create_token(dict(USER, id=2), ACCESS, 60).split(".")[0]
+    with pytest.raises(InvalidToken):
+        decode_token(f"{forged}.{signature}", ACCESS)
+    with pytest.raises(InvalidToken):
+        decode_token(create_token(USER, ACCESS, -1), ACCESS)
+    with pytest.raises(InvalidToken):
+        decode_token(token, REFRESH)
+    with pytest.raises(InvalidToken):
+        decode_token("testuser", ACCESS)
+    with pytest.raises(InvalidToken):
+        decode_token("a.é", ACCESS)
+
+
+def test_missing_or_placeholder_key_stops_production_workers(monkeypatch):
+    monkeypatch.setattr(tokens, "_secret_key", None)
+    monkeypatch.setenv("AUTH_SECRET_KEY", "change-me-in-production")
+    monkeypatch.setenv("DYNO", "web.1")
+    with pytest.raises(RuntimeError):
+        tokens.get_secret_key()
+    monkeypatch.delenv("DYNO")
+    # Elsewhere a random per-process key stands in.
+    assert len(tokens.get_secret_key()) >= 32
@@ -0,0 +1,65 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from app import warmup
+from app.warmup import Readiness, warm_up
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 10.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_warm_up_times_each_step_and_survives_optional_failures():
+    clock = FakeClock()
+    readiness = Readiness(started_at=9.5, clock=clock)
+    clock.now = 10.0
+    readiness.mark("imports")
+
+    async def fast():
+        clock.now += 0.25
+
+    async def broken():
+        clock.now += 0.5
+        raise RuntimeError("bcrypt worker died")
+
+    assert not readiness.ready
+    asyncio.run(warm_up(readiness, (("db_pool", fast, True), ("hot_paths", broken, False))))
+    assert readiness.ready
+    stats = readiness.stats()
+    assert stats["imports_ms"] == 500.0 and stats["db_pool_ms"] == 250.0 and stats["hot_paths_ms"] == 500.0
+    assert stats["total_ms"] == 1250.0
+    assert stats["errors"] == {"hot_paths": "bcrypt worker died"}
+
+
+def test_required_steps_are_retried_before_ready():
+    readiness = Readiness()
+    attempts = []
+
+    async def flaky():
+        attempts.append(readiness.ready)
+        if len(attempts) < 3:
+            raise RuntimeError("database down")
+        assert readiness.errors == {"db_pool": "database down"}
+
+    asyncio.run(warm_up(readiness, (("db_pool", flaky, True),), retry_interval=0))
+    assert attempts == [False, False, False]
+    assert readiness.ready and "errors" not in readiness.stats()
+
+
+def test_ready_is_unavailable_until_warmed_up(monkeypatch):
+    from app.main import app
+
+    readiness = Readiness()
+    monkeypatch.setattr(warmup, "readiness", readiness)
+    monkeypatch.setattr("app.main.readiness", readiness)
+    client = TestClient(app)
+    response = client.get("/ready")
+    assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+    asyncio.run(warm_up(readiness, ()))
+    response = client.get("/ready")
+    assert response.status_code == 200 and response.json()["ready"] is True
@@ -0,0 +1,154 @@
+import os
+import threading
+
+import pytest
+
+from app.write_behind import IdBlockAllocator, WriteBehindFull, WriteBehindQueue
+
+
+class FakeTable:
+    """Stands in for the records table: rows by id, duplicates skipped."""
+
+    def __init__(self):
+        self.rows = {}
+        self.inserts = []
+        self.down = False
+        self.bad_users = set()
+        self.next_id = 1
+        self.lock = threading.Lock()
+
+    def insert(self, records):
+        if self.down:
+            raise ConnectionError("database is down")
+        if any(record["user_id"] in self.bad_users for record in records):
+            raise ValueError("foreign key check failed")
+        self.inserts.append(len(records))
+        for record in records:
+            self.rows.setdefault(record["id"], record)
+
+    def reserve(self, count):
+        with self.lock:
+            first = self.next_id
+            self.next_id += count
+            return first
+
+
+def make_queue(table, wal_dir, **kwargs):
+    queue = WriteBehindQueue(
+        insert=table.insert, allocator=IdBlockAllocator(table.reserve, block_size=4), wal_dir=str(wal_dir),
+        retry_delay=0.01, **kwargs
+    )
+    queue.start()
+    return queue
+
+
+def record(n):
+    return {"operation_id": 1, "user_id": n % 2 + 1, "amount": 1.0, "user_balance": 100 - n, "operation_response": "2"}
+
+
+def test_ids_come_from_reserved_blocks():
+    table = FakeTable()
+    allocator = IdBlockAllocator(table.reserve, block_size=4)
+    assert allocator.allocate(3) == [1, 2, 3]
+    assert allocator.allocate(3) == [4, 5, 6]
+    assert allocator.blocks == 2
+
+
+def test_records_are_flushed_in_groups(tmp_path):
+    table = FakeTable()
+    flushed_users = []
+    queue = make_queue(table, tmp_path, interval=0.05, max_rows=3, on_flush=flushed_users.append)
+    try:
+        submitted = queue.submit([record(n) for n in range(7)])
+        assert [r["id"] for r in submitted] == list(range(1, 8))
+        assert queue.drain(timeout=5)
+    finally:
+        queue.close()
+    assert table.inserts == [3, 3, 1]
+    assert sorted(table.rows) == list(range(1, 8))
+    assert flushed_users[0] == {1, 2}
+    # A drained, closed queue leaves no log behind.
+    assert os.listdir(tmp_path) == []
+
+
+def test_log_is_replayed_after_a_crash(tmp_path):
+    table = FakeTable()
+    table.down = True
+    crashed = make_queue(table, tmp_path, interval=0.01)
+    submitted = crashed.submit([record(n) for n in range(5)])
+    crashed.close(timeout=0.1)
+    assert crashed.stats()["queued"] == 5 and table.rows == {}
+    assert len(os.listdir(tmp_path)) == 1
+
+    table.down = False
+    # Pretend the first records made it in before the crash.
+    table.rows[1] = submitted[0]
+    restarted = make_queue(table, tmp_path, interval=0.01)
+    try:
+        assert restarted.drain(timeout=5)
+        assert restarted.stats()["replayed"] == 5
+    finally:
+        restarted.close()
+    assert sorted(table.rows) == [1, 2, 3, 4, 5]
+    assert table.rows[3]["user_balance"] == 98
+    assert os.listdir(tmp_path) == []
+
+
+def test_log_of_a_running_worker_is_not_replayed(tmp_path):
+    table = FakeTable()
+    table.down = True
+    running = make_queue(table, tmp_path, interval=0.01)
+    try:
+        running.submit([record(0)])
+        other = make_queue(table, tmp_path, interval=0.01)
+        assert other.stats()["replayed"] == 0
+        other.close()
+    finally:
+        running.close(timeout=0.1)
+
+
+def test_aborted_records_are_not_replayed(tmp_path):
+    table = FakeTable()
+    table.down = True
+    crashed = make_queue(table, tmp_path, interval=0.01)
+    committed = crashed.prepare([record(0)])
+    crashed.confirm(committed)
+    # The charge rolled back after its record was logged.
+    crashed.abort(crashed.prepare([record(1)]))
+    crashed.close(timeout=0.1)
+
+    table.down = False
+    restarted = make_queue(table, tmp_path, interval=0.01)
+    try:
+        assert restarted.drain(timeout=5)
+    finally:
+        restarted.close()
+    assert sorted(table.rows) == [committed[0]["id"]]
+
+
+def test_rows_rejected_for_their_content_are_quarantined(tmp_path):
+    table = FakeTable()
+    table.bad_users = {2}
+    queue = make_queue(table, tmp_path, interval=0.01, poison_errors=(ValueError,))
+    try:
+        queue.submit([record(n) for n in range(4)])
+        assert queue.drain(timeout=5)
+    finally:
+        queue.close()
+    assert sorted(row["user_id"] for row in table.rows.values()) == [1, 1]
+    assert queue.stats()["quarantined"] == 2
+    with open(tmp_path / "quarantine.jsonl") as f:
+        assert len(f.readlines()) == 2
+
+
+def test_full_queue_rejects_new_records(tmp_path):
+    table = FakeTable()
+    table.down = True
+    queue = make_queue(table, tmp_path, interval=0.01, max_queued=3)
+    try:
+        queue.submit([record(n) for n in range(3)])
+        with pytest.raises(WriteBehindFull):
+            queue.prepare([record(3)])
+        assert queue.stats()["rejected"] == 1
+    finally:
+        queue.close(timeout=0.1)